@@ -0,0 +1,409 @@
+"""Offline, population-scale footprint scoring.
+
+    python -m app.batch score --source csv --output parquet --output-path data/batch/scores
+    python -m app.batch score --source firestore --output firestore --workers 8 --resume
+
+Profiles are streamed in chunks from Firestore pages, a Firestore export (JSON lines) or
+the Carbon Emission CSV, scored across the CPU pool with the category models and their
+rule-based fallback, and written back with batched Firestore commits or as Parquet/CSV
+part files. A checkpoint is written after every chunk so an interrupted run resumes
+where it stopped.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .ml.carbon_model import CarbonFootprintModel
+from .ml.feature_schema import (
+    ANDROID_RANGE_VALUES, ANDROID_TO_DATASET, ANDROID_VALUE_ALIASES, DATASET_NUMERICAL_COLUMNS, FEATURE_SCHEMA
+)
+from .services.carbon_calculator import CarbonCalculator
+from .services.cpu_pool import CPUPool, WorkerContext, score_profiles_task
+from .services.data_loader import parse_list_literal
+from .services.dataset import DATASET_PATH
+from .services.footprint_writer import FIRESTORE_MAX_BATCH
+from .services.model_registry import ModelRegistry
+from .services.shared_state import SharedArrayStore
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet output is optional; CSV and Firestore outputs need nothing extra
+    pyarrow = None
+
+CHECKPOINT_FORMAT = 1
+
+
+def dataset_profiles(frame: pd.DataFrame, first_row: int = 0) -> List[Dict]:
+    """Dataset rows as Android profiles: the reverse of FeatureSchema.to_dataset_record.
+
+    Answers use the schema's canonical spelling (as the app sends them); values outside a
+    field's domain, such as hybrid vehicles, are kept as they are and score as unknown.
+    """
+    reverse_aliases = {column: {dataset: android for android, dataset in aliases.items()}
+                       for column, aliases in ANDROID_VALUE_ALIASES.items()}
+    # Numerical answers go back into the range whose midpoint is closest
+    ranges = {field: np.array([ANDROID_RANGE_VALUES[answer] for answer in FEATURE_SCHEMA.domains[field]])
+              for field, column in ANDROID_TO_DATASET.items() if column in DATASET_NUMERICAL_COLUMNS}
+    columns = {}
+    for field, column in ANDROID_TO_DATASET.items():
+        values = frame[column]
+        if field in ranges:
+            nearest = np.abs(values.to_numpy(dtype=float)[:, np.newaxis] - ranges[field]).argmin(axis=1)
+            columns[field] = np.array(FEATURE_SCHEMA.domains[field], dtype=object)[nearest]
+            continue
+        aliases = reverse_aliases.get(column, {})
+        answers = values.astype(object).where(values.notna(), None).map(lambda value: aliases.get(value, value))
+        if column in ('Recycling', 'Cooking_With'):
+            # Profiles hold one answer per list field, as the app sends them
+            answers = answers.map(lambda value: (parse_list_literal(value)[:1] or [value])[0])
+        columns[field] = answers.to_numpy(dtype=object)
+
+    records = pd.DataFrame(columns)
+    codes = FEATURE_SCHEMA.codes_many(records.to_dict("records"))
+    for i, field in enumerate(FEATURE_SCHEMA.fields):
+        known = codes[:, i] >= 0
+        canonical = records[field].to_numpy(dtype=object)
+        canonical[known] = np.array(FEATURE_SCHEMA.domains[field], dtype=object)[codes[known, i]]
+        records[field] = canonical
+    profiles = records.to_dict("records")
+    for i, profile in enumerate(profiles, start=first_row):
+        profile["userId"] = f"row-{i}"
+    return profiles
+
+
+def _firestore_client(credentials_path: Optional[str]):
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        path = credentials_path or os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "serviceAccountKey.json")
+        firebase_admin.initialize_app(credentials.Certificate(path))
+    return firestore.client()
+
+
+# Sources: each yields (profiles, last key) chunks, starting after what the checkpoint covers
+
+def read_csv(path: str, chunk_size: int, done: int, last_key: Optional[str]) -> Iterator[Tuple[List[Dict], str]]:
+    first_row = done
+    for frame in pd.read_csv(path, chunksize=chunk_size, skiprows=range(1, done + 1)):
+        profiles = dataset_profiles(frame, first_row)
+        first_row += len(profiles)
+        yield profiles, profiles[-1]["userId"]
+
+
+def read_export(path: str, chunk_size: int, done: int, last_key: Optional[str]) -> Iterator[Tuple[List[Dict], str]]:
+    """A Firestore export as JSON lines: one document per line, its id under "id" or "userId" """
+    chunk = []
+    with open(path) as f:
+        for line_number, line in enumerate(f):
+            if line_number < done or not line.strip():
+                continue
+            document = json.loads(line)
+            document.setdefault("userId", document.get("id", f"line-{line_number}"))
+            chunk.append(document)
+            if len(chunk) == chunk_size:
+                yield chunk, chunk[-1]["userId"]
+                chunk = []
+    if chunk:
+        yield chunk, chunk[-1]["userId"]
+
+
+def read_firestore(db, collection: str, chunk_size: int, done: int,
+                   last_key: Optional[str]) -> Iterator[Tuple[List[Dict], str]]:
+    """Pages of a collection in document-id order; a resumed run starts after last_key"""
+    collection_ref = db.collection(collection)
+    cursor = collection_ref.document(last_key).get() if last_key else None
+    while True:
+        query = collection_ref.order_by("__name__").limit(chunk_size)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        snapshots = list(query.stream())
+        if not snapshots:
+            return
+        chunk = []
+        for snapshot in snapshots:
+            document = snapshot.to_dict()
+            document.setdefault("userId", snapshot.id)
+            chunk.append(document)
+        cursor = snapshots[-1]
+        yield chunk, snapshots[-1].id
+        if len(snapshots) < chunk_size:
+            return
+
+
+# Sinks: write one scored chunk; parts are named so a resumed run never overwrites finished ones
+
+class PartFileSink:
+    def __init__(self, directory: str, file_format: str):
+        if file_format == "parquet" and pyarrow is None:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow); use --output csv instead")
+        self.directory = Path(directory)
+        self.file_format = file_format
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def clear(self):
+        for path in self.directory.glob(f"part-*.{self.file_format}"):
+            path.unlink()
+
+    def write(self, rows: List[Dict], part: int) -> str:
+        path = self.directory / f"part-{part:06d}.{self.file_format}"
+        frame = pd.DataFrame.from_records(rows)
+        # Written under a temporary name first, so a crash never leaves a half-written part behind
+        tmp = path.with_name(f".{path.name}.tmp")
+        if self.file_format == "parquet":
+            pyarrow.parquet.write_table(pyarrow.Table.from_pandas(frame, preserve_index=False), tmp)
+        else:
+            frame.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+        return path.name
+
+
+class FirestoreSink:
+    def __init__(self, db, collection: str, model_version: str, max_retries: int = 3):
+        self.db = db
+        self.collection = collection
+        self.model_version = model_version
+        self.max_retries = max_retries
+        self.commits = 0
+
+    def clear(self):
+        pass
+
+    def write(self, rows: List[Dict], part: int) -> str:
+        collection_ref = self.db.collection(self.collection)
+        scored_at = datetime.now()
+        for start in range(0, len(rows), FIRESTORE_MAX_BATCH):
+            batch = self.db.batch()
+            for row in rows[start:start + FIRESTORE_MAX_BATCH]:
+                if "error" in row:
+                    continue
+                update = {
+                    "carbon_footprint": row["total_footprint"],
+                    "carbon_footprint_breakdown": {
+                        key[:-len("_footprint")]: value for key, value in row.items()
+                        if key.endswith("_footprint") and key != "total_footprint"
+                    },
+                    "scored_at": scored_at,
+                    "scored_model_version": self.model_version
+                }
+                if "predicted_emission" in row:
+                    update["predicted_emission"] = row["predicted_emission"]
+                batch.set(collection_ref.document(row["userId"]), update, merge=True)
+            self._commit_with_retry(batch)
+        return f"firestore:{self.collection}#{part}"
+
+    def _commit_with_retry(self, batch):
+        delay = 0.5
+        for attempt in range(self.max_retries):
+            try:
+                batch.commit()
+                self.commits += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                print(f"[BatchScoring] Batch commit failed (attempt {attempt + 1}): {str(e)}")
+                time.sleep(delay)
+                delay = min(delay * 2, 10.0)
+
+
+class Checkpoint:
+    """Progress of one run, replaced atomically after every written chunk"""
+
+    def __init__(self, path: str, job: Dict):
+        self.path = Path(path)
+        self.job = job
+        self.records_done = 0
+        self.chunks_done = 0
+        self.last_key: Optional[str] = None
+        self.parts: List[str] = []
+
+    def load(self) -> bool:
+        """Resume from the file if it describes the same job"""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get("format") != CHECKPOINT_FORMAT or state.get("job") != self.job:
+            raise SystemExit(f"Checkpoint {self.path} belongs to a different job: {state.get('job')}")
+        self.records_done = state["records_done"]
+        self.chunks_done = state["chunks_done"]
+        self.last_key = state["last_key"]
+        self.parts = state["parts"]
+        return True
+
+    def save(self, finished: bool = False):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        state = {
+            "format": CHECKPOINT_FORMAT,
+            "job": self.job,
+            "records_done": self.records_done,
+            "chunks_done": self.chunks_done,
+            "last_key": self.last_key,
+            "parts": self.parts,
+            "finished": finished,
+            "updated_at": datetime.now().isoformat()
+        }
+        fd, tmp = tempfile.mkstemp(prefix=".checkpoint-", dir=self.path.parent)
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def score(args) -> Dict:
+    registry = ModelRegistry(poll_interval=0)
+    calculator = CarbonCalculator()
+    carbon_model = CarbonFootprintModel() if args.emission else None
+    registry.register("carbon_calculator", calculator)
+    if carbon_model is not None:
+        registry.register("carbon_model", carbon_model)
+    # Score with the published model version; pool workers are pinned to the same one
+    registry.reload()
+    if carbon_model is not None and not carbon_model.is_ready:
+        raise SystemExit("--emission needs the trained pipeline; train it with: python -m app.ml.carbon_model")
+    pool = CPUPool(
+        WorkerContext(carbon_calculator=calculator, carbon_model=carbon_model,
+                      similarity_store=SharedArrayStore("similarity"), model_registry=registry),
+        workers=args.workers,
+        model_registry=registry
+    )
+
+    db = None
+    if args.source == "firestore" or args.output == "firestore":
+        db = _firestore_client(args.credentials)
+    input_name = args.collection if args.source == "firestore" else (args.input or DATASET_PATH)
+    if args.output == "firestore":
+        sink = FirestoreSink(db, args.output_collection, registry.active_version)
+        default_checkpoint = os.path.join("data", "batch", f"{args.source}-to-firestore.checkpoint.json")
+    else:
+        output_path = args.output_path or os.path.join("data", "batch", f"{args.source}-scores")
+        sink = PartFileSink(output_path, args.output)
+        default_checkpoint = os.path.join(output_path, "_checkpoint.json")
+
+    job = {"source": args.source, "input": str(input_name), "output": args.output,
+           "destination": args.output_collection if args.output == "firestore" else str(sink.directory),
+           "chunk_size": args.chunk_size, "emission": args.emission}
+    checkpoint = Checkpoint(args.checkpoint or default_checkpoint, job)
+    if args.resume and checkpoint.load():
+        print(f"[BatchScoring] Resuming after {checkpoint.records_done:,} records ({checkpoint.chunks_done} chunks)")
+    else:
+        sink.clear()
+
+    if args.source == "csv":
+        chunks = read_csv(input_name, args.chunk_size, checkpoint.records_done, checkpoint.last_key)
+    elif args.source == "export":
+        chunks = read_export(input_name, args.chunk_size, checkpoint.records_done, checkpoint.last_key)
+    else:
+        chunks = read_firestore(db, input_name, args.chunk_size, checkpoint.records_done, checkpoint.last_key)
+
+    report = {"records": 0, "chunks": 0, "failed": 0, "write_s": 0.0, "chunk_latencies": [],
+              "model_version": registry.active_version, "workers": args.workers}
+    in_flight = deque()
+    start_time = time.perf_counter()
+    pool.start()
+    try:
+        exhausted = False
+        while in_flight or not exhausted:
+            # Keep every worker busy plus one chunk queued each; results are written in input order.
+            # Without workers one chunk at a time: the task silences stdout process-wide
+            while not exhausted and len(in_flight) < max(1, args.workers * 2):
+                if args.limit and report["records"] + sum(len(c[0]) for c in in_flight) >= args.limit:
+                    exhausted = True
+                    break
+                try:
+                    profiles, last_key = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight.append((profiles, last_key, time.perf_counter(),
+                                  pool.submit(score_profiles_task, profiles, args.emission)))
+            if not in_flight:
+                break
+            profiles, last_key, submitted_at, future = in_flight.popleft()
+            rows = future.result()
+            report["chunk_latencies"].append(time.perf_counter() - submitted_at)
+
+            write_start = time.perf_counter()
+            checkpoint.parts.append(sink.write(rows, checkpoint.chunks_done))
+            report["write_s"] += time.perf_counter() - write_start
+            checkpoint.records_done += len(rows)
+            checkpoint.chunks_done += 1
+            checkpoint.last_key = last_key
+            checkpoint.save()
+
+            report["records"] += len(rows)
+            failed = [row for row in rows if "error" in row]
+            if failed:
+                report["failed"] += len(failed)
+                print(f"[BatchScoring] {len(failed)} records could not be scored, "
+                      f"e.g. {failed[0]['userId']}: {failed[0]['error']}")
+            report["chunks"] += 1
+            elapsed = time.perf_counter() - start_time
+            print(f"[BatchScoring] {checkpoint.records_done:,} records scored "
+                  f"({report['records'] / elapsed:,.0f} records/s)")
+        checkpoint.save(finished=exhausted and not in_flight)
+    finally:
+        pool.stop()
+    report["elapsed_s"] = time.perf_counter() - start_time
+    report["records_total"] = checkpoint.records_done
+    report["checkpoint"] = str(checkpoint.path)
+    return report
+
+
+def print_report(report: Dict):
+    latencies = np.array(report["chunk_latencies"]) if report["chunk_latencies"] else np.zeros(1)
+    print("\n" + "=" * 60)
+    print("📊 BATCH SCORING")
+    print("=" * 60)
+    print(f"  • Model version: {report['model_version']}, worker processes: {report['workers']}")
+    print(f"  • Records this run: {report['records']:,} in {report['chunks']} chunks, "
+          f"{report['records_total']:,} in total")
+    print(f"  • Records that could not be scored: {report['failed']:,}")
+    print(f"  • Elapsed: {report['elapsed_s']:.2f} s, "
+          f"throughput: {report['records'] / max(report['elapsed_s'], 1e-9):,.0f} records/s")
+    print(f"  • Chunk latency p50/p95: {np.percentile(latencies, 50):.2f} / {np.percentile(latencies, 95):.2f} s")
+    print(f"  • Time spent writing: {report['write_s']:.2f} s")
+    print(f"  • Checkpoint: {report['checkpoint']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline batch scoring for the Carbon Hero backend")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    score_parser = subparsers.add_parser("score", help="Score every profile of a source and write the results")
+    score_parser.add_argument("--source", choices=["csv", "export", "firestore"], default="csv")
+    score_parser.add_argument("--input", default=None,
+                              help="CSV or JSON-lines export path (default: data/Carbon Emission.csv)")
+    score_parser.add_argument("--collection", default="user_data", help="Firestore collection to read")
+    score_parser.add_argument("--output", choices=["parquet", "csv", "firestore"], default="parquet")
+    score_parser.add_argument("--output-path", default=None, help="Directory for Parquet/CSV part files")
+    score_parser.add_argument("--output-collection", default="user_data", help="Firestore collection to update")
+    score_parser.add_argument("--chunk-size", type=int, default=1000)
+    score_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                              help="Worker processes; 0 scores in this process")
+    score_parser.add_argument("--emission", action="store_true",
+                              help="Also add the CarbonFootprintModel estimate (predicted_emission)")
+    score_parser.add_argument("--limit", type=int, default=0, help="Stop after about this many records in this run")
+    score_parser.add_argument("--checkpoint", default=None, help="Checkpoint file path")
+    score_parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint")
+    score_parser.add_argument("--credentials", default=None, help="Firebase service account key")
+
+    args = parser.parse_args()
+    if args.command == "score":
+        print_report(score(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Dict, Optional
@@ -6,6 +6,7 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 from datetime import datetime
 import os
+import time
 from dotenv import load_dotenv
 import pandas as pd
 import numpy as np
@@ -13,10 +14,23 @@ from sklearn.ensemble import RandomForestRegressor
 import joblib
 from sklearn.metrics.pairwise import cosine_similarity
 
-from app.services import CarbonCalculator, ChallengeService, RecommendationEngine
+from app.services import CarbonCalculator, ChallengeService, RecommendationEngine, UserDataCache, FootprintHistoryWriter
 from app.ml import CarbonFootprintModel, CollaborativeFilter
 from .models import UserData, CarbonFootprintResponse, TrainingData
 from .services.ml_service import MLService
+from .services.footprint_stats import FootprintStatsStore, stats_from_user_data
+from .services.score_service import ScoreService
+from .services.recommendation import INTERACTION_STARTED, INTERACTION_COMPLETED, progress_weight
+from .ml.feature_schema import encode_profile
+from .services.dataset import get_dataset
+from .services.model_registry import ModelRegistry
+from .services.shared_state import SharedArrayStore
+from .services.rebuild_scheduler import RebuildScheduler
+from .services.request_context import RequestContext
+from .services.recommendation_store import RecommendationStore
+from .services.cpu_pool import (
+    CPUPool, CPUTaskTimeout, WorkerContext, build_similarity_task, predict_task
+)
 
 # Load environment variables
 load_dotenv()
@@ -27,16 +41,58 @@ firebase_admin.initialize_app(cred)
 db = firestore.client()
 
 # Initialize services
-carbon_calculator = CarbonCalculator()
+# Similarity state is built by one worker and memory-mapped by the others (see initialize_similarity_matrix)
+similarity_store = SharedArrayStore("similarity")
+ml_service = MLService(shared_store=similarity_store)
+# The calculator shares ml_service: one set of category models and similarity state per worker
+carbon_calculator = CarbonCalculator(ml_service=ml_service)
 recommendation_engine = RecommendationEngine()
 carbon_model = CarbonFootprintModel()
-collaborative_filter = CollaborativeFilter()
-challenge_service = ChallengeService()
-ml_service = MLService()
+collaborative_filter = CollaborativeFilter(shared_store=similarity_store)
+challenge_service = ChallengeService(collaborative_filter=collaborative_filter)
+user_cache = UserDataCache(
+    db,
+    max_entries=int(os.getenv("USER_CACHE_MAX_ENTRIES", "1024")),
+    # Per process, not invalidated across workers: the TTL bounds how stale another worker's view gets
+    ttl_seconds=float(os.getenv("USER_CACHE_TTL_SECONDS", "30")),
+    negative_ttl_seconds=float(os.getenv("USER_CACHE_NEGATIVE_TTL_SECONDS", "2"))
+)
+footprint_history = FootprintHistoryWriter(
+    db,
+    batch_size=int(os.getenv("FOOTPRINT_HISTORY_BATCH_SIZE", "100")),
+    flush_interval=float(os.getenv("FOOTPRINT_HISTORY_FLUSH_SECONDS", "1.0")),
+    max_queue=int(os.getenv("FOOTPRINT_HISTORY_MAX_QUEUE", "5000"))
+)
+# Rolling footprint aggregates, updated transactionally outside the user document
+footprint_stats = FootprintStatsStore(db)
+score_service = ScoreService(
+    db,
+    num_shards=int(os.getenv("SCORE_SHARD_COUNT", "10")),
+    sharded_users=[u for u in os.getenv("SCORE_SHARDED_USERS", "").split(",") if u],
+    shard_all=os.getenv("SCORE_SHARD_ALL", "false").lower() == "true"
+)
+# Hot reload of model artifacts: follows models/CURRENT or POST /models/reload
+model_registry = ModelRegistry(poll_interval=float(os.getenv("MODEL_POLL_SECONDS", "5")))
+model_registry.register("carbon_calculator", carbon_calculator)
+model_registry.register("carbon_model", carbon_model)
+model_registry.register("ml_service", ml_service)
+# CPU-bound inference and similarity rebuilds; CPU_POOL_WORKERS=0 keeps them in the thread pool
+cpu_pool = CPUPool(
+    WorkerContext(
+        carbon_calculator=carbon_calculator,
+        carbon_model=carbon_model,
+        similarity_store=similarity_store,
+        model_registry=model_registry
+    ),
+    workers=int(os.getenv("CPU_POOL_WORKERS", "0")),
+    timeout=float(os.getenv("CPU_POOL_TIMEOUT_SECONDS", "10")),
+    model_registry=model_registry
+)
+SIMILARITY_REBUILD_TIMEOUT = float(os.getenv("SIMILARITY_REBUILD_TIMEOUT_SECONDS", "120"))
 
-# Initialize similarity matrix with existing user data
-def initialize_similarity_matrix():
-    try:
+def rebuild_similarity_state(wait: bool = False, max_age: Optional[float] = None) -> Optional[int]:
+    """Rebuild the similarity state from Firestore and attach to the result"""
+    def build():
         print("Loading user data from Firestore to initialize similarity matrix...")
         users_ref = db.collection("user_data").stream()
         user_data = []
@@ -51,24 +107,104 @@ def initialize_similarity_matrix():
         
         if user_data:
             print(f"Found {len(user_data)} users in Firestore")
-            # Update the ML service with user data
-            ml_service.update_user_item_matrix(user_data)
-            print("Successfully initialized similarity matrix with existing user data")
         else:
             print("No user data found in Firestore")
-            # Initialize empty mappings to prevent errors
-            ml_service.user_id_to_index = {}
-            ml_service.index_to_user_id = {}
+        # Rebuild the ML service and collaborative filter state from the same read; the pool
+        # process publishes the matrices itself, so only the generation number comes back
+        return cpu_pool.run_sync(build_similarity_task, user_data, timeout=SIMILARITY_REBUILD_TIMEOUT)
+
+    # Only the worker holding the builder lock rebuilds; a busy lock queues one more rebuild
+    generation = similarity_store.rebuild(build, wait=wait, max_age=max_age)
+    # Services swap in the published arrays; nothing they are serving is modified in place
+    ml_service.sync_shared()
+    collaborative_filter.sync_shared()
+    if generation is not None:
+        print(f"Similarity matrix generation {generation} is active")
+    return generation
+
+# Initialize similarity matrix with existing user data
+def initialize_similarity_matrix(wait: bool = False, max_age: Optional[float] = None):
+    try:
+        rebuild_similarity_state(wait=wait, max_age=max_age)
     except Exception as e:
         print(f"Error initializing similarity matrix: {str(e)}")
         import traceback
         traceback.print_exc()
         # Initialize empty mappings to prevent errors
-        ml_service.user_id_to_index = {}
-        ml_service.index_to_user_id = {}
+        ml_service.reset_similarity()
+
+# Initialize the similarity matrix; workers starting together reuse the first one's build
+initialize_similarity_matrix(wait=True, max_age=float(os.getenv("SHARED_STATE_MAX_AGE_SECONDS", "60")))
+
+# Top-k recommendations for every user, precomputed after each similarity rebuild and
+# persisted in the shared store; endpoints look them up instead of computing them per request
+recommendation_store = RecommendationStore(SharedArrayStore("recommendations"))
+RECOMMENDATION_REFRESH_TIMEOUT = float(os.getenv("RECOMMENDATION_REFRESH_TIMEOUT_SECONDS", "300"))
+CHALLENGE_RECOMMENDATIONS = 5
+# Tamamlanan meydan okumalar istek anında elenir; listeler bunun için yedek öneri taşır
+CHALLENGE_RECOMMENDATION_SLOTS = 2 * CHALLENGE_RECOMMENDATIONS
+
+def rebuild_recommendations(wait: bool = False) -> Optional[int]:
+    """Batch job: feature and challenge recommendations of every user from the current snapshot"""
+    def build():
+        started_at = time.time()
+        # Other workers' challenge progress only reaches this engine through Firestore
+        recommendation_engine.load_interactions(read_challenge_interactions())
+        ml_service.sync_shared()
+        snapshot = ml_service.similarity
+        feature_lists = dict(ml_service.recommendations_for_all(snapshot=snapshot))
+        challenge_lists = {}
+        for user_id in snapshot.user_id_to_index:
+            try:
+                challenge_lists[user_id] = recommendation_engine.recommend_challenges(
+                    user_id, [], CHALLENGE_RECOMMENDATION_SLOTS
+                )
+            except ValueError:
+                challenge_lists[user_id] = None  # Profili olmayan kullanıcı: istek anında hesaplanır
+        print(f"[RecommendationStore] Precomputed recommendations for {len(feature_lists)} users "
+              f"in {time.time() - started_at:.2f} s")
+        return RecommendationStore.build_shared(
+            feature_lists, challenge_lists, snapshot.feature_names, recommendation_engine.challenge_ids,
+            started_at, snapshot.generation
+        )
 
-# Initialize the similarity matrix
-initialize_similarity_matrix()
+    return recommendation_store.rebuild(build, wait=wait)
+
+recommendation_store.sync_shared()
+recommendation_refreshes = RebuildScheduler(
+    rebuild_recommendations,
+    name="recommendation-refresh-scheduler",
+    min_interval=float(os.getenv("RECOMMENDATION_REFRESH_MIN_INTERVAL_SECONDS", "30")),
+    quiet_period=float(os.getenv("RECOMMENDATION_REFRESH_QUIET_SECONDS", "1")),
+    max_staleness=float(os.getenv("RECOMMENDATION_MAX_STALENESS_SECONDS", "300"))
+)
+
+def rebuild_similarity_and_recommendations() -> Optional[int]:
+    generation = rebuild_similarity_state()
+    if generation is not None:
+        # This worker built the new similarity state, so it also refreshes the precomputed lists
+        recommendation_refreshes.mark_dirty()
+    return generation
+
+async def refresh_user_recommendations(context: RequestContext):
+    """Per-user refresh after a profile write: the lists reflect the saved profile at once"""
+    try:
+        challenges = await cpu_pool.run_in_thread(
+            recommendation_engine.get_challenge_recommendations, context.profile,
+            CHALLENGE_RECOMMENDATION_SLOTS, context.encoded
+        )
+    except ValueError:
+        challenges = None
+    recommendation_store.refresh_user(context.user_id, features=context.recommendations(), challenges=challenges)
+
+# Profile writes only mark the similarity state dirty; this thread coalesces them into rebuilds
+similarity_rebuilds = RebuildScheduler(
+    rebuild_similarity_and_recommendations,
+    name="similarity-rebuild-scheduler",
+    min_interval=float(os.getenv("SIMILARITY_REBUILD_MIN_INTERVAL_SECONDS", "5")),
+    quiet_period=float(os.getenv("SIMILARITY_REBUILD_QUIET_SECONDS", "1")),
+    max_staleness=float(os.getenv("SIMILARITY_MAX_STALENESS_SECONDS", "30"))
+)
 
 app = FastAPI(title="Carbon Hero API",debug=True)
 
@@ -81,6 +217,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def start_background_writers():
+    footprint_history.start()
+    # Switch to the version models/CURRENT points at (if any) before serving, then follow it
+    try:
+        model_registry.reload()
+    except Exception as e:
+        print(f"Starting with the default model set: {str(e)}")
+    model_registry.start()
+    cpu_pool.start()
+    similarity_rebuilds.start()
+    recommendation_refreshes.start()
+    # Lists persisted from an older similarity state (or none yet) are rebuilt in the background
+    if recommendation_store.snapshot.similarity_generation != similarity_store.generation():
+        recommendation_refreshes.mark_dirty()
+
+@app.on_event("shutdown")
+def stop_background_writers():
+    # Flush queued carbon_footprints rows before the process exits
+    footprint_history.stop()
+    similarity_rebuilds.stop()
+    recommendation_refreshes.stop()
+    model_registry.stop()
+    cpu_pool.stop()
+
 # Initialize models
 class UserData(BaseModel):
     userId: str
@@ -155,6 +316,7 @@ class UserDataUpdate(BaseModel):
 @app.post("/calculate-carbon-footprint", response_model=CarbonFootprintResponse)
 async def calculate_carbon_footprint(user_data: UserData):
     """Calculate carbon footprint based on user data"""
+    _require_history_capacity()
     try:
         # Calculate footprint
         footprint = calculate_footprint(user_data.dict())
@@ -165,12 +327,20 @@ async def calculate_carbon_footprint(user_data: UserData):
             "timestamp": firestore.SERVER_TIMESTAMP,
             **footprint
         }
-        db.collection("carbon_footprints").add(footprint_data)
         
         # Save user data if not exists
-        user_ref = db.collection("user_data").document(user_data.userId)
-        if not user_ref.get().exists:
-            user_ref.set(user_data.dict())
+        existing_user_data = user_cache.get(user_data.userId)
+        if existing_user_data is None:
+            new_user_data = user_data.dict()
+            db.collection("user_data").document(user_data.userId).set(new_user_data)
+            user_cache.set(user_data.userId, new_user_data)
+            recommendation_engine.upsert_member(new_user_data)
+        
+        # Keep the footprint aggregates up to date (before the history row is queued)
+        category_breakdown = {k: v for k, v in footprint.items() if k not in ("total", "recommendations")}
+        await cpu_pool.run_in_thread(footprint_stats.record, user_data.userId, footprint["total"],
+                                     category_breakdown, (existing_user_data or {}).get("footprint_stats"))
+        footprint_history.enqueue(footprint_data)
         
         return CarbonFootprintResponse(
             total_footprint=footprint["total"],
@@ -186,17 +356,25 @@ async def recommend_challenges(user_id: str):
     """Kullanıcıya önerilen meydan okumaları getirir."""
     try:
         # Kullanıcı verilerini al
-        user_doc = db.collection("user_data").document(user_id).get()
-        if not user_doc.exists:
+        user_data = user_cache.get(user_id)
+        if user_data is None:
             raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
         
-        user_data = user_doc.to_dict()
-        
-        # Kullanıcının mevcut meydan okumalarını al
-        user_challenges = challenge_service.get_user_challenges(user_id)
+        # Önceden hesaplanmış liste: tek bir arama
+        recommendations = recommendation_store.challenges(user_id)
+        if recommendations is None:
+            # Öneri motorunu kullanarak meydan okuma önerileri al
+            # Profil vektörleri ve etkileşimler bu sürece ait; iş parçacığında, zaman aşımıyla çalışır
+            recommendations = await cpu_pool.run_in_thread(
+                recommendation_engine.get_challenge_recommendations, user_data, CHALLENGE_RECOMMENDATION_SLOTS
+            )
+            recommendation_store.refresh_user(user_id, challenges=recommendations)
         
-        # Öneri motorunu kullanarak meydan okuma önerileri al
-        recommendations = recommendation_engine.get_challenge_recommendations(user_data)
+        # Tamamlananları Firestore'dan oku ve ele: hangi worker'da tamamlanmış olursa olsun geçerli
+        completed = await cpu_pool.run_in_thread(challenge_service.get_completed_challenge_ids, user_id)
+        recommendations = [
+            rec for rec in recommendations if rec['challenge_id'] not in completed
+        ][:CHALLENGE_RECOMMENDATIONS]
         
         # Önerilen meydan okumaların detaylarını al
         recommended_challenges = []
@@ -210,6 +388,10 @@ async def recommend_challenges(user_id: str):
         
         return recommended_challenges
     
+    except HTTPException:
+        raise
+    except CPUTaskTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -217,110 +399,40 @@ async def recommend_challenges(user_id: str):
 async def get_user_stats(user_id: str):
     """Get user statistics including carbon footprint trends and challenge progress"""
     try:
-        # Get user's carbon footprints (historical data)
-        footprints_ref = db.collection("carbon_footprints")\
-            .where("userId", "==", user_id)\
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)\
-            .limit(10)\
-            .stream()
-        
-        footprints = [doc.to_dict() for doc in footprints_ref]
-        
-        user_doc_ref = db.collection("user_data").document(user_id)
-        user_doc = user_doc_ref.get()
-        current_user_data = user_doc.to_dict() if user_doc.exists else {}
-
-        # Initialize breakdown data to an empty dictionary
-        breakdown_data = {}
-        
-        # Try to get breakdown from the latest carbon_footprints entry first
-        if footprints:
-            breakdown_data = footprints[0].get("breakdown", {})
-            print(f"[GET_USER_STATS] Breakdown from carbon_footprints: {breakdown_data}") # Debug log
-        
-        # Eğer breakdown boşsa, son 5 footprint dokümanında breakdown içeren ilk dokümanı bul
-        if not breakdown_data and footprints:
-            for fp in footprints[1:5]:
-                if fp.get("breakdown"):
-                    breakdown_data = fp["breakdown"]
-                    print(f"[GET_USER_STATS] Breakdown found in previous footprint: {breakdown_data}")
-                    break
-        # If breakdown is still empty, try to get it from the user_data document (fallback for older data)
-        if not breakdown_data and current_user_data:
-            breakdown_data = current_user_data.get("carbon_footprint_breakdown", {})
-            print(f"[GET_USER_STATS] Breakdown from user_data (fallback): {breakdown_data}") # Debug log
-        # Eğer breakdown hala boşsa, kullanıcı verisinden tekrar hesapla
-        if not breakdown_data and current_user_data:
-            from app.services.carbon_calculator import CarbonCalculator
-            carbon_calculator = CarbonCalculator()
-            breakdown_data = carbon_calculator.calculate(current_user_data).get("breakdown", {})
-            print(f"[GET_USER_STATS] Breakdown recalculated: {breakdown_data}")
-
-        # Determine current footprint
-        current_footprint = 0.0
-        if footprints:
-            current_footprint = footprints[0].get("total_footprint", 0.0)
-        elif current_user_data:
-            current_footprint = current_user_data.get("carbon_footprint", 0.0)
-
-        # Calculate average footprint
-        average_footprint = 0.0
-        if footprints:
-            total_sum = sum(f.get("total_footprint", 0.0) for f in footprints)
-            if len(footprints) > 0:
-                average_footprint = total_sum / len(footprints)
-        else:
-            average_footprint = current_footprint # If no historical data, average is current
-
-        # Calculate trend
-        trend = 0.0
-        trend_percentage = 0.0
-        if len(footprints) >= 2:
-            latest_footprint = footprints[0].get("total_footprint", 0.0)
-            oldest_footprint = footprints[-1].get("total_footprint", 0.0)
-            trend = latest_footprint - oldest_footprint
-            if oldest_footprint != 0.0:
-                trend_percentage = (trend / oldest_footprint) * 100
-
-        # Get user's challenges (assuming challenge_service is properly initialized and available)
-        # Note: challenge_service might be outside this function's scope if not passed as arg
-        # For simplicity, assuming it's globally accessible or correctly injected
-        # user_challenges = challenge_service.get_user_challenges(user_id)
-        # completed_challenges = [c for c in user_challenges if c["user_challenge"]["completed"]]
-        # in_progress_challenges = [c for c in user_challenges if not c["user_challenge"]["completed"]]
-        # total_carbon_saved = sum(c["challenge"]["carbon_savings"] for c in completed_challenges)
-        
+        # Aggregates are maintained in footprint_stats/{userId} whenever a footprint is written,
+        # so this is two document reads; only users without one yet are backfilled from history
+        current_user_data = user_cache.get(user_id) or {}
+        aggregates = await cpu_pool.run_in_thread(footprint_stats.get, user_id,
+                                                  current_user_data.get("footprint_stats"))
+        if not current_user_data and aggregates is None:
+            raise HTTPException(status_code=404, detail="No footprint data found for user")
+
+        stats = stats_from_user_data(current_user_data, aggregates)
+        trend = stats["trend"]
+        trend_percentage = stats["trend_percentage"]
+
         # Default challenges data if not fetching real challenges here
         challenges_stats = {
             "completed": 0,
             "in_progress": 0,
             "total_carbon_saved": 0.0
         }
-        # If you want to fetch challenges, you'd need challenge_service.get_user_challenges(user_id) here
-
-        # Get recommendations from user_data document
-        recommendations_data = current_user_data.get("recommendations", [])
-
-        # Get total score from user_data
-        total_score = current_user_data.get("total_score", 0)
-
-        # Ensure that if no footprint data is found at all, we return a 404
-        if not footprints and not current_user_data:
-            raise HTTPException(status_code=404, detail="No footprint data found for user")
 
         return {
-            "current_footprint": current_footprint,
-            "average_footprint": average_footprint,
+            "current_footprint": stats["latest"],
+            "average_footprint": stats["average"],
             "trend": trend,
             "trend_percentage": trend_percentage,
             "improvement_percentage": abs(trend_percentage) if trend < 0 else 0,
-            "challenges": challenges_stats, # Use the default or fetched challenges_stats
-            "recent_footprints": footprints[:5],  # Last 5 historical footprints
-            "breakdown": breakdown_data,
-            "recommendations": recommendations_data, # Include recommendations in the response
+            "challenges": challenges_stats,
+            "recent_footprints": stats["recent"],  # Last 5 historical footprints
+            "breakdown": stats["latest_breakdown"],
+            "recommendations": current_user_data.get("recommendations", []),
             "user_data": current_user_data,
-            "total_score": total_score
+            "total_score": score_service.get_total(user_id, current_user_data.get("total_score", 0))
         }
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print(f"[GET_USER_STATS] HATA: {e}") # Debug log
@@ -332,6 +444,7 @@ async def start_challenge(user_id: str, challenge_id: str):
     """Start a new challenge for a user"""
     try:
         result = challenge_service.start_challenge(user_id, challenge_id)
+        recommendation_engine.record_interaction(user_id, challenge_id, INTERACTION_STARTED)
         return UserChallenge(
             challenge_id=result["challenge"]["id"],
             start_date=result["user_challenge"]["startDate"],
@@ -355,6 +468,14 @@ async def update_challenge_progress(
             user_challenge_id,
             progress_update.progress
         )
+        recommendation_engine.record_interaction(
+            result["user_challenge"]["userId"],
+            result["user_challenge"]["challengeId"],
+            progress_weight(result["user_challenge"]["progress"])
+        )
+        if result["user_challenge"]["completed"]:
+            # Diğer kullanıcıların listeleri de bu tamamlamayı yansıtsın (arka planda)
+            recommendation_refreshes.mark_dirty()
         return UserChallenge(
             challenge_id=result["challenge"]["id"],
             start_date=result["user_challenge"]["startDate"],
@@ -391,20 +512,11 @@ async def get_user_challenges(user_id: str):
 async def get_challenges_by_category(category: str):
     """Get all challenges for a specific category"""
     try:
-        challenges = challenge_service.get_challenges_by_category(category)
-        return [
-            ChallengeRecommendation(
-                challenge_id=c["id"],
-                title=c["title"],
-                description=c["description"],
-                category=c["category"],
-                difficulty=c["difficulty"],
-                carbon_savings=c["carbon_savings"],
-                duration_days=c["duration_days"],
-                score=1.0  # Default score for category listing
-            )
-            for c in challenges
-        ]
+        # Listing is serialized once when the catalog is compiled
+        return Response(
+            content=challenge_service.get_category_response(category),
+            media_type="application/json"
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -412,62 +524,70 @@ async def get_challenges_by_category(category: str):
 async def get_challenges_by_difficulty(difficulty: str):
     """Get all challenges for a specific difficulty level"""
     try:
-        challenges = challenge_service.get_challenges_by_difficulty(difficulty)
-        return [
-            ChallengeRecommendation(
-                challenge_id=c["id"],
-                title=c["title"],
-                description=c["description"],
-                category=c["category"],
-                difficulty=c["difficulty"],
-                carbon_savings=c["carbon_savings"],
-                duration_days=c["duration_days"],
-                score=1.0  # Default score for difficulty listing
-            )
-            for c in challenges
-        ]
+        return Response(
+            content=challenge_service.get_difficulty_response(difficulty),
+            media_type="application/json"
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/models")
+def get_model_status():
+    """Active model version, load timings and the state of the pointer watcher"""
+    return model_registry.status()
+
+@app.post("/models/reload")
+def reload_models(version: Optional[str] = None, force: bool = False):
+    """Load, smoke-test and swap in a model version (models/CURRENT's one by default)"""
+    try:
+        return model_registry.reload(version, force=force)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reloading models: {str(e)}")
+
+@app.post("/challenges/reload")
+async def reload_challenges():
+    """Reload the challenge catalog from its data file without a restart"""
+    try:
+        count = challenge_service.reload_catalog()
+        recommendation_engine.load_challenges(challenge_service.get_all_challenges())
+        recommendation_refreshes.mark_dirty()
+        return {"status": "success", "challenges": count}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reloading challenges: {str(e)}")
+
 @app.post("/api/challenges/{user_id}/complete/{challenge_title}")
 async def complete_challenge(user_id: str, challenge_title: str):
     """Complete a challenge and update user score"""
     try:
-        # Get user's current score
-        user_ref = db.collection("user_data").document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
+        # Existence check only; the score itself is never read-modified-written here
+        user_data = user_cache.get(user_id)
+        if user_data is None:
             raise HTTPException(status_code=404, detail="User not found")
         
-        user_data = user_doc.to_dict()
-        current_score = user_data.get("total_score", 0)
-        
         # Find the challenge in all categories
-        all_challenges = challenge_service.get_all_challenges()
-        challenge = next((c for c in all_challenges if c["title"] == challenge_title), None)
+        challenge = challenge_service.get_challenge_by_title(challenge_title)
         if not challenge:
             raise HTTPException(status_code=404, detail="Challenge not found")
         
         # Dynamic points calculation
         difficulty_bonus = {"easy": 0, "medium": 10, "hard": 20}
         points_earned = int(challenge["carbon_savings"] * 20) + difficulty_bonus.get(challenge["difficulty"].lower(), 0)
-        new_total_score = current_score + points_earned
         
-        # Update user's total score
-        user_ref.update({
-            "total_score": new_total_score,
-            "last_challenge_completed": challenge_title,
-            "last_challenge_date": datetime.now()
-        })
+        # Server-side increment and completed_challenges insert in one commit; the total is
+        # read back from Firestore, since this worker's cache misses other workers' awards
+        new_total_score = await cpu_pool.run_in_thread(score_service.award, user_id, challenge_title, points_earned)
+        recommendation_engine.record_interaction(user_id, challenge["id"], INTERACTION_COMPLETED)
+        recommendation_refreshes.mark_dirty()  # Diğer kullanıcıların listeleri için (arka planda)
         
-        # Add to completed challenges collection
-        db.collection("completed_challenges").add({
-            "userId": user_id,
-            "challenge_title": challenge_title,
-            "points_earned": points_earned,
-            "completed_at": datetime.now()
-        })
+        if not score_service.is_sharded(user_id):
+            # Sharded users keep total_score and the last completion off the user document
+            user_cache.update(user_id, {
+                "total_score": new_total_score,
+                "last_challenge_completed": challenge_title,
+                "last_challenge_date": datetime.now()
+            })
         
         return {
             "status": "success",
@@ -475,20 +595,40 @@ async def complete_challenge(user_id: str, challenge_title: str):
             "points_earned": points_earned,
             "total_score": new_total_score
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[COMPLETE_CHALLENGE ERROR] {e}")
         raise HTTPException(status_code=500, detail=f"Error completing challenge: {str(e)}")
 
+def _require_history_capacity():
+    # Backpressure: while Firestore lags and the history queue is full, turn writes away
+    if footprint_history.is_full():
+        raise HTTPException(status_code=503, detail="Footprint history is backed up, retry shortly",
+                            headers={"Retry-After": "5"})
+
+def _require_carbon_model():
+    if not carbon_model.is_ready:
+        raise HTTPException(status_code=503,
+                            detail="Karbon modeli eğitilmemiş: python -m app.ml.carbon_model")
+
 @app.post("/tahmin")
 def tahmin_yap(veri: UserTestResult):
-    prediction = carbon_model.predict(veri.dict())
+    _require_carbon_model()
+    profile = veri.dict()
+    # Profil bir kez kodlanır; tahmin ve benzer kullanıcı araması aynı kodlamayı kullanır
+    encoded = encode_profile(profile)
+    try:
+        prediction = float(cpu_pool.run_sync(predict_task, [profile], [encoded])[0])
+    except CPUTaskTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     # Model önerileri
     recommendations = [
         {"challenge": "Toplu taşıma kullan", "score": 10},
         {"challenge": "Et tüketimini azalt", "score": 8}
     ]
     # Collaborative filtering ile benzer kullanıcılar ve ortak challenge
-    similar_users = collaborative_filter.find_similar_users(veri.dict())
+    similar_users = collaborative_filter.find_similar_users(profile, encoded=encoded)
     collaborative_challenges = []
     for user in similar_users:
         collaborative_challenges.append({
@@ -502,43 +642,70 @@ def tahmin_yap(veri: UserTestResult):
         "collaborative_challenges": collaborative_challenges
     }
 
+@app.post("/tahmin/batch")
+def toplu_tahmin_yap(veriler: List[UserTestResult]):
+    """Birden çok test sonucunu tek bir vektörel model çağrısıyla tahmin et"""
+    _require_carbon_model()
+    profiles = [veri.dict() for veri in veriler]
+    try:
+        predictions = cpu_pool.run_sync(predict_task, profiles)
+    except CPUTaskTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    return {
+        "sonuclar": [
+            {"userId": profile.get("userId", ""), "sonuc": float(prediction)}
+            for profile, prediction in zip(profiles, predictions)
+        ]
+    }
+
 @app.post("/api/user-data")
 async def submit_user_data(user_data: UserData):
+    _require_history_capacity()
     try:
         # Karbon ayak izini hesapla (ML modeli ile)
-        footprint_data_calculated = carbon_calculator.calculate(user_data.dict())
+        # İstek bağlamı: profil bir kez kodlanır, tahmin ve komşu araması istek başına bir kez yapılır
+        context = RequestContext(user_data.userId, user_data.dict(), ml_service, cpu_pool)
+        encoded = context.encoded
+        footprint_data_calculated = await context.footprint()
 
         # Firestore'a kaydet (user_data koleksiyonu)
+        previous_user_data = user_cache.get(user_data.userId) or {}
         user_doc_ref = db.collection("user_data").document(user_data.userId)
-        user_doc_ref.set({
+        user_document = {
             **user_data.dict(),
             "carbon_footprint": footprint_data_calculated["total_footprint"],
             "carbon_footprint_breakdown": footprint_data_calculated["breakdown"], # Add breakdown
             "created_at": datetime.now(),
             "updated_at": datetime.now()
-        })
+        }
+        user_doc_ref.set(user_document)
+        user_cache.set(user_data.userId, user_document)
+        await cpu_pool.run_in_thread(footprint_stats.record, user_data.userId,
+                                     footprint_data_calculated["total_footprint"],
+                                     footprint_data_calculated["breakdown"],
+                                     previous_user_data.get("footprint_stats"))
+        recommendation_engine.upsert_member(user_document, encoded)
+        collaborative_filter.upsert_user(user_document, encoded)
 
         # carbon_footprints koleksiyonuna da ekle (geçmiş verileri)
-        db.collection("carbon_footprints").add({
+        footprint_history.enqueue({
             "userId": user_data.userId,
             "timestamp": firestore.SERVER_TIMESTAMP,
             "total_footprint": footprint_data_calculated["total_footprint"],
             "breakdown": footprint_data_calculated["breakdown"] # Ensure breakdown is here
         })
 
-        # Önerileri al
-        try:
-            recommendations = ml_service.get_recommendations(user_data.userId)
-        except Exception as e:
-            print(f"Error getting recommendations: {e}")
-            recommendations = []
+        # Önerileri al (kaydedilen profile göre, bir kez)
+        recommendations = context.recommendations()
 
         # Önerileri de kaydet (user_data koleksiyonuna)
         user_doc_ref.update({
             "recommendations": recommendations
         })
+        user_cache.update(user_data.userId, {"recommendations": recommendations})
+        await refresh_user_recommendations(context)
 
-        initialize_similarity_matrix()  # Yeni kullanıcı eklenince similarity matrix güncellensin
+        similarity_rebuilds.mark_dirty()  # Yeni kullanıcı eklenince similarity matrix güncellensin (arka planda)
 
         return {
             "status": "success",
@@ -572,19 +739,15 @@ async def train_models(training_data: List[TrainingData]):
             })
 
         carbon_calculator.train_models(formatted_data)
-        # Update collaborative filtering with all users
+        # Pool processes loaded the previous category models; give them the retrained ones
+        if cpu_pool.enabled:
+            cpu_pool.restart()
+        # Rebuild the shared similarity state from Firestore so every worker attaches to it
         try:
-            # Get all users from Firestore
-            users_ref = db.collection("user_data").stream()
-            firestore_users = [doc.to_dict() for doc in users_ref]
-            # If we have users in Firestore, use them
-            if firestore_users:
-                print("Updating collaborative filtering with Firestore users...")
-                carbon_calculator.update_collaborative_filtering(firestore_users)
-            else:
-                # Otherwise use the training data
-                print("No users in Firestore, using training data for collaborative filtering...")
-                carbon_calculator.update_collaborative_filtering(formatted_data)
+            stats = await cpu_pool.run_in_thread(similarity_rebuilds.force, True, SIMILARITY_REBUILD_TIMEOUT,
+                                                 timeout=SIMILARITY_REBUILD_TIMEOUT)
+            if stats.get("last_error"):
+                raise RuntimeError(stats["last_error"])
             print("Successfully updated collaborative filtering system")
         except Exception as e:
             print(f"Error updating collaborative filtering: {str(e)}")
@@ -602,25 +765,29 @@ async def get_user_recommendations(user_id: str):
     print("user-recommendations endpoint başı")
     try:
         # Check if user exists in Firestore
-        user_doc = db.collection("user_data").document(user_id).get()
-        if not user_doc.exists:
+        if user_cache.get(user_id) is None:
             raise HTTPException(status_code=404, detail="User not found")
         
-        # If similarity matrix is not initialized, try to initialize it
-        if not hasattr(ml_service, 'user_id_to_index') or not ml_service.user_id_to_index:
-            print("Similarity matrix not initialized, attempting to initialize...")
-            initialize_similarity_matrix()
-            
-            # If still not initialized, return empty recommendations
+        # Precomputed by the batch job, or refreshed on the user's last profile write
+        recommendations = recommendation_store.features(user_id)
+        if recommendations is None:
+            # Another worker may already have published a newer similarity generation
+            ml_service.sync_shared()
             if not hasattr(ml_service, 'user_id_to_index') or not ml_service.user_id_to_index:
-                return {
-                    "status": "success",
-                    "recommendations": [],
-                    "message": "No similar users found yet. Recommendations will be available as more users join."
-                }
+                print("Similarity matrix not initialized, scheduling a rebuild...")
+                similarity_rebuilds.mark_dirty()
+            
+                # Until the background rebuild lands, return empty recommendations
+                if not hasattr(ml_service, 'user_id_to_index') or not ml_service.user_id_to_index:
+                    return {
+                        "status": "success",
+                        "recommendations": [],
+                        "message": "No similar users found yet. Recommendations will be available as more users join."
+                    }
         
-        # Get recommendations using ML service
-        recommendations = ml_service.get_recommendations(user_id)
+            # Get recommendations using ML service
+            recommendations = ml_service.get_recommendations(user_id)
+            recommendation_store.refresh_user(user_id, features=recommendations)
         
         # Format recommendations
         formatted_recommendations = []
@@ -685,9 +852,8 @@ async def get_similar_users(user_id: str, n_recommendations: int = 5):
         # Get user details for similar users
         similar_users_details = []
         for user_idx, similarity_score in similar_users:
-            user_doc = db.collection("user_data").document(str(user_idx)).get()
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
+            user_data = user_cache.get(str(user_idx))
+            if user_data is not None:
                 similar_users_details.append({
                     "userId": str(user_idx),
                     "similarity_score": float(similarity_score),
@@ -701,6 +867,14 @@ async def get_similar_users(user_id: str, n_recommendations: int = 5):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/score/{user_id}")
+async def get_score(user_id: str):
+    """Total score read from Firestore, bypassing this worker's user_data cache"""
+    total_score = await cpu_pool.run_in_thread(score_service.read_total, user_id)
+    if total_score is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"userId": user_id, "total_score": total_score}
+
 @app.get("/api/leaderboard")
 async def get_leaderboard():
     """Get leaderboard of users ranked by total score"""
@@ -708,10 +882,14 @@ async def get_leaderboard():
         # Get all users with their total scores
         users_ref = db.collection("user_data").stream()
         users_data = []
+        # Points of sharded (hot) users that are not folded into total_score
+        shard_totals = score_service.shard_totals()
         
         for doc in users_ref:
             user_data = doc.to_dict()
             user_data['userId'] = doc.id
+            if doc.id in shard_totals:
+                user_data['total_score'] = user_data.get('total_score', 0) + shard_totals[doc.id]
             users_data.append(user_data)
         
         # Sort users by total_score (descending)
@@ -736,45 +914,114 @@ async def get_leaderboard():
         print(f"Error getting leaderboard: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Report hit ratio and memory use of the user_data cache"""
+    return {
+        "status": "success",
+        "user_data": user_cache.stats()
+    }
+
+@app.get("/similarity/stats")
+async def get_similarity_stats():
+    """Report staleness, coalescing and timings of the similarity rebuilds"""
+    return {
+        "status": "success",
+        "generation": similarity_store.generation(),
+        "scheduler": similarity_rebuilds.stats()
+    }
+
+@app.post("/similarity/rebuild")
+def force_similarity_rebuild(wait: bool = False):
+    """Admin: rebuild the similarity state now instead of at the next scheduled slot"""
+    return {
+        "status": "success",
+        "scheduler": similarity_rebuilds.force(wait=wait, timeout=SIMILARITY_REBUILD_TIMEOUT)
+    }
+
+@app.get("/recommendations/stats")
+async def get_recommendation_stats():
+    """Report size, hit ratio and refreshes of the precomputed recommendations"""
+    recommendation_store.sync_shared()
+    return {
+        "status": "success",
+        "store": recommendation_store.stats(),
+        "scheduler": recommendation_refreshes.stats()
+    }
+
+@app.post("/recommendations/refresh")
+def force_recommendation_refresh(wait: bool = False):
+    """Admin: run the precompute job now instead of after the next similarity rebuild"""
+    return {
+        "status": "success",
+        "scheduler": recommendation_refreshes.force(wait=wait, timeout=RECOMMENDATION_REFRESH_TIMEOUT)
+    }
+
+@app.get("/cpu-pool/stats")
+async def get_cpu_pool_stats():
+    """Report worker count, submitted tasks and timeouts of the CPU pool"""
+    return {
+        "status": "success",
+        "pool": cpu_pool.stats()
+    }
+
+@app.get("/footprint-history/stats")
+async def get_footprint_history_stats():
+    """Report queue depth and batching of carbon_footprints writes"""
+    return {
+        "status": "success",
+        "writer": footprint_history.stats()
+    }
+
 @app.post("/api/user-data/update/{user_id}")
 async def update_user_data(user_id: str, update: UserDataUpdate):
+    _require_history_capacity()
     try:
         # Get current user data
-        user_ref = db.collection("user_data").document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
+        current_data = user_cache.get(user_id)
+        if current_data is None:
             raise HTTPException(status_code=404, detail="User data not found")
         
-        current_data = user_doc.to_dict()
+        user_ref = db.collection("user_data").document(user_id)
         
         # Update the specified field
         field_name = update.field.lower().replace(" ", "_")
         current_data[field_name] = update.value
         
-        # Calculate new carbon footprint using ML model
-        footprint_data_calculated = carbon_calculator.calculate(current_data)
+        # Calculate new carbon footprint using ML model (profile encoded once for every consumer)
+        context = RequestContext(user_id, current_data, ml_service, cpu_pool)
+        encoded = context.encoded
+        footprint_data_calculated = await context.footprint()
         
         # Update Firestore (user_data collection)
-        user_ref.update({
+        profile_update = {
             field_name: update.value,
             "carbon_footprint": footprint_data_calculated["total_footprint"], # Update total footprint
             "carbon_footprint_breakdown": footprint_data_calculated["breakdown"], # Update breakdown
             "last_updated": datetime.now()
-        })
+        }
+        user_ref.update(profile_update)
+        user_cache.update(user_id, profile_update)
+        await cpu_pool.run_in_thread(footprint_stats.record, user_id,
+                                     footprint_data_calculated["total_footprint"],
+                                     footprint_data_calculated["breakdown"],
+                                     current_data.get("footprint_stats"))
+        recommendation_engine.upsert_member(context.profile, encoded)
+        collaborative_filter.upsert_user(context.profile, encoded)
 
         # Add new entry to carbon_footprints collection for historical data
-        db.collection("carbon_footprints").add({
+        footprint_history.enqueue({
             "userId": user_id,
             "timestamp": firestore.SERVER_TIMESTAMP,
             "total_footprint": footprint_data_calculated["total_footprint"],
             "breakdown": footprint_data_calculated["breakdown"]
         })
         
-        # Get new recommendations
-        recommendations = ml_service.get_recommendations(user_id)
+        # Get new recommendations, for the profile as just updated
+        recommendations = context.recommendations()
+        await refresh_user_recommendations(context)
         
-        initialize_similarity_matrix()  # Profil güncellenince similarity matrix güncellensin
+        similarity_rebuilds.mark_dirty()  # Profil güncellenince similarity matrix güncellensin (arka planda)
 
         return {
             "message": "User data updated successfully",
@@ -789,18 +1036,47 @@ async def update_user_data(user_id: str, update: UserDataUpdate):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-# Öneri motorunu başlat
-recommendation_engine = RecommendationEngine()
-
 # Veri setini yükle
 try:
-    user_data = pd.read_csv("data/Carbon Emission.csv")
+    user_data = get_dataset().frame(copy=False)
     # Öneri motorunu verilerle başlat
     recommendation_engine.load_data(user_data, challenge_service.get_all_challenges())
 except Exception as e:
     print(f"Veri yükleme hatası: {str(e)}")
     user_data = None
 
+def read_challenge_interactions() -> List[tuple]:
+    """(userId, challengeId, weight) for every started and completed challenge in Firestore"""
+    interactions = []
+    for doc in db.collection("user_challenges").stream():
+        record = doc.to_dict()
+        if record.get("completed"):
+            weight = INTERACTION_COMPLETED
+        else:
+            weight = progress_weight(record.get("progress", 0))
+        interactions.append((record.get("userId"), record.get("challengeId"), weight))
+    for doc in db.collection("completed_challenges").stream():
+        record = doc.to_dict()
+        challenge = challenge_service.get_challenge_by_title(record.get("challenge_title", ""))
+        if challenge:
+            interactions.append((record.get("userId"), challenge["id"], INTERACTION_COMPLETED))
+    return interactions
+
+def initialize_challenge_interactions():
+    """Load Firestore profiles and challenge history into the recommendation engine"""
+    try:
+        recommendation_engine.load_members(
+            {**doc.to_dict(), "userId": doc.id} for doc in db.collection("user_data").stream()
+        )
+
+        interactions = read_challenge_interactions()
+        recommendation_engine.load_interactions(interactions)
+        print(f"Loaded {len(interactions)} challenge interactions into the recommendation engine")
+    except Exception as e:
+        print(f"Error loading challenge interactions: {str(e)}")
+
+initialize_challenge_interactions()
+
 def calculate_footprint(user_data: dict) -> dict:
     try:
         print(f"Calculating footprint for user data: {user_data}")  # Debug log
@@ -4,8 +4,14 @@ Machine learning modules for Carbon Hero backend
 
 from .carbon_model import CarbonFootprintModel
 from .collaborative_filter import CollaborativeFilter
+from .feature_schema import FeatureSchema, EncodedProfile, FEATURE_SCHEMA, SCHEMA_VERSION, encode_profile
 
 __all__ = [
     'CarbonFootprintModel',
-    'CollaborativeFilter'
-] 
\ No newline at end of file
+    'CollaborativeFilter',
+    'FeatureSchema',
+    'EncodedProfile',
+    'FEATURE_SCHEMA',
+    'SCHEMA_VERSION',
+    'encode_profile'
+] 
@@ -1,92 +1,232 @@
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import joblib
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-import joblib
-import os
+from sklearn.model_selection import train_test_split
+
+from .feature_schema import FEATURE_SCHEMA, SCHEMA_VERSION, EncodedProfile
+from ..services.dataset import TARGET_COLUMN, get_dataset
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'models')
+PIPELINE_PATH = os.path.join(MODEL_DIR, 'carbon_pipeline.joblib')
+# Artefakt biçimi değişirse artırılır; eski biçimdeki dosyalar yüklenmez
+PIPELINE_FORMAT = 1
+
 
 class CarbonFootprintModel:
-    def __init__(self):
-        self.model = None
-        self.label_encoders = {}
-        self.scaler = StandardScaler()
-        self.model_path = os.path.join(os.path.dirname(__file__), '..', '..', 'models', 'carbon_model.joblib')
-        self._load_or_train_model()
-
-    def _load_or_train_model(self):
-        """Modeli yükle veya yoksa eğit"""
+    """Kodlayıcılar + ölçekleyici + model + sütun sırasından oluşan tek bir pipeline artefaktı.
+
+    Artefakt yalnızca eğitim CLI'ı ile üretilir (python -m app.ml.carbon_model);
+    sunucu açılışında eğitim yapılmaz, mevcut artefakt milisaniyeler içinde yüklenir.
+    """
+
+    def __init__(self, pipeline_path: Optional[str] = None):
+        self.pipeline_path = pipeline_path or os.getenv("CARBON_PIPELINE_PATH", PIPELINE_PATH)
+        self.pipeline: Optional[Dict[str, Any]] = None
+        self._load_pipeline()
+
+    def _load_pipeline(self):
+        """Pipeline artefaktını yükle; yoksa modeli eğitmeden devam et"""
+        if not os.path.exists(self.pipeline_path):
+            print(f"Model pipeline bulunamadı ({self.pipeline_path}). "
+                  f"Eğitmek için: python -m app.ml.carbon_model")
+            return
         try:
-            if os.path.exists(self.model_path):
-                self.model = joblib.load(self.model_path)
-                print("Model başarıyla yüklendi.")
-            else:
-                print("Model bulunamadı, yeni model eğitilecek...")
-                self._train_model()
+            self.pipeline = self.read_pipeline(self.pipeline_path)
+            print("Model başarıyla yüklendi.")
         except Exception as e:
             print(f"Model yüklenirken hata oluştu: {str(e)}")
-            print("Yeni model eğitilecek...")
-            self._train_model()
 
-    def _train_model(self):
-        """Yeni model eğit"""
-        try:
-            # Veri setini yükle
-            data_path = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'Carbon Emission.csv')
-            df = pd.read_csv(data_path)
+    @staticmethod
+    def read_pipeline(path: str) -> Dict[str, Any]:
+        pipeline = joblib.load(path)
+        if pipeline.get("format") != PIPELINE_FORMAT:
+            raise ValueError(f"Model pipeline biçimi desteklenmiyor: {pipeline.get('format')}")
+        return pipeline
 
-            # Kategorik değişkenleri otomatik olarak bul ve sayısallaştır
-            categorical_columns = df.select_dtypes(include=['object']).columns.tolist()
-            for column in categorical_columns:
-                self.label_encoders[column] = LabelEncoder()
-                df[column] = self.label_encoders[column].fit_transform(df[column].astype(str))
+    @property
+    def model(self):
+        return self.pipeline["model"] if self.pipeline is not None else None
 
-            # Özellikler ve hedef değişken
-            X = df.drop(['CarbonEmission'], axis=1, errors='ignore')
-            y = df['CarbonEmission']
+    @property
+    def is_ready(self) -> bool:
+        return self.pipeline is not None
 
-            # Veriyi ölçeklendir
-            X = self.scaler.fit_transform(X)
+    def load_bundle(self, model_dir: str, version: str) -> Optional[Dict[str, Any]]:
+        """Bir sürüm dizinindeki pipeline'ı etkin olana dokunmadan yükle (yoksa None)"""
+        path = os.path.join(model_dir, os.path.basename(PIPELINE_PATH))
+        return self.read_pipeline(path) if os.path.exists(path) else None
 
-            # Model eğitimi
-            self.model = RandomForestRegressor(n_estimators=100, random_state=42)
-            self.model.fit(X, y)
+    def smoke_test(self, pipeline: Optional[Dict[str, Any]], profile: Dict[str, Any]):
+        if pipeline is None:
+            return
+        prediction = self._predict_many(pipeline, [profile])[0]
+        if not np.isfinite(prediction):
+            raise ValueError(f"Pipeline duman testinde geçersiz tahmin döndürdü: {prediction}")
 
-            # Modeli kaydet
-            os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
-            joblib.dump(self.model, self.model_path)
-            print("Model başarıyla eğitildi ve kaydedildi.")
+    def activate(self, pipeline: Optional[Dict[str, Any]]):
+        """Doğrulanmış pipeline'ı tek bir referans ataması ile yayınla"""
+        self.pipeline = pipeline
 
-        except Exception as e:
-            print(f"Model eğitilirken hata oluştu: {str(e)}")
-            raise
+    @staticmethod
+    def build_pipeline(df: pd.DataFrame, n_estimators: int = 100, random_state: int = 42) -> Dict[str, Any]:
+        """Veri setinden uçtan uca pipeline'ı eğit"""
+        X = df.drop([TARGET_COLUMN], axis=1, errors='ignore')
+        y = df[TARGET_COLUMN].to_numpy(dtype=np.float64)
+        columns = X.columns.tolist()
 
-    def predict(self, user_data):
-        """Kullanıcı verilerine göre karbon ayak izini tahmin et"""
+        # Kategorik değişkenler: sıralı sınıf listesi (LabelEncoder ile aynı kodlar)
+        categories = {}
+        defaults = {}
+        matrix = np.empty((len(X), len(columns)), dtype=np.float64)
+        for i, column in enumerate(columns):
+            series = X[column]
+            if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object:
+                values = series.astype(object).where(series.notna(), None)
+                classes = sorted({str(v) for v in values if v is not None})
+                has_missing = bool(values.isna().any())
+                if has_missing:
+                    classes.append(None)
+                codes = pd.Categorical(values.astype(object), categories=[c for c in classes if c is not None]).codes
+                codes = codes.astype(np.int64)
+                if has_missing:
+                    codes[codes < 0] = len(classes) - 1
+                categories[column] = classes
+                # Bilinmeyen veya eksik cevaplar en sık görülen sınıfa düşer
+                defaults[column] = int(np.bincount(codes).argmax())
+                matrix[:, i] = codes
+            else:
+                matrix[:, i] = series.to_numpy(dtype=np.float64)
+                defaults[column] = float(np.nanmean(matrix[:, i]))
+
+        # Ölçekleyici istatistikleri (StandardScaler ile aynı)
+        mean = matrix.mean(axis=0)
+        scale = matrix.std(axis=0)
+        scale[scale == 0] = 1.0
+        scaled = (matrix - mean) / scale
+
+        X_train, X_test, y_train, y_test = train_test_split(scaled, y, test_size=0.2, random_state=random_state)
+        model = RandomForestRegressor(n_estimators=n_estimators, random_state=random_state, n_jobs=-1)
+        model.fit(X_train, y_train)
+        test_score = float(model.score(X_test, y_test))
+        # Yayınlanan model tüm veriyle eğitilir
+        model.fit(scaled, y)
+
+        return {
+            "format": PIPELINE_FORMAT,
+            "schema_version": SCHEMA_VERSION,
+            "columns": columns,
+            "categories": categories,
+            "code_maps": {
+                column: {value: code for code, value in enumerate(classes)}
+                for column, classes in categories.items()
+            },
+            "defaults": defaults,
+            "mean": mean,
+            "scale": scale,
+            "model": model,
+            "metrics": {"test_r2": test_score, "rows": int(len(X))},
+            "trained_at": datetime.now().isoformat()
+        }
+
+    @staticmethod
+    def save_pipeline(pipeline: Dict[str, Any], path: str):
+        """Artefaktı geçici dosyaya yazıp atomik olarak yerine taşı"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".carbon_pipeline-", dir=os.path.dirname(os.path.abspath(path)))
+        os.close(fd)
         try:
-            # Kategorik değişkenleri dönüştür
-            for column, encoder in self.label_encoders.items():
-                if column in user_data:
-                    user_data[column] = encoder.transform([str(user_data[column])])[0]
+            joblib.dump(pipeline, tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @staticmethod
+    def _transform(pipeline: Dict[str, Any], records: List[Dict[str, Any]]) -> np.ndarray:
+        """Veri seti sütunlarına eşlenmiş kayıtları sütun bazında ölçeklenmiş matrise çevir"""
+        matrix = np.empty((len(records), len(pipeline["columns"])), dtype=np.float64)
+        for i, column in enumerate(pipeline["columns"]):
+            default = pipeline["defaults"][column]
+            code_map = pipeline["code_maps"].get(column)
+            if code_map is None:
+                matrix[:, i] = [
+                    float(record[column]) if isinstance(record.get(column), (int, float)) else default
+                    for record in records
+                ]
+            else:
+                # Android'in "yok" cevapları (None) veri setindeki eksik sınıfına karşılık gelir
+                matrix[:, i] = [
+                    code_map.get(None if record[column] is None else str(record[column]), default)
+                    if column in record else default
+                    for record in records
+                ]
+        return (matrix - pipeline["mean"]) / pipeline["scale"]
 
-            # Veriyi ölçeklendir
-            X = self.scaler.transform([list(user_data.values())])
+    def predict_many(self, profiles: List[Dict[str, Any]],
+                     encoded: Optional[List[EncodedProfile]] = None) -> np.ndarray:
+        """Birden çok profil için tek bir vektörel model çağrısı"""
+        # Tek okuma: yeniden yükleme sırasında bile istek baştan sona aynı pipeline'ı kullanır
+        pipeline = self.pipeline
+        if pipeline is None:
+            raise RuntimeError("Model pipeline yüklenmedi; önce python -m app.ml.carbon_model ile eğitin")
+        return self._predict_many(pipeline, profiles, encoded)
 
-            # Tahmin yap
-            prediction = self.model.predict(X)[0]
-            return float(prediction)
+    def _predict_many(self, pipeline: Dict[str, Any], profiles: List[Dict[str, Any]],
+                      encoded: Optional[List[EncodedProfile]] = None) -> np.ndarray:
+        if not profiles:
+            return np.empty(0, dtype=np.float64)
+        # Android alanları ortak özellik şeması ile veri seti sütunlarına eşlenir (girdi değiştirilmez)
+        records = [
+            FEATURE_SCHEMA.ensure(profile, encoded[i] if encoded else None).dataset_record
+            for i, profile in enumerate(profiles)
+        ]
+        return pipeline["model"].predict(self._transform(pipeline, records))
 
+    def predict(self, user_data: Dict[str, Any], encoded: Optional[EncodedProfile] = None) -> float:
+        """Kullanıcı verilerine göre karbon ayak izini tahmin et"""
+        try:
+            return float(self.predict_many([user_data], [encoded] if encoded else None)[0])
         except Exception as e:
             print(f"Tahmin yapılırken hata oluştu: {str(e)}")
             raise
 
     def get_feature_importance(self):
         """Özellik önemlerini döndür"""
-        if self.model is None:
+        pipeline = self.pipeline
+        if pipeline is None:
             return None
-        
-        feature_names = list(self.label_encoders.keys())
-        importances = self.model.feature_importances_
-        
+
+        feature_names = pipeline["columns"]
+        importances = pipeline["model"].feature_importances_
+
         # Özellik önemlerini sırala
         feature_importance = dict(zip(feature_names, importances))
-        return dict(sorted(feature_importance.items(), key=lambda x: x[1], reverse=True)) 
\ No newline at end of file
+        return dict(sorted(feature_importance.items(), key=lambda x: x[1], reverse=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CarbonFootprintModel pipeline'ını eğitir ve kaydeder")
+    parser.add_argument("--output", default=PIPELINE_PATH, help="Pipeline artefaktının yolu")
+    parser.add_argument("--data", default=None, help="Veri seti CSV yolu (varsayılan: data/Carbon Emission.csv)")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    pipeline = CarbonFootprintModel.build_pipeline(get_dataset(args.data).frame(copy=False), args.n_estimators)
+    CarbonFootprintModel.save_pipeline(pipeline, args.output)
+    print(f"Model eğitildi ve kaydedildi: {args.output}")
+    print(f"  • Satır: {pipeline['metrics']['rows']}, test R2: {pipeline['metrics']['test_r2']:.3f}")
+    print(f"  • Süre: {time.time() - start_time:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,129 +1,197 @@
+import threading
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
-from typing import List, Dict
-import pandas as pd
+from typing import List, Dict, Optional, Tuple
 from firebase_admin import firestore
+from .feature_schema import FEATURE_SCHEMA, EncodedProfile, profile_signatures
+from ..services.shared_state import SharedArrayStore, SharedSnapshot
+
+# Fields kept per user in the in-memory corpus and returned by find_similar_users
+CORPUS_FIELDS = ("userId", "username", "carbon_footprint", "total_score")
 
 class CollaborativeFilter:
-    def __init__(self):
-        self.db = firestore.client()
+    def __init__(self, shared_store: Optional[SharedArrayStore] = None):
+        self._db = None
         self.user_matrix = None
-        self.user_similarity = None
-        self._load_data()
+        # Distinct profile rows and each user's signature id; queries compare against the signatures
+        self.signatures = None
+        self.user_signatures = None
+        self._signature_ids: Dict[bytes, int] = {}
+        # Row-aligned corpus: user_ids[i] and user_corpus[i] describe user_matrix[i]
+        self.user_ids: List[str] = []
+        self.user_corpus: List[Dict] = []
+        self.user_index: Dict[str, int] = {}
+        self._capacity_matrix = None
+        self._lock = threading.Lock()
+        # With a shared store the owner loads users once for all workers (see load_users/sync_shared)
+        self.shared_store = shared_store
+        self._shared: Optional[SharedSnapshot] = None
+        if shared_store is None:
+            self._load_data()
+
+    @property
+    def db(self):
+        # Created on first use, so pool processes that only compute never need a Firestore client
+        if self._db is None:
+            self._db = firestore.client()
+        return self._db
 
     def _load_data(self):
         """Load and preprocess user data from Firestore"""
-        # Get all user data
-        users_ref = self.db.collection("user_data").stream()
-        users_data = [doc.to_dict() for doc in users_ref]
-        
+        # Single pass over the collection builds the matrix and the corpus together
+        users_data = []
+        for doc in self.db.collection("user_data").stream():
+            user = doc.to_dict()
+            user.setdefault("userId", doc.id)
+            users_data.append(user)
+        self.load_users(users_data)
+
+    def load_users(self, users_data: List[Dict]):
+        """Replace the corpus with these users and recompute the similarity matrix"""
         if not users_data:
             return
         
         # Convert categorical data to numerical features
-        self.user_matrix = self._preprocess_user_data(users_data)
-        
-        # Calculate user similarity matrix
-        self.user_similarity = cosine_similarity(self.user_matrix)
+        matrix = self._preprocess_user_data(users_data)
+        signatures, user_signatures = profile_signatures(matrix)
+        with self._lock:
+            self.user_ids = [user["userId"] for user in users_data]
+            self.user_corpus = [self._compact(user) for user in users_data]
+            self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+            self._capacity_matrix = matrix
+            self.user_matrix = matrix
+            self._set_signatures(signatures, user_signatures)
+
+    @classmethod
+    def build_shared(cls, users_data: List[Dict]) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """Matrix, signatures and corpus for SharedArrayStore.publish, built without touching a live filter"""
+        width = len(FEATURE_SCHEMA.dense_columns)
+        matrix = FEATURE_SCHEMA.dense_many(users_data) if users_data else np.zeros((0, width))
+        signatures, user_signatures = profile_signatures(matrix)
+        arrays = {
+            "cf_user_matrix": matrix,
+            "cf_signatures": signatures,
+            "cf_user_signature": user_signatures
+        }
+        meta = {
+            "cf_user_ids": [user["userId"] for user in users_data],
+            "cf_corpus": [cls._compact(user) for user in users_data]
+        }
+        return arrays, meta
+
+    def sync_shared(self):
+        """Re-attach to the shared matrices when a newer generation was published"""
+        if self.shared_store is None:
+            return
+        snapshot = self.shared_store.refresh(self._shared)
+        if snapshot is None or "cf_user_signature" not in snapshot.arrays:
+            return
+        user_ids = snapshot.meta["cf_user_ids"]
+        with self._lock:
+            self._shared = snapshot
+            self.user_ids = list(user_ids)
+            self.user_corpus = list(snapshot.meta["cf_corpus"])
+            self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+            # upsert_user writes rows in place, so the small feature matrix is a private copy
+            self._capacity_matrix = np.array(snapshot.arrays["cf_user_matrix"]) if user_ids else None
+            self.user_matrix = self._capacity_matrix
+            self._set_signatures(np.array(snapshot.arrays["cf_signatures"]),
+                                 np.array(snapshot.arrays["cf_user_signature"]))
+
+    def _set_signatures(self, signatures: np.ndarray, user_signatures: np.ndarray):
+        # Called with the lock held
+        self.signatures = signatures
+        self.user_signatures = user_signatures
+        self._signature_ids = {row.tobytes(): i for i, row in enumerate(signatures)}
+
+    def _signature_of(self, features: np.ndarray) -> int:
+        # Called with the lock held; a profile nobody had before becomes a new signature
+        key = features.tobytes()
+        signature = self._signature_ids.get(key)
+        if signature is None:
+            signature = len(self._signature_ids)
+            self._signature_ids[key] = signature
+            self.signatures = np.vstack([self.signatures, features[np.newaxis, :]]) \
+                if self.signatures is not None else features[np.newaxis, :].copy()
+        return signature
+
+    @staticmethod
+    def _compact(user: Dict) -> Dict:
+        return {field: user[field] for field in CORPUS_FIELDS if field in user}
+
+    def upsert_user(self, user: Dict, encoded: Optional[EncodedProfile] = None):
+        """Add or refresh one user's row and corpus entry without re-reading Firestore"""
+        user_id = user.get("userId")
+        if not user_id:
+            return
+        features = FEATURE_SCHEMA.ensure(user, encoded).dense
+        with self._lock:
+            row = self.user_index.get(user_id)
+            if row is None:
+                row = len(self.user_ids)
+                capacity = self._capacity_matrix
+                if capacity is None or row >= capacity.shape[0]:
+                    # Grow geometrically so appends stay amortised O(1)
+                    grown = np.zeros((max(16, 2 * row), features.shape[0]), dtype=features.dtype)
+                    grown_signatures = np.zeros(grown.shape[0], dtype=np.int32)
+                    if capacity is not None:
+                        grown[:row] = capacity[:row]
+                        grown_signatures[:row] = self.user_signatures[:row]
+                    capacity = grown
+                    self.user_signatures = grown_signatures
+                self._capacity_matrix = capacity
+                self.user_ids.append(user_id)
+                self.user_corpus.append(self._compact(user))
+                self.user_index[user_id] = row
+            else:
+                self.user_corpus[row] = self._compact(user)
+            self._capacity_matrix[row] = features
+            self.user_signatures[row] = self._signature_of(features)
+            self.user_matrix = self._capacity_matrix[:len(self.user_ids)]
 
     def _preprocess_user_data(self, users_data: List[Dict]) -> np.ndarray:
         """Convert categorical user data to numerical features"""
-        # Define feature mappings
-        feature_mappings = {
-            "body_type": {
-                "Underweight": 0, "Normal": 1, "Overweight": 2, "Obese": 3
-            },
-            "gender": {"Female": 0, "Male": 1},
-            "diet_type": {
-                "Vegan": 0, "Vegetarian": 1, "Pescatarian": 2, "Omnivore": 3
-            },
-            "shower_frequency": {
-                "Daily": 1, "Twice a day": 2, "More frequently": 3, "Less frequently": 0
-            },
-            "heating_source": {
-                "Coal": 3, "Natural gas": 2, "Electricity": 1, "Wood": 2.5
-            },
-            "transportation_mode": {
-                "Public transport": 0, "Private car": 2, "Walking/Bicycle": 0.5
-            },
-            "vehicle_type": {
-                "Petrol": 2.5, "Diesel": 2, "Electric": 1, "I don't own a vehicle": 0
-            },
-            "social_activity": {
-                "Never": 0, "Sometimes": 1, "Often": 2
-            },
-            "trash_bag_size": {
-                "Small": 0.8, "Medium": 1, "Large": 1.5, "Extra large": 2
-            },
-            "air_travel_frequency": {
-                "Never": 0, "Rarely": 1, "Frequently": 2, "Very frequently": 3
-            },
-            "home_energy_efficiency": {
-                "No": 2, "Sometimes": 1.5, "Yes": 1
-            },
-            "recycling": {
-                "Paper": 0.8, "Plastic": 0.8, "Glass": 0.8, 
-                "Metal": 0.8, "I do not recycle": 2
-            },
-            "cooking_devices": {
-                "Stove": 1, "Oven": 1.5, "Microwave": 0.8, 
-                "Airfryer": 0.7, "Grill": 1.2
-            },
-            "screen_time": {
-                "Less than 4 hours": 0.8, "4-8 hours": 1,
-                "8-16 hours": 1.5, "More than 16 hours": 2
-            },
-            "clothes_purchases": {
-                "0-10": 0.8, "11-20": 1.2, "21-30": 1.5, "31+": 2
-            },
-            "internet_usage": {
-                "Less than 4 hours": 0.8, "4-8 hours": 1,
-                "8-16 hours": 1.5, "More than 16 hours": 2
-            }
-        }
-        
-        # Convert user data to numerical features
-        numerical_data = []
-        for user in users_data:
-            user_features = []
-            for feature, mapping in feature_mappings.items():
-                value = user.get(feature, list(mapping.keys())[0])
-                if isinstance(value, list):
-                    v = value[0] if value else 0
-                else:
-                    v = value
-                user_features.append(mapping.get(v, 0))
-            numerical_data.append(user_features)
-        
-        return np.array(numerical_data)
+        if len(users_data) == 1:
+            return FEATURE_SCHEMA.encode(users_data[0]).dense[np.newaxis, :]
+        # Column-wise encoding through the shared feature schema
+        return FEATURE_SCHEMA.dense_many(users_data)
 
-    def find_similar_users(self, user_data: Dict, n_similar: int = 5) -> List[Dict]:
+    def find_similar_users(self, user_data: Dict, n_similar: int = 5,
+                           encoded: Optional[EncodedProfile] = None) -> List[Dict]:
         """Find similar users based on user data"""
-        if self.user_matrix is None or self.user_similarity is None:
+        self.sync_shared()
+        with self._lock:
+            user_corpus = self.user_corpus
+            signatures = self.signatures
+            # A copy: upsert_user writes signature ids (possibly new ones) into this array in place
+            user_signatures = self.user_signatures[:len(user_corpus)].copy() if self.user_signatures is not None else None
+            self_row = self.user_index.get(user_data.get("userId"))
+        if signatures is None or len(user_corpus) == 0:
             return []
         
         # Convert input user data to numerical features
-        user_features = self._preprocess_user_data([user_data])[0]
-        
-        # Calculate similarity with all users
-        similarities = cosine_similarity([user_features], self.user_matrix)[0]
-        
-        # Get indices of most similar users
-        similar_indices = np.argsort(similarities)[::-1][1:n_similar+1]
+        user_features = FEATURE_SCHEMA.ensure(user_data, encoded).dense
         
-        # Get user data for similar users
-        users_ref = self.db.collection("user_data").stream()
-        users_data = [doc.to_dict() for doc in users_ref]
+        # Calculate similarity with each distinct profile, then expand to all users
+        similarities = cosine_similarity([user_features], signatures)[0][user_signatures]
+        if self_row is not None and self_row < len(similarities):
+            similarities[self_row] = -np.inf
         
-        similar_users = []
-        for idx in similar_indices:
-            if idx < len(users_data):
-                similar_users.append({
-                    "user_data": users_data[idx],
-                    "similarity_score": float(similarities[idx])
-                })
-        
-        return similar_users
+        # Get indices of most similar users (top-k without a full sort)
+        k = min(n_similar, len(similarities) - (1 if self_row is not None else 0))
+        if k <= 0:
+            return []
+        top = np.argpartition(-similarities, k - 1)[:k]
+        similar_indices = top[np.argsort(-similarities[top])]
+        
+        # Corpus rows line up with matrix rows, so no Firestore read is needed here
+        return [
+            {
+                "user_data": user_corpus[idx],
+                "similarity_score": float(similarities[idx])
+            }
+            for idx in similar_indices
+        ]
 
     def get_user_challenges(self, user_id: str) -> List[Dict]:
         """Get challenges completed by a user"""
@@ -0,0 +1,310 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+# Bump whenever a field, domain or impact value changes: encoded vectors of different
+# versions are not comparable and must be recomputed
+SCHEMA_VERSION = 1
+
+# Android profile fields, their domains (in code order) and the impact value of each answer
+FIELD_IMPACTS = {
+    "body_type": {
+        "Underweight": 0, "Normal": 1, "Overweight": 2, "Obese": 3
+    },
+    "gender": {"Female": 0, "Male": 1},
+    "diet_type": {
+        "Vegan": 0, "Vegetarian": 1, "Pescatarian": 2, "Omnivore": 3
+    },
+    "shower_frequency": {
+        "Daily": 1, "Twice a day": 2, "More frequently": 3, "Less frequently": 0
+    },
+    "heating_source": {
+        "Coal": 3, "Natural gas": 2, "Electricity": 1, "Wood": 2.5
+    },
+    "transportation_mode": {
+        "Public transport": 0, "Private car": 2, "Walking/Bicycle": 0.5
+    },
+    "vehicle_type": {
+        "Petrol": 2.5, "Diesel": 2, "Electric": 1, "I don't own a vehicle": 0
+    },
+    "social_activity": {
+        "Never": 0, "Sometimes": 1, "Often": 2
+    },
+    "trash_bag_size": {
+        "Small": 0.8, "Medium": 1, "Large": 1.5, "Extra large": 2
+    },
+    "air_travel_frequency": {
+        "Never": 0, "Rarely": 1, "Frequently": 2, "Very frequently": 3
+    },
+    "home_energy_efficiency": {
+        "No": 2, "Sometimes": 1.5, "Yes": 1
+    },
+    "recycling": {
+        "Paper": 0.8, "Plastic": 0.8, "Glass": 0.8,
+        "Metal": 0.8, "I do not recycle": 2
+    },
+    "cooking_devices": {
+        "Stove": 1, "Oven": 1.5, "Microwave": 0.8,
+        "Airfryer": 0.7, "Grill": 1.2
+    },
+    "screen_time": {
+        "Less than 4 hours": 0.8, "4-8 hours": 1,
+        "8-16 hours": 1.5, "More than 16 hours": 2
+    },
+    "clothes_purchases": {
+        "0-10": 0.8, "11-20": 1.2, "21-30": 1.5, "31+": 2
+    },
+    "internet_usage": {
+        "Less than 4 hours": 0.8, "4-8 hours": 1,
+        "8-16 hours": 1.5, "More than 16 hours": 2
+    }
+}
+
+# Columns of the Carbon Emission dataset the models were trained on
+DATASET_CATEGORICAL_COLUMNS = [
+    'Body Type', 'Sex', 'Diet', 'How Often Shower',
+    'Heating Energy Source', 'Transport', 'Vehicle Type',
+    'Social Activity', 'Waste Bag Size', 'Energy efficiency', 'Recycling',
+    'Frequency of Traveling by Air', 'Cooking_With'
+]
+DATASET_NUMERICAL_COLUMNS = [
+    'Monthly Grocery Bill', 'Vehicle Monthly Distance Km',
+    'Waste Bag Weekly Count', 'How Long TV PC Daily Hour',
+    'How Many New Clothes Monthly', 'How Long Internet Daily Hour'
+]
+
+# Android profile fields -> dataset columns
+ANDROID_TO_DATASET = {
+    'body_type': 'Body Type',
+    'gender': 'Sex',
+    'diet_type': 'Diet',
+    'shower_frequency': 'How Often Shower',
+    'heating_source': 'Heating Energy Source',
+    'transportation_mode': 'Transport',
+    'vehicle_type': 'Vehicle Type',
+    'social_activity': 'Social Activity',
+    'trash_bag_size': 'Waste Bag Size',
+    'home_energy_efficiency': 'Energy efficiency',
+    'recycling': 'Recycling',
+    'air_travel_frequency': 'Frequency of Traveling by Air',
+    'cooking_devices': 'Cooking_With',
+    'screen_time': 'How Long TV PC Daily Hour',
+    'internet_usage': 'How Long Internet Daily Hour',
+    'clothes_purchases': 'How Many New Clothes Monthly'
+}
+# Android answers spelled differently from the dataset
+ANDROID_VALUE_ALIASES = {
+    'Transport': {'private car': 'private', 'public transport': 'public', 'walking/bicycle': 'walk/bicycle'},
+    'Vehicle Type': {"i don't own a vehicle": None},
+    'Recycling': {'i do not recycle': '[]'}
+}
+# Midpoints for numerical answers that arrive as ranges
+ANDROID_RANGE_VALUES = {
+    'Less than 4 hours': 2.0, '4-8 hours': 6.0, '8-16 hours': 12.0, 'More than 16 hours': 20.0,
+    '0-10': 5.0, '11-20': 15.5, '21-30': 25.5, '31+': 40.0
+}
+
+# Code used for a field that is absent from the profile (as opposed to an unknown answer)
+MISSING = -2
+UNKNOWN = -1
+
+
+def _raw_answer(value: Any) -> Any:
+    """List answers use their first element; an empty list counts as missing"""
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+class EncodedProfile:
+    """One profile encoded once, shared by every model and similarity component"""
+
+    __slots__ = ("schema_version", "user_id", "values", "codes", "dense", "onehot_indices",
+                 "dataset_record", "_onehot_width", "_onehot")
+
+    def __init__(self, schema: "FeatureSchema", user_id: Optional[str], values: Dict[str, Optional[str]],
+                 codes: np.ndarray, dataset_record: Dict[str, Any]):
+        self.schema_version = schema.version
+        self.user_id = user_id
+        self.values = values
+        self.codes = codes
+        self.dense = schema.dense_from_codes(codes[np.newaxis, :])[0]
+        known = codes >= 0
+        self.onehot_indices = (schema.onehot_offsets[known] + codes[known]).astype(np.int32)
+        self.dataset_record = dataset_record
+        self._onehot_width = schema.onehot_width
+        self._onehot = None
+
+    @property
+    def onehot(self) -> csr_matrix:
+        """1 x width sparse one-hot row (unknown and missing answers set no bit)"""
+        if self._onehot is None:
+            self._onehot = csr_matrix(
+                (np.ones(len(self.onehot_indices), dtype=np.float32),
+                 self.onehot_indices, np.array([0, len(self.onehot_indices)])),
+                shape=(1, self._onehot_width)
+            )
+        return self._onehot
+
+
+class FeatureSchema:
+    """Versioned field domains, value normalisation and the compiled encoders"""
+
+    def __init__(self, field_impacts: Dict[str, Dict[str, float]] = FIELD_IMPACTS, version: int = SCHEMA_VERSION):
+        self.version = version
+        self.fields: Tuple[str, ...] = tuple(field_impacts)
+        self.domains = {field: tuple(mapping) for field, mapping in field_impacts.items()}
+        # Case- and whitespace-insensitive lookup of each field's canonical answers
+        self.lookups = {
+            field: {value.casefold(): code for code, value in enumerate(domain)}
+            for field, domain in self.domains.items()
+        }
+        # Impact tables with a trailing 0 for unknown answers; missing fields take the first answer
+        self.impact_tables = [
+            np.array(list(mapping.values()) + [0], dtype=np.float64)
+            for mapping in field_impacts.values()
+        ]
+        sizes = np.array([len(domain) for domain in self.domains.values()], dtype=np.int32)
+        self.onehot_offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+        self.onehot_width = int(sizes.sum())
+        self.onehot_columns = [f"{field}={value}" for field in self.fields for value in self.domains[field]]
+
+    @property
+    def dense_columns(self) -> List[str]:
+        return list(self.fields)
+
+    def normalize_value(self, field: str, value: Any) -> Tuple[int, Optional[str]]:
+        """(code, normalised answer) of one raw Android answer"""
+        value = _raw_answer(value)
+        if value is None:
+            return MISSING, None
+        if not isinstance(value, str):
+            return UNKNOWN, None
+        stripped = value.strip()
+        code = self.lookups[field].get(stripped.casefold())
+        if code is None:
+            return UNKNOWN, stripped
+        return code, self.domains[field][code]
+
+    def encode(self, profile: Dict[str, Any]) -> EncodedProfile:
+        """Normalise and encode a single profile"""
+        codes = np.empty(len(self.fields), dtype=np.int64)
+        values = {}
+        for i, field in enumerate(self.fields):
+            codes[i], values[field] = self.normalize_value(field, profile.get(field))
+        return EncodedProfile(self, profile.get("userId"), values, codes,
+                              self.to_dataset_record(profile, values))
+
+    def ensure(self, profile: Dict[str, Any], encoded: Optional[EncodedProfile] = None) -> EncodedProfile:
+        """Reuse a request's encoded profile, encoding only if it is absent or stale"""
+        if encoded is not None and encoded.schema_version == self.version:
+            return encoded
+        return self.encode(profile)
+
+    def codes_many(self, profiles: List[Dict[str, Any]]) -> np.ndarray:
+        """Column-wise codes of a whole population (n_profiles x n_fields)"""
+        frame = pd.DataFrame.from_records(profiles, columns=list(self.fields))
+        codes = np.empty((len(profiles), len(self.fields)), dtype=np.int64)
+        for column, field in enumerate(self.fields):
+            values = frame[field].to_numpy(dtype=object)
+            is_list = np.fromiter((isinstance(v, list) for v in values), dtype=bool, count=len(values))
+            if is_list.any():
+                values = values.copy()
+                values[is_list] = [_raw_answer(v) for v in values[is_list]]
+            missing = pd.isna(values)
+            # Non-string answers become NaN under .str and therefore unknown
+            folded = pd.Series(values, dtype=object).str.strip().str.casefold()
+            field_codes = pd.Categorical(folded, categories=list(self.lookups[field])).codes.astype(np.int64)
+            field_codes[missing] = MISSING
+            codes[:, column] = field_codes
+        return codes
+
+    def dense_from_codes(self, codes: np.ndarray) -> np.ndarray:
+        """Impact (ordinal) matrix: lower values mean a lower footprint"""
+        matrix = np.empty(codes.shape, dtype=np.float64)
+        for column, table in enumerate(self.impact_tables):
+            field_codes = codes[:, column].copy()
+            field_codes[field_codes == MISSING] = 0
+            matrix[:, column] = table[field_codes]
+        return matrix
+
+    def onehot_from_codes(self, codes: np.ndarray) -> csr_matrix:
+        """Sparse one-hot matrix; unknown and missing answers set no bit"""
+        rows, columns = np.nonzero(codes >= 0)
+        indices = self.onehot_offsets[columns] + codes[rows, columns]
+        return csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, indices)),
+            shape=(codes.shape[0], self.onehot_width)
+        )
+
+    def unit_onehot_from_codes(self, codes: np.ndarray) -> csr_matrix:
+        """One-hot rows scaled to unit length: a row dot product is the cosine similarity"""
+        matrix = self.onehot_from_codes(codes)
+        answered = np.diff(matrix.indptr)
+        matrix.data = np.repeat(1.0 / np.sqrt(np.maximum(answered, 1)), answered).astype(np.float32)
+        return matrix
+
+    def dense_many(self, profiles: List[Dict[str, Any]]) -> np.ndarray:
+        return self.dense_from_codes(self.codes_many(profiles))
+
+    def to_dataset_record(self, profile: Dict[str, Any],
+                          values: Optional[Dict[str, Optional[str]]] = None) -> Dict[str, Any]:
+        """Map a profile (Android or dataset fields) onto the dataset's columns and spellings"""
+        record = {}
+        for column in DATASET_CATEGORICAL_COLUMNS + DATASET_NUMERICAL_COLUMNS:
+            if column in profile:
+                record[column] = profile[column]
+        for android_key, column in ANDROID_TO_DATASET.items():
+            if column in record or android_key not in profile:
+                continue
+            if values is not None and android_key in values:
+                value = values[android_key]
+            else:
+                value = self.normalize_value(android_key, profile[android_key])[1]
+            raw = _raw_answer(profile[android_key])
+            if column in DATASET_NUMERICAL_COLUMNS:
+                if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+                    record[column] = float(raw)
+                elif value in ANDROID_RANGE_VALUES:
+                    record[column] = ANDROID_RANGE_VALUES[value]
+                continue
+            if value is None:
+                continue
+            aliases = ANDROID_VALUE_ALIASES.get(column, {})
+            if value.lower() in aliases:
+                record[column] = aliases[value.lower()]
+            elif column in ('Recycling', 'Cooking_With'):
+                record[column] = str([value])
+            elif column == 'Energy efficiency':
+                record[column] = value.capitalize()
+            else:
+                record[column] = value.lower()
+        return record
+
+
+def profile_signatures(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct rows of an encoded matrix and the signature id of every row.
+
+    A profile is a handful of categorical answers, so many users share an identical
+    vector; similarities only need computing between the distinct signatures.
+    """
+    if len(matrix) == 0:
+        return matrix[:0], np.zeros(0, dtype=np.int32)
+    signatures, inverse = np.unique(matrix, axis=0, return_inverse=True)
+    return signatures, inverse.reshape(-1).astype(np.int32)
+
+
+# The process-wide compiled schema
+FEATURE_SCHEMA = FeatureSchema()
+
+
+def encode_profile(profile: Dict[str, Any]) -> EncodedProfile:
+    """Encode a request's profile once so every consumer can reuse it"""
+    return FEATURE_SCHEMA.encode(profile)
+
+
+def encode_profiles(profiles: Iterable[Dict[str, Any]]) -> Tuple[np.ndarray, csr_matrix]:
+    """Dense impact matrix and sparse one-hot matrix of a population"""
+    codes = FEATURE_SCHEMA.codes_many(list(profiles))
+    return FEATURE_SCHEMA.dense_from_codes(codes), FEATURE_SCHEMA.onehot_from_codes(codes)
@@ -6,10 +6,14 @@ from .carbon_calculator import CarbonCalculator
 from .challenge_service import ChallengeService
 from .recommendation import RecommendationEngine
 from .data_loader import DataLoader
+from .user_cache import UserDataCache
+from .footprint_writer import FootprintHistoryWriter
 
 __all__ = [
     'CarbonCalculator',
     'ChallengeService',
     'RecommendationEngine',
-    'DataLoader'
+    'DataLoader',
+    'UserDataCache',
+    'FootprintHistoryWriter'
 ] 
\ No newline at end of file
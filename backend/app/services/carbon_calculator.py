@@ -1,13 +1,19 @@
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Optional
 import joblib
 import os
 import pandas as pd
 from .ml_service import MLService
+from ..ml.feature_schema import (
+    FEATURE_SCHEMA, EncodedProfile, DATASET_CATEGORICAL_COLUMNS, DATASET_NUMERICAL_COLUMNS
+)
 
 class CarbonCalculator:
-    def __init__(self):
-        self.ml_service = MLService()
+    def __init__(self, ml_service: Optional[MLService] = None):
+        # The API passes its own MLService so footprints and recommendations use one model and
+        # similarity state; a calculator without one (pool workers, scripts) owns a private copy
+        self.owns_ml_service = ml_service is None
+        self.ml_service = ml_service if ml_service is not None else MLService()
         self.categories = ["diet", "transportation", "housing", "lifestyle", "waste"]
         # Load pre-trained model, label encoders, and scaler if exist
         base_dir = os.path.join(os.path.dirname(__file__), "../../models")
@@ -15,89 +21,82 @@ class CarbonCalculator:
         self.label_encoders_path = os.path.join(base_dir, "label_encoders.joblib")
         self.scaler_path = os.path.join(base_dir, "scaler.joblib")
         try:
-            self.model = joblib.load(self.model_path)
-        except:
-            self.model = None
-        try:
-            self.label_encoders = joblib.load(self.label_encoders_path)
-        except:
-            self.label_encoders = None
-        try:
-            self.scaler = joblib.load(self.scaler_path)
-        except:
-            self.scaler = None
+            self.legacy_models = self._load_legacy_models(base_dir)
+        except Exception as e:
+            # Startup keeps serving without them; a reload reports the same failure instead
+            print(f"[CarbonCalculator] Could not load legacy models: {str(e)}")
+            self.legacy_models = {"model": None, "label_encoders": None, "scaler": None}
+
+    @staticmethod
+    def _load_legacy_models(model_dir: str) -> Dict:
+        """Load the legacy artifacts; a missing file is None, an unreadable one raises"""
+        legacy_models = {}
+        for key, file_name in (("model", "carbon_model.joblib"),
+                               ("label_encoders", "label_encoders.joblib"),
+                               ("scaler", "scaler.joblib")):
+            path = os.path.join(model_dir, file_name)
+            if not os.path.exists(path):
+                legacy_models[key] = None
+                continue
+            try:
+                legacy_models[key] = joblib.load(path)
+            except Exception as e:
+                raise ValueError(f"Could not load {file_name}: {str(e)}") from e
+        return legacy_models
+
+    # Legacy whole-footprint artifacts, swapped together with the category models
+    @property
+    def model(self):
+        return self.legacy_models["model"]
 
-    def _encode_user_data(self, user_data: Dict) -> pd.DataFrame:
-        # Kategorik ve sayısal encoding işlemleri
-        processed_data = {}
-        # Kategorik değişkenler
-        categorical_columns = [
-            'Body Type', 'Sex', 'Diet', 'How Often Shower',
-            'Heating Energy Source', 'Transport', 'Vehicle Type',
-            'Social Activity', 'Waste Bag Size', 'Energy efficiency',
-            'Recycling'
-        ]
-        # Android'den gelen field mapping
-        android_to_model = {
-            'diet_type': 'Diet',
-            'transportation_mode': 'Transport',
-            'vehicle_type': 'Vehicle Type',
-            'heating_source': 'Heating Energy Source',
-            'home_energy_efficiency': 'Energy efficiency',
-            'shower_frequency': 'How Often Shower',
-            'screen_time': 'How Long TV PC Daily Hour',
-            'internet_usage': 'How Long Internet Daily Hour',
-            'clothes_purchases': 'How Many New Clothes Monthly',
-            'recycling': 'Recycling',
-            'trash_bag_size': 'Waste Bag Size',
+    @property
+    def label_encoders(self):
+        return self.legacy_models["label_encoders"]
+
+    @property
+    def scaler(self):
+        return self.legacy_models["scaler"]
+
+    def load_bundle(self, model_dir: str, version: str) -> Dict:
+        """Load the calculator's model set for a version without touching the active one"""
+        return {
+            # A shared MLService is registered (and reloaded) on its own
+            "ml": self.ml_service.load_bundle(model_dir, version) if self.owns_ml_service else None,
+            "legacy": self._load_legacy_models(model_dir)
         }
-        # Kategorik encoding
-        for android_key, model_key in android_to_model.items():
-            if model_key in categorical_columns:
-                if android_key in user_data:
-                    value = user_data[android_key]
-                    if isinstance(value, str):
-                        processed_data[model_key] = value.strip().title()
-                    else:
-                        processed_data[model_key] = value # Keep non-string values as is
-        # Sayısal encoding (örnek: hepsi 0 olarak atanacak çünkü Android'de yok)
-        numerical_columns = [
-            'Monthly Grocery Bill', 'Vehicle Monthly Distance Km',
-            'Waste Bag Weekly Count', 'How Long TV PC Daily Hour',
-            'How Many New Clothes Monthly', 'How Long Internet Daily Hour'
-        ]
-        for col in numerical_columns:
-            if col in ['How Long TV PC Daily Hour', 'How Many New Clothes Monthly', 'How Long Internet Daily Hour']:
-                for android_key, model_key in android_to_model.items():
-                    if model_key == col and android_key in user_data:
-                        # Already handled in categorical, ensure consistent format if it's a number
-                        if isinstance(user_data[android_key], (int, float)):
-                            processed_data[model_key] = user_data[android_key]
-                        elif isinstance(user_data[android_key], str):
-                            # If it's a string that should be numeric, try to convert
-                            try:
-                                processed_data[model_key] = float(user_data[android_key])
-                            except ValueError:
-                                processed_data[model_key] = 0.0 # Default to 0 if conversion fails
-                        else:
-                            processed_data[model_key] = 0.0
-            else:
-                processed_data[col] = 0.0 # Default for non-existent numerical features
 
+    def smoke_test(self, bundle: Dict, profile: Dict):
+        if bundle["ml"] is not None:
+            self.ml_service.smoke_test(bundle["ml"], profile)
+
+    def activate(self, bundle: Dict):
+        if bundle["ml"] is not None:
+            self.ml_service.activate(bundle["ml"])
+        self.legacy_models = bundle["legacy"]
+
+    def _encode_user_data(self, user_data: Dict, encoded: Optional[EncodedProfile] = None) -> pd.DataFrame:
+        # Android alanları ortak özellik şeması üzerinden veri seti sütunlarına eşlenir
+        record = FEATURE_SCHEMA.ensure(user_data, encoded).dataset_record
         # Eksik sütunları 0 ile doldur
-        all_features = categorical_columns + numerical_columns
-        for col in all_features:
-            if col not in processed_data:
-                processed_data[col] = 0
+        processed_data = {
+            col: record.get(col) if record.get(col) is not None else 0
+            for col in DATASET_CATEGORICAL_COLUMNS + DATASET_NUMERICAL_COLUMNS
+        }
         
         # DataFrame oluştur
         X_pred = pd.DataFrame([processed_data])
         return X_pred
 
-    def calculate(self, user_data: Dict) -> Dict:
+    def calculate(self, user_data: Dict, encoded: Optional[EncodedProfile] = None,
+                  with_recommendations: bool = True) -> Dict:
         """
         Calculate carbon footprint based on user data using ML models
+
+        with_recommendations=False skips the neighbour lookup, for callers that fetch
+        recommendations themselves once the profile has been saved.
         """
+        # Encode the profile once for all category models
+        encoded = FEATURE_SCHEMA.ensure(user_data, encoded)
         footprint = {
             "total_footprint": 0.0,
             "breakdown": {},
@@ -107,7 +106,7 @@ class CarbonCalculator:
         # Try to use ML models for each category
         for category in self.categories:
             try:
-                category_footprint = self.ml_service.predict_category_footprint(category, user_data)
+                category_footprint = self.ml_service.predict_category_footprint(category, user_data, encoded)
                 footprint["breakdown"][category] = category_footprint
                 footprint["total_footprint"] += category_footprint
                 print(f"[CarbonCalculator] Category {category} footprint: {category_footprint}")  # Debug log
@@ -128,6 +127,9 @@ class CarbonCalculator:
         print(f"[CarbonCalculator] Final footprint breakdown before recommendations: {footprint['breakdown']}")  # Debug log
         print(f"[CarbonCalculator] Final total footprint before recommendations: {footprint['total_footprint']}") # Debug log
         
+        if not with_recommendations:
+            return footprint
+        
         # Get personalized recommendations
         try:
             recommendations = self.ml_service.get_recommendations(user_data["userId"])
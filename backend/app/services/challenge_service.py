@@ -1,333 +1,116 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Set, Tuple
+from types import MappingProxyType
+from pathlib import Path
+import json
+import os
 from firebase_admin import firestore
 from ..ml.collaborative_filter import CollaborativeFilter
 
+DEFAULT_CATALOG_PATH = Path(__file__).parent.parent.parent / 'data' / 'challenges.json'
+
+
+class ChallengeCatalog:
+    """Immutable, pre-indexed view of the challenge definitions"""
+
+    def __init__(self, challenges_by_category: Dict[str, List[Dict]]):
+        all_challenges = []
+        by_category = {}
+        by_difficulty = {}
+        for category, category_challenges in challenges_by_category.items():
+            by_category[category] = tuple(category_challenges)
+            for challenge in category_challenges:
+                all_challenges.append(challenge)
+                by_difficulty.setdefault(challenge["difficulty"], []).append(challenge)
+
+        self.all = tuple(all_challenges)
+        self.by_id = MappingProxyType({c["id"]: c for c in self.all})
+        self.by_title = MappingProxyType({c["title"]: c for c in self.all})
+        self.by_category = MappingProxyType(by_category)
+        self.by_difficulty = MappingProxyType({k: tuple(v) for k, v in by_difficulty.items()})
+
+        # The listing endpoints return the same payload every time, so serialize it once
+        self.category_responses = MappingProxyType({
+            category: self._serialize_listing(challenges)
+            for category, challenges in self.by_category.items()
+        })
+        self.difficulty_responses = MappingProxyType({
+            difficulty: self._serialize_listing(challenges)
+            for difficulty, challenges in self.by_difficulty.items()
+        })
+        self.empty_response = self._serialize_listing(())
+
+    @staticmethod
+    def _serialize_listing(challenges) -> bytes:
+        return json.dumps([
+            {
+                "challenge_id": c["id"],
+                "title": c["title"],
+                "description": c["description"],
+                "category": c["category"],
+                "difficulty": c["difficulty"],
+                "carbon_savings": float(c["carbon_savings"]),
+                "duration_days": int(c["duration_days"]),
+                "score": 1.0  # Default score for category/difficulty listing
+            }
+            for c in challenges
+        ]).encode("utf-8")
+
+    @classmethod
+    def from_file(cls, path) -> "ChallengeCatalog":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+
 class ChallengeService:
-    def __init__(self):
+    def __init__(self, catalog_path: Optional[str] = None,
+                 collaborative_filter: Optional[CollaborativeFilter] = None):
         self.db = firestore.client()
-        self.collaborative_filter = CollaborativeFilter()
-        
+        self.collaborative_filter = collaborative_filter or CollaborativeFilter()
+        self.catalog_path = catalog_path or os.getenv("CHALLENGES_PATH", str(DEFAULT_CATALOG_PATH))
+
         # Predefined challenges with categories and difficulty levels
-        self.challenges = {
-            "diet": [
-                {
-                    "id": "diet_1",
-                    "title": "Meatless Monday",
-                    "description": "Go meat-free every Monday for a month",
-                    "category": "diet",
-                    "difficulty": "easy",
-                    "carbon_savings": 2.5,  # kg CO2 per week
-                    "duration_days": 30
-                },
-                {
-                    "id": "diet_2",
-                    "title": "Local Produce Week",
-                    "description": "Eat only locally grown produce for one week",
-                    "category": "diet",
-                    "difficulty": "medium",
-                    "carbon_savings": 3.0,
-                    "duration_days": 7
-                },
-                {
-                    "id": "diet_3",
-                    "title": "Vegan Challenge",
-                    "description": "Try a vegan diet for two weeks",
-                    "category": "diet",
-                    "difficulty": "hard",
-                    "carbon_savings": 5.0,
-                    "duration_days": 14
-                },
-                {
-                    "id": "diet_4",
-                    "title": "Plant-Based Meal",
-                    "description": "Try a completely plant-based meal today",
-                    "category": "diet",
-                    "difficulty": "easy",
-                    "carbon_savings": 3.5,
-                    "duration_days": 1
-                },
-                {
-                    "id": "diet_5",
-                    "title": "Reduce Meat Consumption",
-                    "description": "Skip meat for one meal today",
-                    "category": "diet",
-                    "difficulty": "medium",
-                    "carbon_savings": 2.0,
-                    "duration_days": 1
-                },
-                {
-                    "id": "diet_6",
-                    "title": "Local Produce Challenge",
-                    "description": "Buy only locally grown produce today",
-                    "category": "diet",
-                    "difficulty": "easy",
-                    "carbon_savings": 2.5,
-                    "duration_days": 1
-                },
-                {
-                    "id": "diet_7",
-                    "title": "Vegan Day Challenge",
-                    "description": "Go completely vegan for one day",
-                    "category": "diet",
-                    "difficulty": "hard",
-                    "carbon_savings": 5.0,
-                    "duration_days": 1
-                }
-            ],
-            "transportation": [
-                {
-                    "id": "transport_1",
-                    "title": "Bike to Work",
-                    "description": "Use a bicycle for commuting three times a week",
-                    "category": "transportation",
-                    "difficulty": "medium",
-                    "carbon_savings": 4.0,
-                    "duration_days": 30
-                },
-                {
-                    "id": "transport_2",
-                    "title": "Public Transport Week",
-                    "description": "Use only public transport for one week",
-                    "category": "transportation",
-                    "difficulty": "easy",
-                    "carbon_savings": 3.5,
-                    "duration_days": 7
-                },
-                {
-                    "id": "transport_3",
-                    "title": "Car-Free Month",
-                    "description": "Avoid using a car for an entire month",
-                    "category": "transportation",
-                    "difficulty": "hard",
-                    "carbon_savings": 15.0,
-                    "duration_days": 30
-                },
-                {
-                    "id": "transport_4",
-                    "title": "Walk or Bike",
-                    "description": "Choose walking or biking instead of driving for short trips",
-                    "category": "transportation",
-                    "difficulty": "easy",
-                    "carbon_savings": 2.0,
-                    "duration_days": 1
-                },
-                {
-                    "id": "transport_5",
-                    "title": "Public Transport",
-                    "description": "Use public transport instead of private car",
-                    "category": "transportation",
-                    "difficulty": "medium",
-                    "carbon_savings": 2.5,
-                    "duration_days": 1
-                },
-                {
-                    "id": "transport_6",
-                    "title": "Carpool Challenge",
-                    "description": "Share a ride with someone today",
-                    "category": "transportation",
-                    "difficulty": "medium",
-                    "carbon_savings": 2.0,
-                    "duration_days": 1
-                },
-                {
-                    "id": "transport_7",
-                    "title": "No Car Day",
-                    "description": "Don't use your car at all today",
-                    "category": "transportation",
-                    "difficulty": "hard",
-                    "carbon_savings": 4.0,
-                    "duration_days": 1
-                }
-            ],
-            "energy": [
-                {
-                    "id": "energy_1",
-                    "title": "Power Down Hour",
-                    "description": "Turn off all non-essential electronics for one hour daily",
-                    "category": "energy",
-                    "difficulty": "easy",
-                    "carbon_savings": 1.0,
-                    "duration_days": 30
-                },
-                {
-                    "id": "energy_2",
-                    "title": "Smart Thermostat",
-                    "description": "Optimize your home temperature settings",
-                    "category": "energy",
-                    "difficulty": "medium",
-                    "carbon_savings": 2.5,
-                    "duration_days": 30
-                },
-                {
-                    "id": "energy_3",
-                    "title": "Renewable Energy Switch",
-                    "description": "Switch to a renewable energy provider",
-                    "category": "energy",
-                    "difficulty": "hard",
-                    "carbon_savings": 20.0,
-                    "duration_days": 365
-                },
-                {
-                    "id": "energy_4",
-                    "title": "Energy Saver",
-                    "description": "Turn off lights and unplug devices when not in use",
-                    "category": "energy",
-                    "difficulty": "easy",
-                    "carbon_savings": 1.0,
-                    "duration_days": 1
-                },
-                {
-                    "id": "energy_5",
-                    "title": "Temperature Control",
-                    "description": "Reduce heating/cooling by 2 degrees",
-                    "category": "energy",
-                    "difficulty": "medium",
-                    "carbon_savings": 1.5,
-                    "duration_days": 1
-                },
-                {
-                    "id": "energy_6",
-                    "title": "LED Bulb Switch",
-                    "description": "Replace one regular bulb with LED today",
-                    "category": "energy",
-                    "difficulty": "easy",
-                    "carbon_savings": 0.5,
-                    "duration_days": 1
-                },
-                {
-                    "id": "energy_7",
-                    "title": "Energy Audit",
-                    "description": "Conduct a home energy audit today",
-                    "category": "energy",
-                    "difficulty": "hard",
-                    "carbon_savings": 2.0,
-                    "duration_days": 1
-                }
-            ],
-            "waste": [
-                {
-                    "id": "waste_1",
-                    "title": "Zero Waste Week",
-                    "description": "Minimize waste production for one week",
-                    "category": "waste",
-                    "difficulty": "medium",
-                    "carbon_savings": 2.0,
-                    "duration_days": 7
-                },
-                {
-                    "id": "waste_2",
-                    "title": "Recycling Master",
-                    "description": "Properly sort and recycle all waste for a month",
-                    "category": "waste",
-                    "difficulty": "easy",
-                    "carbon_savings": 1.5,
-                    "duration_days": 30
-                },
-                {
-                    "id": "waste_3",
-                    "title": "Compost Challenge",
-                    "description": "Start composting organic waste",
-                    "category": "waste",
-                    "difficulty": "hard",
-                    "carbon_savings": 3.0,
-                    "duration_days": 90
-                },
-                {
-                    "id": "waste_4",
-                    "title": "Zero Waste Meal",
-                    "description": "Prepare a meal using all ingredients with no waste",
-                    "category": "waste",
-                    "difficulty": "medium",
-                    "carbon_savings": 1.5,
-                    "duration_days": 1
-                },
-                {
-                    "id": "waste_5",
-                    "title": "Recycle More",
-                    "description": "Properly separate and recycle all waste today",
-                    "category": "waste",
-                    "difficulty": "easy",
-                    "carbon_savings": 1.0,
-                    "duration_days": 1
-                },
-                {
-                    "id": "waste_6",
-                    "title": "Zero Waste Day",
-                    "description": "Produce no waste at all today",
-                    "category": "waste",
-                    "difficulty": "hard",
-                    "carbon_savings": 2.5,
-                    "duration_days": 1
-                }
-            ],
-            "lifestyle": [
-                {
-                    "id": "lifestyle_1",
-                    "title": "Digital Detox",
-                    "description": "Reduce screen time by 50% for a week",
-                    "category": "lifestyle",
-                    "difficulty": "medium",
-                    "carbon_savings": 1.0,
-                    "duration_days": 7
-                },
-                {
-                    "id": "lifestyle_2",
-                    "title": "Second-Hand Shopping",
-                    "description": "Buy only second-hand items for a month",
-                    "category": "lifestyle",
-                    "difficulty": "hard",
-                    "carbon_savings": 4.0,
-                    "duration_days": 30
-                },
-                {
-                    "id": "lifestyle_3",
-                    "title": "Water Conservation",
-                    "description": "Reduce water usage by 25% for two weeks",
-                    "category": "lifestyle",
-                    "difficulty": "easy",
-                    "carbon_savings": 1.5,
-                    "duration_days": 14
-                },
-                {
-                    "id": "lifestyle_4",
-                    "title": "Reduce Water Usage",
-                    "description": "Take shorter showers and turn off taps when not in use",
-                    "category": "lifestyle",
-                    "difficulty": "easy",
-                    "carbon_savings": 0.8,
-                    "duration_days": 1
-                },
-                {
-                    "id": "lifestyle_5",
-                    "title": "Minimalist Challenge",
-                    "description": "Don't buy anything non-essential today",
-                    "category": "lifestyle",
-                    "difficulty": "medium",
-                    "carbon_savings": 1.0,
-                    "duration_days": 1
-                }
-            ]
-        }
+        self.catalog = ChallengeCatalog.from_file(self.catalog_path)
+
+    def reload_catalog(self) -> int:
+        """Re-read the challenge data file and swap the catalog in one assignment"""
+        catalog = ChallengeCatalog.from_file(self.catalog_path)
+        self.catalog = catalog
+        print(f"[ChallengeService] Reloaded {len(catalog.all)} challenges from {self.catalog_path}")
+        return len(catalog.all)
+
+    @property
+    def challenges(self):
+        return self.catalog.by_category
 
-    def get_all_challenges(self) -> List[Dict]:
+    def get_all_challenges(self) -> Tuple[Dict, ...]:
         """Get all available challenges"""
-        all_challenges = []
-        for category_challenges in self.challenges.values():
-            all_challenges.extend(category_challenges)
-        return all_challenges
+        return self.catalog.all
 
-    def get_challenges_by_category(self, category: str) -> List[Dict]:
+    def get_challenges_by_category(self, category: str) -> Tuple[Dict, ...]:
         """Get challenges for a specific category"""
-        return self.challenges.get(category, [])
+        return self.catalog.by_category.get(category, ())
 
-    def get_challenges_by_difficulty(self, difficulty: str) -> List[Dict]:
+    def get_challenges_by_difficulty(self, difficulty: str) -> Tuple[Dict, ...]:
         """Get challenges for a specific difficulty level"""
-        return [
-            challenge
-            for category_challenges in self.challenges.values()
-            for challenge in category_challenges
-            if challenge["difficulty"] == difficulty
-        ]
+        return self.catalog.by_difficulty.get(difficulty, ())
+
+    def get_category_response(self, category: str) -> bytes:
+        """Pre-serialized listing for a category"""
+        catalog = self.catalog
+        return catalog.category_responses.get(category, catalog.empty_response)
+
+    def get_difficulty_response(self, difficulty: str) -> bytes:
+        """Pre-serialized listing for a difficulty level"""
+        catalog = self.catalog
+        return catalog.difficulty_responses.get(difficulty, catalog.empty_response)
+
+    def get_challenge_by_id(self, challenge_id: str) -> Optional[Dict]:
+        """Get a challenge by its ID"""
+        return self.catalog.by_id.get(challenge_id)
+
+    def get_challenge_by_title(self, title: str) -> Optional[Dict]:
+        """Get a challenge by its title"""
+        return self.catalog.by_title.get(title)
 
     def get_recommended_challenges(self, user_data: Dict, n_recommendations: int = 5) -> List[Dict]:
         """Get personalized challenge recommendations"""
@@ -340,24 +123,16 @@ class ChallengeService:
         if cf_recommendations:
             return [
                 {
-                    "challenge": self._get_challenge_by_id(rec["challenge_id"]),
+                    "challenge": self.get_challenge_by_id(rec["challenge_id"]),
                     "score": rec["score"]
                 }
                 for rec in cf_recommendations
-                if self._get_challenge_by_id(rec["challenge_id"])
+                if self.get_challenge_by_id(rec["challenge_id"])
             ]
         
         # Fallback to rule-based recommendations based on user data
         return self._get_rule_based_recommendations(user_data, n_recommendations)
 
-    def _get_challenge_by_id(self, challenge_id: str) -> Dict:
-        """Get a challenge by its ID"""
-        for category_challenges in self.challenges.values():
-            for challenge in category_challenges:
-                if challenge["id"] == challenge_id:
-                    return challenge
-        return None
-
     def _get_rule_based_recommendations(self, user_data: Dict, n_recommendations: int) -> List[Dict]:
         """Get recommendations based on user data and predefined rules"""
         recommendations = []
@@ -366,7 +141,7 @@ class ChallengeService:
         if user_data.get("diet_type") in ["Omnivore", "Pescatarian"]:
             recommendations.extend([
                 {"challenge": challenge, "score": 0.9}
-                for challenge in self.challenges["diet"]
+                for challenge in self.challenges.get("diet", ())
                 if challenge["difficulty"] == "easy"
             ])
         
@@ -374,7 +149,7 @@ class ChallengeService:
         if user_data.get("vehicle_type") in ["Petrol", "Diesel"]:
             recommendations.extend([
                 {"challenge": challenge, "score": 0.8}
-                for challenge in self.challenges["transportation"]
+                for challenge in self.challenges.get("transportation", ())
                 if challenge["difficulty"] == "medium"
             ])
         
@@ -382,7 +157,7 @@ class ChallengeService:
         if user_data.get("home_energy_efficiency") == "No":
             recommendations.extend([
                 {"challenge": challenge, "score": 0.85}
-                for challenge in self.challenges["energy"]
+                for challenge in self.challenges.get("energy", ())
                 if challenge["difficulty"] == "easy"
             ])
         
@@ -390,7 +165,7 @@ class ChallengeService:
         if user_data.get("recycling") == "I do not recycle":
             recommendations.extend([
                 {"challenge": challenge, "score": 0.75}
-                for challenge in self.challenges["waste"]
+                for challenge in self.challenges.get("waste", ())
                 if challenge["difficulty"] == "easy"
             ])
         
@@ -398,7 +173,7 @@ class ChallengeService:
         if user_data.get("screen_time") in ["8-16 hours", "More than 16 hours"]:
             recommendations.extend([
                 {"challenge": challenge, "score": 0.7}
-                for challenge in self.challenges["lifestyle"]
+                for challenge in self.challenges.get("lifestyle", ())
                 if challenge["difficulty"] == "medium"
             ])
         
@@ -408,7 +183,7 @@ class ChallengeService:
 
     def start_challenge(self, user_id: str, challenge_id: str) -> Dict:
         """Start a new challenge for a user"""
-        challenge = self._get_challenge_by_id(challenge_id)
+        challenge = self.get_challenge_by_id(challenge_id)
         if not challenge:
             raise ValueError(f"Challenge {challenge_id} not found")
         
@@ -440,7 +215,7 @@ class ChallengeService:
             raise ValueError(f"User challenge {user_challenge_id} not found")
         
         challenge_data = doc.to_dict()
-        challenge = self._get_challenge_by_id(challenge_data["challengeId"])
+        challenge = self.get_challenge_by_id(challenge_data["challengeId"])
         
         # Update progress
         new_progress = min(100, max(0, progress))
@@ -471,11 +246,28 @@ class ChallengeService:
         user_challenges = []
         for doc in challenges_ref:
             challenge_data = doc.to_dict()
-            challenge = self._get_challenge_by_id(challenge_data["challengeId"])
+            challenge = self.get_challenge_by_id(challenge_data["challengeId"])
             if challenge:
                 user_challenges.append({
                     "challenge": challenge,
                     "user_challenge": {**challenge_data, "id": doc.id}
                 })
         
-        return user_challenges 
\ No newline at end of file
+        return user_challenges
+
+    def get_completed_challenge_ids(self, user_id: str) -> Set[str]:
+        """IDs of the challenges a user has completed, read from Firestore.
+
+        Completions land either on a user_challenges record (progress reached 100) or in
+        completed_challenges (completed by title), so both collections are checked.
+        """
+        completed = set()
+        for doc in self.db.collection("user_challenges").where("userId", "==", user_id).stream():
+            record = doc.to_dict()
+            if record.get("completed"):
+                completed.add(record.get("challengeId"))
+        for doc in self.db.collection("completed_challenges").where("userId", "==", user_id).stream():
+            challenge = self.get_challenge_by_title(doc.to_dict().get("challenge_title", ""))
+            if challenge:
+                completed.add(challenge["id"])
+        return completed
@@ -0,0 +1,317 @@
+import asyncio
+import contextlib
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+from ..ml.carbon_model import CarbonFootprintModel
+from ..ml.collaborative_filter import CollaborativeFilter
+from .carbon_calculator import CarbonCalculator
+from .ml_service import MLService
+from .model_registry import ModelRegistry
+from .shared_state import SharedArrayStore
+
+
+class CPUTaskTimeout(TimeoutError):
+    """A pooled task did not finish within its timeout"""
+
+
+class WorkerContext:
+    """The model-backed components a task runs against.
+
+    In the API process these are the app's singletons; in a pool process they are the
+    worker's own copies, loaded once by the pool initializer.
+    """
+
+    def __init__(self, carbon_calculator=None, carbon_model=None, similarity_store=None, model_registry=None):
+        self.carbon_calculator = carbon_calculator
+        self.carbon_model = carbon_model
+        self.similarity_store = similarity_store
+        self.model_registry = model_registry
+
+
+# Set in each pool process by _init_worker
+_worker_context: Optional[WorkerContext] = None
+
+
+def _init_worker(store_name: str, store_root: str):
+    global _worker_context
+    store = SharedArrayStore(store_name, store_root)
+    context = WorkerContext(
+        carbon_calculator=CarbonCalculator(),
+        carbon_model=CarbonFootprintModel(),
+        similarity_store=store,
+        # Workers never watch the pointer themselves; each task names the version to use
+        model_registry=ModelRegistry(poll_interval=0)
+    )
+    context.model_registry.register("carbon_calculator", context.carbon_calculator)
+    context.model_registry.register("carbon_model", context.carbon_model)
+    _worker_context = context
+
+
+def _run_in_worker(task: Callable, model_version: Optional[str], args: tuple) -> Any:
+    context = _worker_context
+    if model_version is not None and model_version != context.model_registry.active_version:
+        context.model_registry.reload(model_version, publish=False)
+    return task(context, *args)
+
+
+def _ping(_context: WorkerContext) -> int:
+    return os.getpid()
+
+
+# Tasks: module-level so they can be sent to a pool process by reference
+
+def calculate_footprint_task(context: WorkerContext, user_data: Dict, encoded=None,
+                             with_recommendations: bool = True) -> Dict:
+    return context.carbon_calculator.calculate(user_data, encoded, with_recommendations)
+
+
+def predict_task(context: WorkerContext, profiles: List[Dict], encoded=None) -> Any:
+    return context.carbon_model.predict_many(profiles, encoded)
+
+
+def score_profiles_task(context: WorkerContext, profiles: List[Dict], with_emission: bool = False) -> List[Dict]:
+    """Footprint of a chunk of profiles: category models with the rule-based fallback.
+
+    Returns one flat row per profile; with_emission adds the CarbonFootprintModel estimate.
+    A profile that cannot be scored gets a row with an "error" instead of failing the chunk.
+    """
+    calculator = context.carbon_calculator
+    rows, scored = [], []
+    # The calculator logs every category of every profile, which would flood a batch run
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for profile in profiles:
+            try:
+                footprint = calculator.calculate(profile, with_recommendations=False)
+            except Exception as e:
+                rows.append({"userId": profile.get("userId"), "error": f"{type(e).__name__}: {str(e)}"})
+                continue
+            row = {
+                "userId": profile.get("userId"),
+                "total_footprint": footprint["total_footprint"],
+                **{f"{category}_footprint": value for category, value in footprint["breakdown"].items()}
+            }
+            rows.append(row)
+            scored.append((row, profile))
+    if with_emission and scored and context.carbon_model is not None and context.carbon_model.is_ready:
+        emissions = context.carbon_model.predict_many([profile for _, profile in scored])
+        for (row, _), emission in zip(scored, emissions):
+            row["predicted_emission"] = float(emission)
+    return rows
+
+
+def build_similarity_task(context: WorkerContext, users: List[Dict]) -> int:
+    """Rebuild the similarity state and publish it; only the generation number travels back.
+
+    The arrays are written straight into the shared store and memory-mapped by
+    the API workers, so they are never pickled across the process boundary. Nothing
+    live is modified here: services pick the new generation up in sync_shared().
+    """
+    ml_arrays, ml_meta = MLService.build_shared(users)
+    cf_arrays, cf_meta = CollaborativeFilter.build_shared(users)
+    return context.similarity_store.publish({**ml_arrays, **cf_arrays}, {**ml_meta, **cf_meta})
+
+
+def _settle(outer: Future, inner: Future):
+    """Copy a finished result onto outer; BrokenProcessPool is raised to the caller instead"""
+    if outer.done():
+        return
+    try:
+        result = inner.result()
+    except BrokenProcessPool:
+        raise
+    except BaseException as e:
+        _fail(outer, e)
+        return
+    try:
+        outer.set_result(result)
+    except InvalidStateError:
+        pass  # Cancelled by the caller (e.g. its timeout) meanwhile
+
+
+def _settle_or_fail(outer: Future, inner: Future):
+    try:
+        _settle(outer, inner)
+    except BrokenProcessPool as e:
+        _fail(outer, e)
+
+
+def _fail(outer: Future, error: BaseException):
+    try:
+        if not outer.done():
+            outer.set_exception(error)
+    except InvalidStateError:
+        pass
+
+
+def _in_thread(func: Callable, *args):
+    return asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+
+class CPUPool:
+    """Process pool for CPU-bound inference and similarity work.
+
+    With workers=0 (the default) tasks run in a thread pool against the API process's own
+    components, which keeps the event loop free but still shares the GIL. run, run_sync
+    and run_in_thread are bounded by a timeout; submit hands back a future for the caller
+    to wait on. A task that times out keeps its thread or worker busy until it finishes,
+    since running tasks cannot be cancelled. When a worker process dies (e.g. OOM) the
+    pool is replaced and the tasks it took down are run once more.
+    """
+
+    def __init__(self, local_context: WorkerContext, workers: int = 0, timeout: float = 10.0,
+                 model_registry=None):
+        self.local_context = local_context
+        self.workers = max(0, workers)
+        self.timeout = timeout
+        self.model_registry = model_registry
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Used by submit and run_sync when there are no worker processes
+        self._local_executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        """Start the worker processes and load their models in the background"""
+        with self._lock:
+            if self.workers == 0 or self._executor is not None:
+                return
+            store = self.local_context.similarity_store
+            # spawn: the API process runs threads (Firestore, writers) that must not be forked
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(store.name, str(store.directory.parent))
+            )
+            executor = self._executor
+        for _ in range(self.workers):
+            executor.submit(_run_in_worker, _ping, None, ())
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            local_executor, self._local_executor = self._local_executor, None
+        for pool in (executor, local_executor):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def restart(self):
+        """Replace the workers, e.g. after models were retrained in place"""
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def _submit(self, task: Callable, args: tuple, retry: bool = True) -> Future:
+        """Submit to the worker processes; a task lost to a dead worker is run once more"""
+        version = self.model_registry.active_version if self.model_registry is not None else None
+        with self._lock:
+            executor = self._executor
+        if executor is None:
+            return self._submit_local(task, args)
+        self.submitted += 1
+        try:
+            inner = executor.submit(_run_in_worker, task, version, args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM) before this call; start a fresh pool and use that
+            self._replace_broken(executor)
+            if not retry:
+                raise
+            return self._submit(task, args, retry=False)
+
+        outer = Future()
+
+        def finished(future: Future):
+            try:
+                _settle(outer, future)
+            except BrokenProcessPool as e:
+                # The worker died while running it; later calls would all fail the same way
+                self._replace_broken(executor)
+                if not retry:
+                    _fail(outer, e)
+                    return
+                try:
+                    self._submit(task, args, retry=False).add_done_callback(
+                        lambda retried: _settle_or_fail(outer, retried))
+                except Exception as e:
+                    _fail(outer, e)
+
+        inner.add_done_callback(finished)
+        return outer
+
+    def _replace_broken(self, executor: ProcessPoolExecutor):
+        """Restart the pool once per broken executor, however many calls saw it break"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        self.restarts += 1
+        print("[CPUPool] A worker process died, restarting the pool")
+        self.start()
+
+    def _submit_local(self, task: Callable, args: tuple) -> Future:
+        with self._lock:
+            if self._local_executor is None:
+                self._local_executor = ThreadPoolExecutor(thread_name_prefix="cpu-pool")
+            executor = self._local_executor
+        self.submitted += 1
+        return executor.submit(task, self.local_context, *args)
+
+    async def run(self, task: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """Run a task without blocking the event loop"""
+        timeout = timeout or self.timeout
+        try:
+            if self._executor is None:
+                return await asyncio.wait_for(_in_thread(task, self.local_context, *args), timeout)
+            return await asyncio.wait_for(asyncio.wrap_future(self._submit(task, args)), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise CPUTaskTimeout(f"{task.__name__} did not finish within {timeout:.1f} s")
+
+    def submit(self, task: Callable, *args) -> Future:
+        """Queue a task without waiting, for batch callers that keep several in flight"""
+        if self._executor is None:
+            return self._submit_local(task, args)
+        return self._submit(task, args)
+
+    def run_sync(self, task: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """Run a task from a sync endpoint or a background thread"""
+        timeout = timeout or self.timeout
+        future = self._submit_local(task, args) if self._executor is None else self._submit(task, args)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            self.timeouts += 1
+            raise CPUTaskTimeout(f"{task.__name__} did not finish within {timeout:.1f} s")
+
+    async def run_in_thread(self, func: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """Thread-pool offload with the same timeout, for work bound to in-process state"""
+        timeout = timeout or self.timeout
+        try:
+            return await asyncio.wait_for(_in_thread(func, *args), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise CPUTaskTimeout(f"{getattr(func, '__name__', 'task')} did not finish within {timeout:.1f} s")
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "enabled": self.enabled,
+            "timeout_seconds": self.timeout,
+            "submitted": self.submitted,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts
+        }
@@ -1,35 +1,92 @@
+import re
 import pandas as pd
 import numpy as np
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestRegressor
 import joblib
 import os
+# Liste sütunu (ör. "['Stove', 'Oven']") ve hedef sütun ortak veri seti servisinde tanımlı
+from .dataset import LIST_COLUMN, TARGET_COLUMN, DatasetStore, get_dataset
+
+# Etiket olarak kodlanan sütunlar
+CATEGORICAL_COLUMNS = [
+    'Body Type', 'Sex', 'Diet', 'How Often Shower',
+    'Heating Energy Source', 'Transport', 'Vehicle Type',
+    'Social Activity', 'Waste Bag Size', 'Energy efficiency',
+    'Recycling'
+]
+NUMERICAL_COLUMNS = [
+    'Monthly Grocery Bill', 'Vehicle Monthly Distance Km',
+    'Waste Bag Weekly Count', 'How Long TV PC Daily Hour',
+    'How Many New Clothes Monthly', 'How Long Internet Daily Hour'
+]
+
+_LIST_ITEM = re.compile(r"""['"]([^'"]*)['"]""")
+
+
+def parse_list_literal(value) -> List[str]:
+    """Bir liste metnini (ör. "['Stove', 'Oven']") eval kullanmadan ayrıştırır."""
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    if not isinstance(value, str):
+        return []
+    return [item.strip() for item in _LIST_ITEM.findall(value) if item.strip()]
+
+
+def multi_hot(column: pd.Series) -> Tuple[np.ndarray, List[str]]:
+    """Liste sütununu (satır x değer) 0/1 matrisine çevirir.
+
+    Her farklı metin yalnızca bir kez ayrıştırılır; satırlar kategorik kodlar
+    üzerinden tek bir indeksleme ile doldurulur.
+    """
+    categorical = column if isinstance(column.dtype, pd.CategoricalDtype) else column.astype('category')
+    parsed = [parse_list_literal(value) for value in categorical.cat.categories]
+    values = sorted({item for items in parsed for item in items})
+    index = {value: i for i, value in enumerate(values)}
+    # Son satır eksik değerler (kod -1) için boş bir satırdır
+    table = np.zeros((len(parsed) + 1, len(values)), dtype=np.int8)
+    for row, items in enumerate(parsed):
+        table[row, [index[item] for item in items]] = 1
+    return table[categorical.cat.codes.to_numpy()], values
+
 
 class DataLoader:
-    def __init__(self):
-        self.data_path = Path(__file__).parent.parent.parent / 'data' / 'Carbon Emission.csv'
+    def __init__(self, data_path: Optional[Path] = None, verbose: bool = False,
+                 dataset: Optional[DatasetStore] = None):
+        self.data_path = Path(data_path) if data_path else Path(__file__).parent.parent.parent / 'data' / 'Carbon Emission.csv'
+        self.verbose = verbose
+        # CSV bir kez ayrıştırılır; sonraki açılışlar önbellekteki .npy dosyalarını eşler
+        self.dataset = dataset or get_dataset(self.data_path)
         self.data = None
         self.X = None
         self.y = None
         self.model = None
         self.label_encoders = {}
         self.scaler = StandardScaler()
+        self.cooking_methods: List[str] = []
+        # Eğitilmiş model başına bir kez hesaplanan özellik önemlilikleri
+        self._importance_model = None
+        self._feature_importance = None
+        self._feature_importance_records: List[Dict] = []
+        self._label_codes: Dict[str, Dict] = {}
         self.load_data()
         self.preprocess_data()
     
     def load_data(self):
         """CSV dosyasını yükler ve DataFrame'e dönüştürür."""
         try:
-            self.data = pd.read_csv(self.data_path)
-            print("Veri seti başarıyla yüklendi.")
-            print("\nVeri seti boyutu:", self.data.shape)
-            print("\nSütunlar:", self.data.columns.tolist())
-            print("\nVeri seti özeti:")
-            print(self.data.describe())
-            print("\nEksik değerler:")
-            print(self.data.isnull().sum())
+            self.data = self.dataset.frame()
+            if self.verbose:
+                print("Veri seti başarıyla yüklendi.")
+                print("\nVeri seti boyutu:", self.data.shape)
+                print("\nSütunlar:", self.data.columns.tolist())
+                print("\nVeri seti özeti:")
+                print(self.data.describe())
+                print("\nEksik değerler:")
+                print(self.data.isnull().sum())
         except Exception as e:
             print(f"Veri seti yüklenirken hata oluştu: {str(e)}")
     
@@ -37,54 +94,90 @@ class DataLoader:
         """Veriyi ön işler ve model için hazırlar."""
         try:
             # Hedef değişkeni ayır
-            self.y = self.data['CarbonEmission']
-            
-            # Kategorik değişkenleri sayısallaştır
-            categorical_columns = [
-                'Body Type', 'Sex', 'Diet', 'How Often Shower',
-                'Heating Energy Source', 'Transport', 'Vehicle Type',
-                'Social Activity', 'Waste Bag Size', 'Energy efficiency',
-                'Recycling'
-            ]
-            
-            # Cooking_With sütununu işle (liste formatında)
-            self.data['Cooking_With'] = self.data['Cooking_With'].apply(eval)
-            cooking_methods = set()
-            for methods in self.data['Cooking_With']:
-                cooking_methods.update(methods)
-            
-            # Her pişirme yöntemi için binary sütun oluştur
-            for method in cooking_methods:
-                self.data[f'Cooking_{method}'] = self.data['Cooking_With'].apply(
-                    lambda x: 1 if method in x else 0
-                )
+            self.y = self.data[TARGET_COLUMN]
             
-            # Kategorik değişkenleri dönüştür
-            for column in categorical_columns:
+            # Özellik matrisi veri seti sürümü başına bir kez üretilir ve önbellekten eşlenir
+            features, meta = self.dataset.cached_array('loader_features', self._build_features)
+            self.cooking_methods = meta['cooking_methods']
+            for column, classes in meta['label_classes'].items():
                 le = LabelEncoder()
-                self.data[column] = le.fit_transform(self.data[column])
+                # LabelEncoder eksik değeri en sona ayrı bir sınıf olarak ekler
+                le.classes_ = np.array([np.nan if c is None else c for c in classes], dtype=object)
                 self.label_encoders[column] = le
+                # Tekil tahminlerde LabelEncoder.transform yerine sözlük araması
+                self._label_codes[column] = {c: code for code, c in enumerate(classes)}
+            self.scaler = StandardScaler()
+            self.scaler.mean_ = np.array(meta['scaler']['mean'])
+            self.scaler.var_ = np.array(meta['scaler']['var'])
+            self.scaler.scale_ = np.array(meta['scaler']['scale'])
+            self.scaler.n_samples_seen_ = meta['scaler']['n_samples_seen']
+            self.scaler.n_features_in_ = len(NUMERICAL_COLUMNS)
+            self.scaler.feature_names_in_ = np.array(NUMERICAL_COLUMNS, dtype=object)
             
-            # Sayısal değişkenleri ölçeklendir
-            numerical_columns = [
-                'Monthly Grocery Bill', 'Vehicle Monthly Distance Km',
-                'Waste Bag Weekly Count', 'How Long TV PC Daily Hour',
-                'How Many New Clothes Monthly', 'How Long Internet Daily Hour'
-            ]
+            # Model için özellik matrisi (salt okunur, kopyalanmadan)
+            feature_columns = meta['columns']
+            self.X = pd.DataFrame(features, columns=feature_columns, index=self.data.index, copy=False)
             
-            self.data[numerical_columns] = self.scaler.fit_transform(self.data[numerical_columns])
+            # self.data önceki gibi kodlanmış/ölçeklenmiş sütunları içerir
+            for column in feature_columns:
+                values = self.X[column].to_numpy()
+                if column in NUMERICAL_COLUMNS:
+                    self.data[column] = values
+                else:
+                    self.data[column] = values.astype(np.int64 if column in CATEGORICAL_COLUMNS else np.int8)
             
-            # Model için özellik matrisini oluştur
-            feature_columns = categorical_columns + numerical_columns + [f'Cooking_{method}' for method in cooking_methods]
-            self.X = self.data[feature_columns]
-            
-            print("\nVeri ön işleme tamamlandı.")
-            print("Özellik sayısı:", len(feature_columns))
+            if self.verbose:
+                print("\nVeri ön işleme tamamlandı.")
+                print("Özellik sayısı:", len(feature_columns))
             
         except Exception as e:
             print(f"Veri ön işleme sırasında hata oluştu: {str(e)}")
     
-    def train_model(self):
+    def _build_features(self) -> Tuple[np.ndarray, Dict]:
+        """Ham veri setinden özellik matrisini ve dönüştürücü durumunu üretir."""
+        columns = []
+        label_classes = {}
+        
+        # Kategorik değişkenleri dönüştür: sıralı kategorilerin kodları LabelEncoder ile aynıdır
+        categorical_codes = []
+        for column in CATEGORICAL_COLUMNS:
+            categorical = self.data[column]
+            categories = sorted(categorical.cat.categories)
+            codes = categorical.cat.reorder_categories(categories).cat.codes.to_numpy().astype(np.int64)
+            classes = [str(c) for c in categories]
+            if (codes < 0).any():
+                codes[codes < 0] = len(categories)
+                classes.append(None)
+            categorical_codes.append(codes)
+            label_classes[column] = classes
+        columns += CATEGORICAL_COLUMNS
+        
+        # Sayısal değişkenleri ölçeklendir
+        scaler = StandardScaler()
+        scaled = scaler.fit_transform(self.data[NUMERICAL_COLUMNS])
+        columns += NUMERICAL_COLUMNS
+        
+        # Cooking_With sütununu işle (liste formatında): her pişirme yöntemi için binary sütun
+        cooking, cooking_methods = multi_hot(self.data[LIST_COLUMN])
+        columns += [f'Cooking_{method}' for method in cooking_methods]
+        
+        features = np.empty((len(self.data), len(columns)), dtype=np.float64)
+        features[:, :len(CATEGORICAL_COLUMNS)] = np.column_stack(categorical_codes)
+        features[:, len(CATEGORICAL_COLUMNS):len(CATEGORICAL_COLUMNS) + len(NUMERICAL_COLUMNS)] = scaled
+        features[:, len(CATEGORICAL_COLUMNS) + len(NUMERICAL_COLUMNS):] = cooking
+        return features, {
+            'columns': columns,
+            'cooking_methods': cooking_methods,
+            'label_classes': label_classes,
+            'scaler': {
+                'mean': scaler.mean_.tolist(),
+                'var': scaler.var_.tolist(),
+                'scale': scaler.scale_.tolist(),
+                'n_samples_seen': int(scaler.n_samples_seen_)
+            }
+        }
+    
+    def train_model(self, save: bool = True):
         """Karbon emisyonu tahmin modelini eğitir."""
         try:
             # Veriyi eğitim ve test setlerine ayır
@@ -105,14 +198,14 @@ class DataLoader:
             print(f"Test seti R2 skoru: {test_score:.3f}")
             
             # Özellik önemliliklerini göster
-            feature_importance = pd.DataFrame({
-                'feature': self.X.columns,
-                'importance': self.model.feature_importances_
-            }).sort_values('importance', ascending=False)
+            feature_importance = self.get_feature_importance()
             
             print("\nEn önemli 10 özellik:")
             print(feature_importance.head(10))
             
+            if not save:
+                return
+            
             # Modeli kaydet
             model_dir = Path(__file__).parent.parent.parent / 'models'
             model_dir.mkdir(exist_ok=True)
@@ -135,65 +228,114 @@ class DataLoader:
         if self.model is None:
             self.train_model()
         
-        return pd.DataFrame({
-            'feature': self.X.columns,
-            'importance': self.model.feature_importances_
-        }).sort_values('importance', ascending=False)
+        # Önemlilikler model değişmedikçe yeniden hesaplanmaz
+        if self._importance_model is not self.model:
+            self._feature_importance = pd.DataFrame({
+                'feature': self.X.columns,
+                'importance': self.model.feature_importances_
+            }).sort_values('importance', ascending=False)
+            self._feature_importance_records = self._feature_importance.to_dict('records')
+            self._importance_model = self.model
+        return self._feature_importance
     
-    def predict_emission(self, user_data):
-        """Kullanıcı verilerine göre karbon emisyonunu tahmin eder."""
-        if self.model is None:
-            self.train_model()
-        
-        # Kullanıcı verilerini dönüştür
-        processed_data = {}
+    def _encode_record(self, user_data: Dict) -> np.ndarray:
+        """Tek bir kullanıcıyı eğitim sütun sırasında bir özellik satırına dönüştürür."""
+        row = np.zeros(len(self.X.columns), dtype=np.float64)
         
-        # Kategorik değişkenleri dönüştür
-        for column, encoder in self.label_encoders.items():
+        # Kategorik değişkenleri dönüştür (eksik sütunlar 0 kalır)
+        for i, column in enumerate(CATEGORICAL_COLUMNS):
             if column in user_data:
-                processed_data[column] = encoder.transform([user_data[column]])[0]
-        
-        # Sayısal değişkenleri ölçeklendir
-        numerical_columns = [
-            'Monthly Grocery Bill', 'Vehicle Monthly Distance Km',
-            'Waste Bag Weekly Count', 'How Long TV PC Daily Hour',
-            'How Many New Clothes Monthly', 'How Long Internet Daily Hour'
-        ]
+                value = user_data[column]
+                # Eksik değer (NaN/None) LabelEncoder'daki gibi ayrı sınıfa düşer
+                key = None if value is None or (isinstance(value, float) and np.isnan(value)) else str(value)
+                code = self._label_codes[column].get(key)
+                if code is None:
+                    raise ValueError(f"y contains previously unseen labels in {column}: {value!r}")
+                row[i] = code
         
-        for column in numerical_columns:
+        # Sayısal değişkenleri tek seferde ölçeklendir
+        offset = len(CATEGORICAL_COLUMNS)
+        for i, column in enumerate(NUMERICAL_COLUMNS):
             if column in user_data:
-                processed_data[column] = self.scaler.transform([[user_data[column]]])[0][0]
+                row[offset + i] = (float(user_data[column]) - self.scaler.mean_[i]) / self.scaler.scale_[i]
         
         # Pişirme yöntemlerini işle
-        cooking_methods = [col for col in self.X.columns if col.startswith('Cooking_')]
-        user_cooking = user_data.get('Cooking_With', [])
+        offset += len(NUMERICAL_COLUMNS)
+        user_cooking = set(parse_list_literal(user_data.get(LIST_COLUMN, [])))
+        for i, method in enumerate(self.cooking_methods):
+            row[offset + i] = 1.0 if method in user_cooking else 0.0
+        return row
+    
+    def _encode_frame(self, frame: pd.DataFrame) -> np.ndarray:
+        """Bir DataFrame'in tamamını sütun bazında (vektörel) özellik matrisine dönüştürür."""
+        matrix = np.zeros((len(frame), len(self.X.columns)), dtype=np.float64)
         
-        for method in cooking_methods:
-            method_name = method.replace('Cooking_', '')
-            processed_data[method] = 1 if method_name in user_cooking else 0
+        # Kategorik değişkenler: kategorik kodlar LabelEncoder sınıflarının sırasını izler
+        for i, column in enumerate(CATEGORICAL_COLUMNS):
+            if column not in frame.columns:
+                continue
+            classes = self.label_encoders[column].classes_
+            known = [c for c in classes if isinstance(c, str)]
+            values = frame[column].astype(object)
+            codes = pd.Categorical(values, categories=known).codes.astype(np.int64)
+            missing = values.isna().to_numpy()
+            if len(known) < len(classes):
+                codes[missing] = len(known)
+            unseen = (codes < 0) & ~missing if len(known) < len(classes) else codes < 0
+            if unseen.any():
+                raise ValueError(f"y contains previously unseen labels in {column}: "
+                                 f"{sorted(set(values[unseen].astype(str)))}")
+            matrix[:, i] = codes
         
-        # Tahmin için veriyi hazırla
-        X_pred = pd.DataFrame([processed_data])
+        # Sayısal değişkenler: kaydedilmiş ölçekleyici istatistikleriyle tek matris işlemi
+        offset = len(CATEGORICAL_COLUMNS)
+        for i, column in enumerate(NUMERICAL_COLUMNS):
+            if column in frame.columns:
+                values = frame[column].to_numpy(dtype=np.float64)
+                matrix[:, offset + i] = (values - self.scaler.mean_[i]) / self.scaler.scale_[i]
         
-        # Eksik sütunları 0 ile doldur
-        for col in self.X.columns:
-            if col not in X_pred.columns:
-                X_pred[col] = 0
+        # Pişirme yöntemleri: her farklı değer bir kez ayrıştırılır
+        offset += len(NUMERICAL_COLUMNS)
+        if LIST_COLUMN in frame.columns and self.cooking_methods:
+            keys = frame[LIST_COLUMN].map(lambda v: tuple(v) if isinstance(v, list) else v)
+            codes, uniques = pd.factorize(keys, use_na_sentinel=True)
+            index = {method: i for i, method in enumerate(self.cooking_methods)}
+            table = np.zeros((len(uniques) + 1, len(self.cooking_methods)), dtype=np.float64)
+            for row, value in enumerate(uniques):
+                for method in parse_list_literal(list(value) if isinstance(value, tuple) else value):
+                    if method in index:
+                        table[row, index[method]] = 1.0
+            matrix[:, offset:] = table[codes]
+        return matrix
+    
+    def predict_emission(self, user_data):
+        """Kullanıcı verilerine göre karbon emisyonunu tahmin eder."""
+        if self.model is None:
+            self.train_model()
         
-        # Sütunları doğru sıraya koy
-        X_pred = X_pred[self.X.columns]
+        # Tahmin için veriyi hazırla (eksik sütunlar 0, sütunlar eğitim sırasında)
+        X_pred = pd.DataFrame(self._encode_record(user_data)[np.newaxis, :], columns=self.X.columns)
         
         # Tahmin yap
         prediction = self.model.predict(X_pred)[0]
         
+        self.get_feature_importance()
         return {
             'predicted_emission': prediction,
-            'feature_importance': self.get_feature_importance().to_dict('records')
+            'feature_importance': list(self._feature_importance_records)
         }
+    
+    def predict_emission_many(self, users: pd.DataFrame) -> np.ndarray:
+        """Bir kullanıcı tablosunun tamamı için tek bir model çağrısıyla tahmin yapar."""
+        if self.model is None:
+            self.train_model()
+        
+        X_pred = pd.DataFrame(self._encode_frame(users), columns=self.X.columns, index=users.index)
+        return self.model.predict(X_pred)
 
 if __name__ == "__main__":
     # Test amaçlı veri setini yükle ve modeli eğit
-    loader = DataLoader()
+    loader = DataLoader(verbose=True)
     loader.train_model()
     
     # Veri setindeki mevcut değerleri al
@@ -217,8 +359,8 @@ if __name__ == "__main__":
         print(values)
     
     # Örnek tahmin için veri setindeki ilk kullanıcıyı kullan
-    test_user = data.iloc[0].to_dict()
-    test_user['Cooking_With'] = eval(test_user['Cooking_With'])  # String'i listeye çevir
+    test_user = loader.dataset.frame(copy=False).iloc[0].to_dict()
+    test_user[LIST_COLUMN] = parse_list_literal(test_user[LIST_COLUMN])  # String'i listeye çevir
     
     print("\nTest kullanıcısı verileri:")
     for key, value in test_user.items():
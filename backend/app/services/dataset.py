@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+DATASET_PATH = Path(__file__).parent.parent.parent / "data" / "Carbon Emission.csv"
+CACHE_ROOT = Path(os.getenv("DATASET_CACHE_DIR", str(Path(__file__).parent.parent.parent / "data" / "cache")))
+# Bump when the on-disk layout changes so old cache directories are ignored
+CACHE_FORMAT = 1
+
+LIST_COLUMN = 'Cooking_With'
+TARGET_COLUMN = 'CarbonEmission'
+
+# Explicit dtypes: no type inference, repeated strings are kept as categoricals
+CSV_DTYPES = {
+    'Body Type': 'category',
+    'Sex': 'category',
+    'Diet': 'category',
+    'How Often Shower': 'category',
+    'Heating Energy Source': 'category',
+    'Transport': 'category',
+    'Vehicle Type': 'category',
+    'Social Activity': 'category',
+    'Monthly Grocery Bill': 'float64',
+    'Frequency of Traveling by Air': 'category',
+    'Vehicle Monthly Distance Km': 'float64',
+    'Waste Bag Size': 'category',
+    'Waste Bag Weekly Count': 'float64',
+    'How Long TV PC Daily Hour': 'float64',
+    'How Many New Clothes Monthly': 'float64',
+    'How Long Internet Daily Hour': 'float64',
+    'Energy efficiency': 'category',
+    'Recycling': 'category',
+    LIST_COLUMN: 'category',
+    TARGET_COLUMN: 'float64'
+}
+
+
+def file_digest(path: Path) -> str:
+    """sha256 of the file contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DatasetStore:
+    """Parses the training CSV once and keeps a content-hashed columnar cache of it.
+
+    The cache lives in <cache_root>/<sha256 prefix>/ as one .npy file per column plus
+    meta.json. Categorical columns are stored as integer codes with their categories in
+    the metadata, numeric columns as float64. Later loads memory-map those files instead
+    of parsing text. Derived (preprocessed) arrays are stored next to them by name, so a
+    changed CSV invalidates everything built from it.
+    """
+
+    def __init__(self, csv_path: Optional[Path] = None, cache_root: Optional[Path] = None):
+        self.csv_path = Path(csv_path) if csv_path else DATASET_PATH
+        self.cache_root = Path(cache_root) if cache_root else CACHE_ROOT
+        self._digest = None
+        self._frame = None
+        self._lock = threading.Lock()
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = file_digest(self.csv_path)
+        return self._digest
+
+    @property
+    def cache_dir(self) -> Path:
+        return self.cache_root / f"v{CACHE_FORMAT}-{self.digest[:16]}"
+
+    def frame(self, copy: bool = True) -> pd.DataFrame:
+        """The raw dataset with typed columns; pass copy=False for read-only use"""
+        with self._lock:
+            if self._frame is None:
+                self._frame = self._load_cached() if (self.cache_dir / "meta.json").exists() else None
+                if self._frame is None:
+                    self._frame = pd.read_csv(self.csv_path, dtype=CSV_DTYPES)
+                    self._write_cache(self._frame)
+            frame = self._frame
+        return frame.copy() if copy else frame
+
+    def cached_array(self, name: str, builder: Callable[[], Tuple[np.ndarray, Dict]]) -> Tuple[np.ndarray, Dict]:
+        """A derived array and its JSON metadata, built once per dataset version.
+
+        The array comes back memory-mapped read-only on every load after the first.
+        """
+        array_path = self.cache_dir / "derived" / f"{name}.npy"
+        meta_path = self.cache_dir / "derived" / f"{name}.json"
+        if array_path.exists() and meta_path.exists():
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                return np.load(array_path, mmap_mode="r"), meta
+            except (OSError, ValueError) as e:
+                print(f"[DatasetStore] Ignoring unreadable cache entry {name}: {str(e)}")
+
+        array, meta = builder()
+        try:
+            array_path.parent.mkdir(parents=True, exist_ok=True)
+            self._atomic_write(array_path, lambda f: np.save(f, np.ascontiguousarray(array)))
+            self._atomic_write(meta_path, lambda f: f.write(json.dumps(meta).encode("utf-8")))
+        except OSError as e:
+            print(f"[DatasetStore] Could not write cache entry {name}: {str(e)}")
+        return array, meta
+
+    def _load_cached(self) -> Optional[pd.DataFrame]:
+        directory = self.cache_dir
+        try:
+            with open(directory / "meta.json") as f:
+                meta = json.load(f)
+            columns = {}
+            for column in meta["columns"]:
+                values = np.load(directory / column["file"], mmap_mode="r")
+                if column["kind"] == "category":
+                    columns[column["name"]] = pd.Categorical.from_codes(values, categories=column["categories"])
+                else:
+                    columns[column["name"]] = values
+            return pd.DataFrame(columns)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[DatasetStore] Ignoring unreadable dataset cache: {str(e)}")
+            return None
+
+    def _write_cache(self, frame: pd.DataFrame):
+        """Write the columnar cache into a temporary directory, then rename it into place"""
+        try:
+            self.cache_root.mkdir(parents=True, exist_ok=True)
+            staging = Path(tempfile.mkdtemp(prefix=".staging-", dir=self.cache_root))
+            columns = []
+            for i, name in enumerate(frame.columns):
+                file_name = f"col{i:02d}.npy"
+                series = frame[name]
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    np.save(staging / file_name, series.cat.codes.to_numpy())
+                    columns.append({"name": name, "kind": "category", "file": file_name,
+                                    "categories": [str(c) for c in series.cat.categories]})
+                else:
+                    np.save(staging / file_name, series.to_numpy(dtype=np.float64))
+                    columns.append({"name": name, "kind": "numeric", "file": file_name})
+            with open(staging / "meta.json", "w") as f:
+                json.dump({
+                    "format": CACHE_FORMAT,
+                    "source": self.csv_path.name,
+                    "sha256": self.digest,
+                    "rows": len(frame),
+                    "columns": columns
+                }, f)
+            try:
+                os.rename(staging, self.cache_dir)
+            except OSError:
+                # Another process published the same dataset version first
+                shutil.rmtree(staging, ignore_errors=True)
+        except OSError as e:
+            print(f"[DatasetStore] Could not write dataset cache: {str(e)}")
+
+    @staticmethod
+    def _atomic_write(path: Path, write: Callable):
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+_stores: Dict[Path, DatasetStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_dataset(csv_path: Optional[Path] = None) -> DatasetStore:
+    """The process-wide store for a CSV, so every component shares a single parse"""
+    path = (Path(csv_path) if csv_path else DATASET_PATH).resolve()
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = DatasetStore(path)
+        return _stores[path]
@@ -0,0 +1,144 @@
+from datetime import datetime
+from typing import Dict, Optional
+from firebase_admin import firestore
+
+# Number of footprints the rolling average and trend are computed over
+STATS_WINDOW = 10
+# Number of footprints returned as recent history by /user-stats
+RECENT_FOOTPRINTS = 5
+
+
+def apply_footprint(stats: Optional[Dict], user_id: str, total: float, breakdown: Dict,
+                    timestamp: Optional[datetime] = None) -> Dict:
+    """Fold a newly written footprint into the running aggregates of a user"""
+    stats = stats or {}
+    timestamp = timestamp or datetime.now()
+    total = float(total)
+
+    # Newest first, like the old order_by(timestamp DESCENDING) query
+    window = ([total] + list(stats.get("window", [])))[:STATS_WINDOW]
+    recent = ([{
+        "userId": user_id,
+        "total_footprint": total,
+        "breakdown": breakdown,
+        "timestamp": timestamp
+    }] + list(stats.get("recent", [])))[:RECENT_FOOTPRINTS]
+
+    latest = window[0]
+    oldest = window[-1]
+    trend = latest - oldest if len(window) >= 2 else 0.0
+    trend_percentage = (trend / oldest) * 100 if len(window) >= 2 and oldest != 0.0 else 0.0
+
+    return {
+        "count": int(stats.get("count", 0)) + 1,
+        "latest": latest,
+        # Keep the last non-empty breakdown, as the old fallback chain did
+        "latest_breakdown": breakdown or stats.get("latest_breakdown", {}),
+        "window": window,
+        "average": sum(window) / len(window),
+        "oldest_in_window": oldest,
+        "trend": trend,
+        "trend_percentage": trend_percentage,
+        "recent": recent,
+        "updated_at": timestamp
+    }
+
+
+def stats_from_user_data(user_data: Dict, stats: Optional[Dict] = None) -> Dict:
+    """Aggregates for a user, falling back to the user document's own footprint"""
+    # Aggregates written before they moved to their own collection live on the user document
+    stats = stats or user_data.get("footprint_stats")
+    if stats:
+        return stats
+
+    # Older documents have no aggregates yet; use what the profile itself stores
+    current = user_data.get("carbon_footprint", 0.0)
+    if not isinstance(current, (int, float)):
+        current = 0.0
+    return {
+        "count": 0,
+        "latest": float(current),
+        "latest_breakdown": user_data.get("carbon_footprint_breakdown", {}),
+        "window": [],
+        "average": float(current),
+        "oldest_in_window": float(current),
+        "trend": 0.0,
+        "trend_percentage": 0.0,
+        "recent": []
+    }
+
+
+class FootprintStatsStore:
+    """Rolling footprint aggregates in footprint_stats/{userId}, one document per user.
+
+    They are kept apart from user_data, which the Android app overwrites with a plain
+    set(), and every footprint is folded in inside a Firestore transaction, so concurrent
+    writes from any worker are retried against the latest aggregates instead of one
+    overwriting the other. A user who has footprint history but no aggregates document
+    yet is backfilled once from the carbon_footprints collection.
+    """
+
+    def __init__(self, db, collection: str = "footprint_stats", history_collection: str = "carbon_footprints"):
+        self.db = db
+        self.collection = collection
+        self.history_collection = history_collection
+
+    def get(self, user_id: str, legacy: Optional[Dict] = None) -> Optional[Dict]:
+        """The user's aggregates, backfilling them from history if there are none yet"""
+        doc_ref = self.db.collection(self.collection).document(user_id)
+        snapshot = doc_ref.get()
+        if snapshot.exists:
+            return snapshot.to_dict()
+        if legacy:
+            return legacy
+        stats = self.from_history(user_id)
+        if stats is None:
+            return None
+
+        @firestore.transactional
+        def backfill(transaction) -> Dict:
+            # A footprint recorded meanwhile already seeded the document from the same history
+            current = doc_ref.get(transaction=transaction)
+            if current.exists:
+                return current.to_dict()
+            transaction.set(doc_ref, stats)
+            return stats
+
+        return backfill(self.db.transaction())
+
+    def from_history(self, user_id: str) -> Optional[Dict]:
+        """Aggregates rebuilt from the user's latest carbon_footprints rows, or None"""
+        rows = self.db.collection(self.history_collection)\
+            .where("userId", "==", user_id)\
+            .order_by("timestamp", direction=firestore.Query.DESCENDING)\
+            .limit(STATS_WINDOW)\
+            .stream()
+        stats = None
+        # Oldest first, so the fold leaves the newest footprint in front
+        for row in reversed([doc.to_dict() for doc in rows]):
+            # /calculate-carbon-footprint rows store the footprint under "total"
+            total = row.get("total_footprint", row.get("total", 0.0))
+            stats = apply_footprint(stats, user_id, total, row.get("breakdown", {}), row.get("timestamp"))
+        return stats
+
+    def record(self, user_id: str, total: float, breakdown: Dict, legacy: Optional[Dict] = None) -> Dict:
+        """Fold one footprint into the user's aggregates and return them.
+
+        A user without an aggregates document is seeded from legacy (the footprint_stats an
+        older version kept on the user document) or else from their history. Call this
+        before queueing the footprint's own history row, so it is not counted twice.
+        """
+        doc_ref = self.db.collection(self.collection).document(user_id)
+
+        @firestore.transactional
+        def update(transaction) -> Dict:
+            snapshot = doc_ref.get(transaction=transaction)
+            if snapshot.exists:
+                seed = snapshot.to_dict()
+            else:
+                seed = legacy or self.from_history(user_id)
+            stats = apply_footprint(seed, user_id, total, breakdown)
+            transaction.set(doc_ref, stats)
+            return stats
+
+        return update(self.db.transaction())
@@ -0,0 +1,161 @@
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# Firestore rejects batches with more than 500 writes
+FIRESTORE_MAX_BATCH = 500
+
+
+class FootprintHistoryWriter:
+    """Write-behind queue that commits carbon_footprints appends in batches.
+
+    Rows are committed in the order they were queued. At most max_queue rows wait in
+    memory; callers check is_full() to push back, and a row queued past that is dropped.
+    Each row gets its document id when it is queued and keeps it through every retry, so
+    a commit whose response was lost is rewritten in place rather than duplicated.
+    """
+
+    def __init__(self, db, collection: str = "carbon_footprints", batch_size: int = 100,
+                 flush_interval: float = 1.0, max_queue: int = 5000, max_retries: int = 5):
+        self.db = db
+        self.collection = collection
+        self.batch_size = max(1, min(batch_size, FIRESTORE_MAX_BATCH))
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failed_commits = 0
+        self.sync_fallbacks = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the background flusher thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="footprint-history-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, record: Dict):
+        """Queue a history row without blocking; called from async endpoints"""
+        item = (self.db.collection(self.collection).document().id, record)
+        if self._thread is None or not self._thread.is_alive():
+            # Not started (scripts, tests): there is no event loop to protect
+            self._write_sync(item)
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Callers check is_full() first and turn requests away; a row that still races
+            # past that is shed rather than letting memory grow while Firestore lags
+            with self._stats_lock:
+                self.dropped += 1
+                if self.dropped % 100 == 1:
+                    print(f"[FootprintHistoryWriter] Queue full, {self.dropped} history rows dropped so far")
+            return
+        with self._stats_lock:
+            self.enqueued += 1
+
+    def is_full(self) -> bool:
+        """True while the flusher is running and max_queue rows are waiting"""
+        return self._thread is not None and self._thread.is_alive() and self._queue.full()
+
+    def stop(self, timeout: float = 30.0):
+        """Flush everything still queued and stop the flusher thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Anything left (e.g. the thread timed out) is committed from the caller's thread
+        remaining = self._drain(FIRESTORE_MAX_BATCH)
+        while remaining:
+            self._commit_with_retry(remaining)
+            remaining = self._drain(FIRESTORE_MAX_BATCH)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                records = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(records) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    break
+                try:
+                    records.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit_with_retry(records)
+        # Graceful shutdown: flush what is left before exiting
+        remaining = self._drain(self.batch_size)
+        while remaining:
+            self._commit_with_retry(remaining)
+            remaining = self._drain(self.batch_size)
+
+    def _drain(self, limit: int) -> List[Tuple[str, Dict]]:
+        records = []
+        while len(records) < limit:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+    def _commit_with_retry(self, records: List[Tuple[str, Dict]]):
+        delay = 0.5
+        for attempt in range(self.max_retries):
+            try:
+                self._commit(records)
+                return
+            except Exception as e:
+                with self._stats_lock:
+                    self.failed_commits += 1
+                print(f"[FootprintHistoryWriter] Batch commit failed (attempt {attempt + 1}): {str(e)}")
+                time.sleep(delay)
+                delay = min(delay * 2, 10.0)
+        # Last resort: write rows one by one so a single bad row does not lose the whole batch
+        for item in records:
+            try:
+                self._write_sync(item)
+            except Exception as e:
+                print(f"[FootprintHistoryWriter] Dropping history row for {item[1].get('userId')}: {str(e)}")
+
+    def _commit(self, records: List[Tuple[str, Dict]]):
+        collection_ref = self.db.collection(self.collection)
+        batch = self.db.batch()
+        for doc_id, record in records:
+            batch.set(collection_ref.document(doc_id), record)
+        batch.commit()
+        with self._stats_lock:
+            self.written += len(records)
+            self.batches += 1
+
+    def _write_sync(self, item: Tuple[str, Dict]):
+        doc_id, record = item
+        # set() on the pre-assigned id is idempotent, unlike add()
+        self.db.collection(self.collection).document(doc_id).set(record)
+        with self._stats_lock:
+            self.written += 1
+            self.sync_fallbacks += 1
+
+    def stats(self) -> Dict:
+        """Queue depth and write counters"""
+        with self._stats_lock:
+            return {
+                "queued": self._queue.qsize(),
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "batches": self.batches,
+                "failed_commits": self.failed_commits,
+                "sync_fallbacks": self.sync_fallbacks,
+                "dropped": self.dropped,
+                "avg_batch_size": (self.written - self.sync_fallbacks) / self.batches if self.batches else 0.0
+            }
@@ -1,53 +1,263 @@
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.model_selection import train_test_split
 import pandas as pd
 from scipy.sparse import csr_matrix
-from sklearn.metrics.pairwise import cosine_similarity
 import joblib
 import os
+import threading
+from ..ml.feature_schema import FEATURE_SCHEMA, MISSING, UNKNOWN, EncodedProfile, profile_signatures
+from .shared_state import SharedArrayStore, SharedSnapshot
 
-class MLService:
-    def __init__(self):
-        self.category_models = {
-            "diet": None,
-            "transportation": None,
-            "housing": None,
-            "lifestyle": None,
-            "waste": None
+CATEGORIES = ["diet", "transportation", "housing", "lifestyle", "waste"]
+
+
+class UnseenValueError(ValueError):
+    """A profile answer the category model's encoder was not fitted on"""
+
+
+class CategoryModelSet:
+    """Per-category models, encoders and scalers loaded from one model directory.
+
+    A set is built completely before it is published, and MLService swaps the whole set
+    with a single reference assignment, so a request never mixes two model versions.
+    """
+
+    __slots__ = ("version", "model_dir", "category_models", "label_encoders", "scalers", "encoder_codes")
+
+    def __init__(self, version: str, model_dir: str, category_models: Dict, label_encoders: Dict, scalers: Dict):
+        self.version = version
+        self.model_dir = model_dir
+        self.category_models = category_models
+        self.label_encoders = label_encoders
+        self.scalers = scalers
+        # category -> column -> {casefolded class: code}, compiled from the fitted LabelEncoders
+        self.encoder_codes = {category: self.compile_encoder_codes(label_encoders.get(category, {}))
+                              for category in category_models}
+
+    @staticmethod
+    def compile_encoder_codes(encoders: Dict) -> Dict:
+        """Precompute value -> code lookups so prediction does not call LabelEncoder.transform"""
+        return {
+            column: {str(value).casefold(): code for code, value in enumerate(encoder.classes_)}
+            for column, encoder in encoders.items()
+        }
+
+    def with_category(self, category: str, model, encoders: Dict, scaler) -> "CategoryModelSet":
+        """A new set with one category's model, encoders and scaler replaced"""
+        return CategoryModelSet(
+            self.version, self.model_dir,
+            {**self.category_models, category: model},
+            {**self.label_encoders, category: encoders},
+            {**self.scalers, category: scaler}
+        )
+
+    @classmethod
+    def load(cls, model_dir: str, version: str = "default") -> "CategoryModelSet":
+        """Load existing models from disk if they exist"""
+        category_models = {category: None for category in CATEGORIES}
+        label_encoders = {}
+        scalers = {}
+        for category in CATEGORIES:
+            model_path = os.path.join(model_dir, f"{category}_model.joblib")
+            encoder_path = os.path.join(model_dir, f"{category}_encoder.joblib")
+            scaler_path = os.path.join(model_dir, f"{category}_scaler.joblib")
+
+            if os.path.exists(model_path):
+                category_models[category] = joblib.load(model_path)
+            if os.path.exists(encoder_path):
+                label_encoders[category] = joblib.load(encoder_path)
+            if os.path.exists(scaler_path):
+                scalers[category] = joblib.load(scaler_path)
+        return cls(version, model_dir, category_models, label_encoders, scalers)
+
+
+class SimilaritySnapshot:
+    """Collaborative-filtering state that is only ever replaced, never modified.
+
+    The user mappings, feature names and matrices are built together and published
+    with a single reference assignment, so a reader that takes the snapshot once never
+    pairs a new mapping with an old matrix, and needs no lock while a rebuild runs.
+    Similarity uses one sparse, unit-length one-hot row per distinct profile signature;
+    a user's similarities are one sparse product, expanded to users when asked for.
+    """
+
+    __slots__ = ("user_id_to_index", "index_to_user_id", "feature_names", "user_item_matrix",
+                 "user_signatures", "signature_vectors", "shared")
+
+    def __init__(self, user_id_to_index: Dict[str, int], feature_names: List[str], user_item_matrix=None,
+                 user_signatures: Optional[np.ndarray] = None, signature_vectors: Optional[csr_matrix] = None,
+                 shared: Optional[SharedSnapshot] = None):
+        self.user_id_to_index = user_id_to_index
+        self.index_to_user_id = {index: user_id for user_id, index in user_id_to_index.items()}
+        self.feature_names = feature_names
+        # Impact values per user, used to find the features a neighbour does better on
+        self.user_item_matrix = user_item_matrix
+        # Matrix row -> signature id, and the signatures' normalised one-hot rows (float32 CSR)
+        self.user_signatures = user_signatures
+        self.signature_vectors = signature_vectors
+        # The shared-store generation the arrays are mapped from, if any
+        self.shared = shared
+
+    @classmethod
+    def empty(cls) -> "SimilaritySnapshot":
+        return cls({}, [])
+
+    @staticmethod
+    def build_arrays(codes: np.ndarray) -> Dict[str, np.ndarray]:
+        """Impact matrix, signature index and one-hot CSR parts of a population's codes"""
+        # Unknown and missing answers set no one-hot bit, so they share one signature code
+        signatures, user_signatures = profile_signatures(np.maximum(codes, UNKNOWN))
+        vectors = FEATURE_SCHEMA.unit_onehot_from_codes(signatures)
+        user_item = FEATURE_SCHEMA.dense_from_codes(codes).astype(np.float32)
+        # Mapped users without a profile in this update keep an all-zero row
+        user_item[(codes == MISSING).all(axis=1)] = 0
+        return {
+            "ml_user_item": user_item,
+            "ml_user_signature": user_signatures,
+            "ml_signature_data": vectors.data,
+            "ml_signature_indices": vectors.indices.astype(np.int32, copy=False),
+            "ml_signature_indptr": vectors.indptr.astype(np.int64, copy=False)
         }
-        self.label_encoders = {}
-        self.scalers = {}
-        self.user_item_matrix = None
-        self.user_similarity_matrix = None
+
+    @classmethod
+    def from_arrays(cls, user_id_to_index: Dict[str, int], feature_names: List[str], arrays: Dict[str, np.ndarray],
+                    shared: Optional[SharedSnapshot] = None) -> "SimilaritySnapshot":
+        indptr = arrays["ml_signature_indptr"]
+        vectors = None
+        if len(indptr) > 1:
+            vectors = csr_matrix((arrays["ml_signature_data"], arrays["ml_signature_indices"], indptr),
+                                 shape=(len(indptr) - 1, FEATURE_SCHEMA.onehot_width))
+        # n x features is small and copied into a csr
+        return cls(user_id_to_index, feature_names, csr_matrix(arrays["ml_user_item"]),
+                   arrays["ml_user_signature"], vectors, shared)
+
+    @classmethod
+    def from_shared(cls, shared: SharedSnapshot) -> "SimilaritySnapshot":
+        user_ids = shared.meta["ml_user_ids"]
+        return cls.from_arrays({user_id: i for i, user_id in enumerate(user_ids)}, shared.meta["ml_feature_names"],
+                               shared.arrays, shared)
+
+    @property
+    def generation(self) -> int:
+        return self.shared.generation if self.shared is not None else 0
+
+    @property
+    def ready(self) -> bool:
+        return self.signature_vectors is not None
+
+    def similarities(self, user_idx: int) -> np.ndarray:
+        """One user's cosine similarity to every user: O(non-zeros) over the distinct signatures"""
+        return self.similarities_to(self.signature_vectors[int(self.user_signatures[user_idx])].toarray().ravel())
+
+    def similarities_to(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of a unit one-hot vector (e.g. a just-saved profile) to every user"""
+        return (self.signature_vectors @ query)[self.user_signatures]
+
+
+class MLService:
+    def __init__(self, shared_store: Optional[SharedArrayStore] = None):
+        # With a shared store the similarity state is built by one process and mapped by the others
+        self.shared_store = shared_store
+        self.similarity = SimilaritySnapshot.empty()
         self.model_dir = "models"
-        self.user_id_to_index = {}
-        self.index_to_user_id = {}
-        self.model_feature_names = {}
         
         # Create models directory if it doesn't exist
         if not os.path.exists(self.model_dir):
             os.makedirs(self.model_dir)
             
         # Load existing models if they exist
-        self._load_models()
-    
-    def _load_models(self):
-        """Load existing models from disk if they exist"""
-        for category in self.category_models.keys():
-            model_path = os.path.join(self.model_dir, f"{category}_model.joblib")
-            encoder_path = os.path.join(self.model_dir, f"{category}_encoder.joblib")
-            scaler_path = os.path.join(self.model_dir, f"{category}_scaler.joblib")
-            
-            if os.path.exists(model_path):
-                self.category_models[category] = joblib.load(model_path)
-            if os.path.exists(encoder_path):
-                self.label_encoders[category] = joblib.load(encoder_path)
-            if os.path.exists(scaler_path):
-                self.scalers[category] = joblib.load(scaler_path)
-    
+        self.models = CategoryModelSet.load(self.model_dir)
+        # Serialises train_category_model's swaps so concurrent trainings do not drop each other
+        self._train_lock = threading.Lock()
+
+    # The active model set's tables, kept as attributes for existing callers
+    @property
+    def category_models(self) -> Dict:
+        return self.models.category_models
+
+    @property
+    def label_encoders(self) -> Dict:
+        return self.models.label_encoders
+
+    @property
+    def scalers(self) -> Dict:
+        return self.models.scalers
+
+    @property
+    def encoder_codes(self) -> Dict:
+        return self.models.encoder_codes
+
+    # The current similarity snapshot's fields, read-only views for existing callers
+    @property
+    def user_id_to_index(self) -> Dict[str, int]:
+        return self.similarity.user_id_to_index
+
+    @property
+    def index_to_user_id(self) -> Dict[int, str]:
+        return self.similarity.index_to_user_id
+
+    @property
+    def model_feature_names(self) -> List[str]:
+        return self.similarity.feature_names
+
+    @property
+    def user_item_matrix(self):
+        return self.similarity.user_item_matrix
+
+    @property
+    def user_signatures(self) -> Optional[np.ndarray]:
+        return self.similarity.user_signatures
+
+    def reset_similarity(self):
+        """Drop the similarity state, e.g. after a failed rebuild"""
+        self.similarity = SimilaritySnapshot.empty()
+
+    def load_bundle(self, model_dir: str, version: str) -> CategoryModelSet:
+        """Load a model set in the background without touching the active one"""
+        return CategoryModelSet.load(model_dir, version)
+
+    def smoke_test(self, models: CategoryModelSet, profile: Dict):
+        """Every loaded category model must predict the profile the way requests do.
+
+        The profile goes through _predict, so a missing scaler, a column count that does not
+        match the model or a categorical column without an encoder fails the set. An answer
+        outside a model's vocabulary sends real requests to the rule-based fallback for that
+        category, so it is tolerated; the model is then checked on its mean input instead.
+        """
+        encoded = FEATURE_SCHEMA.ensure(profile)
+        for category, model in models.category_models.items():
+            if model is None:
+                continue
+            if category not in models.scalers:
+                raise ValueError(f"{category} model has no scaler")
+            scaler = models.scalers[category]
+            encoder_codes = models.encoder_codes.get(category, {})
+            columns = self._model_columns(scaler, encoder_codes)
+            expected = getattr(model, "n_features_in_", len(columns))
+            if len(columns) != expected or len(scaler.mean_) != expected:
+                raise ValueError(f"{category} model expects {expected} features, got {len(columns)} "
+                                 f"columns and a scaler for {len(scaler.mean_)}")
+            missing = [column for column in columns
+                       if isinstance(encoded.values.get(column), str) and column not in encoder_codes]
+            if missing:
+                raise ValueError(f"{category} model has no encoder for {', '.join(missing)}")
+            try:
+                prediction = self._predict(models, category, profile, encoded)
+            except UnseenValueError as e:
+                print(f"[MLService] Smoke profile outside the {category} model's vocabulary ({str(e)}), "
+                      f"checking its mean input")
+                prediction = float(model.predict(np.zeros((1, expected), dtype=np.float64))[0])
+            if not np.isfinite(prediction):
+                raise ValueError(f"{category} model returned {prediction} for the smoke profile")
+
+    def activate(self, models: CategoryModelSet):
+        """Publish a validated model set; in-flight predictions finish on the previous one"""
+        self.models = models
+        self.model_dir = models.model_dir
+
     def _save_models(self):
         """Save models to disk"""
         for category, model in self.category_models.items():
@@ -69,19 +279,15 @@ class MLService:
         X = df.drop(['carbon_footprint', 'userId'], axis=1)
         y = df['carbon_footprint']
         
-        # Encode categorical features
-        if category not in self.label_encoders:
-            self.label_encoders[category] = {}
-        
+        # Encode categorical features with fresh encoders; the active ones keep serving meanwhile
+        encoders = {}
         for column in X.select_dtypes(include=['object']).columns:
-            if column not in self.label_encoders[category]:
-                self.label_encoders[category][column] = LabelEncoder()
-            X[column] = self.label_encoders[category][column].fit_transform(X[column])
+            encoders[column] = LabelEncoder()
+            X[column] = encoders[column].fit_transform(X[column])
         
         # Scale features
-        if category not in self.scalers:
-            self.scalers[category] = StandardScaler()
-        X_scaled = self.scalers[category].fit_transform(X)
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X)
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(
@@ -92,181 +298,239 @@ class MLService:
         model = RandomForestRegressor(n_estimators=100, random_state=42)
         model.fit(X_train, y_train)
         
-        # Save model
-        self.category_models[category] = model
-        self._save_models()
+        # Publish a new model set with this category replaced, then save it
+        with self._train_lock:
+            self.models = self.models.with_category(category, model, encoders, scaler)
+            self._save_models()
         
         return model.score(X_test, y_test)
     
-    def predict_category_footprint(self, category: str, user_data: Dict) -> float:
+    def predict_category_footprint(self, category: str, user_data: Dict,
+                                   encoded: Optional[EncodedProfile] = None) -> float:
         """Predict carbon footprint for a specific category"""
-        if category not in self.category_models or self.category_models[category] is None:
+        return self._predict(self.models, category, user_data, encoded)
+
+    def _predict(self, models: CategoryModelSet, category: str, user_data: Dict,
+                 encoded: Optional[EncodedProfile] = None) -> float:
+        if category not in models.category_models or models.category_models[category] is None:
             raise ValueError(f"No model available for category: {category}")
         
-        # Prepare input data
-        X = pd.DataFrame([user_data])
+        # Build the model row from the request's normalised profile, in training column order
+        encoded = FEATURE_SCHEMA.ensure(user_data, encoded)
+        scaler = models.scalers[category]
+        encoder_codes = models.encoder_codes.get(category, {})
+        columns = self._model_columns(scaler, encoder_codes)
+        row = np.empty(len(columns), dtype=np.float64)
+        for i, column in enumerate(columns):
+            value = encoded.values.get(column) if column in encoded.values else user_data.get(column)
+            if column in encoder_codes:
+                code = encoder_codes[column].get(str(value).casefold()) if value is not None else None
+                if code is None:
+                    raise UnseenValueError(f"Unseen value {value!r} for {column} in {category} model")
+                row[i] = code
+            else:
+                row[i] = float(value)
         
-        # Encode categorical features
-        for column in X.select_dtypes(include=['object']).columns:
-            if column in self.label_encoders[category]:
-                X[column] = self.label_encoders[category][column].transform(X[column])
-        
-        # Scale features
-        X_scaled = self.scalers[category].transform(X)
+        # Same arithmetic as StandardScaler.transform, without building a DataFrame
+        X_scaled = ((row - scaler.mean_) / scaler.scale_)[np.newaxis, :]
         
         # Make prediction
-        return float(self.category_models[category].predict(X_scaled)[0])
+        return float(models.category_models[category].predict(X_scaled)[0])
+
+    @staticmethod
+    def _model_columns(scaler, encoder_codes: Dict) -> List[str]:
+        """A category model's input columns in training order"""
+        columns = getattr(scaler, "feature_names_in_", None)
+        return list(columns) if columns is not None else list(encoder_codes)
     
-    def update_user_item_matrix(self, user_data: List[Dict]):
-        """Update the user-item matrix for collaborative filtering"""
-        df = pd.DataFrame(user_data)
-
-        # Populate user_id_to_index and index_to_user_id mappings
-        for i, user_id in enumerate(df['userId'].unique()):
-            if user_id not in self.user_id_to_index:
-                self.user_id_to_index[user_id] = len(self.user_id_to_index)
-                self.index_to_user_id[self.user_id_to_index[user_id]] = user_id
-
-        # Sadece string, int ve float tipindeki sütunları al
-        allowed_types = (str, int, float)
-        # Ensure we drop columns that are not features for collaborative filtering
-        user_features = df.drop([col for col in ['userId', 'carbon_footprint', 'created_at', 'updated_at', 'recommendations'] if col in df.columns], axis=1)
-        user_features = user_features[[col for col in user_features.columns
-                                       if user_features[col].map(type).apply(lambda t: t in allowed_types).all()]]
-
-        # Store feature names for later use in recommendations
-        self.model_feature_names = user_features.columns.tolist()
-
-        # Eksik değerleri doldur
-        user_features = user_features.fillna(0)
-
-        # Encode categorical features
-        if 'collaborative' not in self.label_encoders:
-            self.label_encoders['collaborative'] = {}
-        for column in user_features.select_dtypes(include=['object', 'int', 'float']).columns:
-            user_features[column] = user_features[column].astype(str)
-            if column not in self.label_encoders['collaborative']:
-                self.label_encoders['collaborative'][column] = LabelEncoder()
-            
-            # Fit and transform, handling unseen labels by fitting to existing data
-            # If training data is limited, this might still lead to unseen labels if new values appear post-training.
-            # For robust production, consider a predefined vocabulary or a more advanced handling strategy.
-            try:
-                user_features[column] = self.label_encoders['collaborative'][column].fit_transform(user_features[column])
-            except ValueError as e:
-                # This means new labels appeared after fit. Refit with all available data or handle specifically.
-                print(f"[MLService] Warning: Unseen label during collaborative filtering encoding for column {column}. Error: {e}")
-                # Re-fit the encoder with existing classes and new data if necessary. Not ideal, but a workaround.
-                all_classes = np.unique(np.concatenate((self.label_encoders['collaborative'][column].classes_, user_features[column].unique())))
-                self.label_encoders['collaborative'][column].classes_ = all_classes
-                user_features[column] = self.label_encoders['collaborative'][column].transform(user_features[column])
-
-        # Map user IDs to integer indices for the matrix
-        user_features['user_index'] = df['userId'].apply(lambda uid: self.user_id_to_index.get(uid, -1))
-        user_features = user_features[user_features['user_index'] != -1] # Filter out unmapped users
-        
-        # Create a dummy column if user_features is empty after mapping
-        if user_features.empty:
-            self.user_item_matrix = csr_matrix((0, len(user_features.columns) - 1)) # Empty matrix
-            self.user_similarity_matrix = None
+    def update_user_item_matrix(self, user_data: List[Dict], codes: Optional[np.ndarray] = None):
+        """Update the user-item matrix for collaborative filtering.
+
+        Only for a service without a shared store: a shared one serves what the similarity
+        rebuild publishes, and a local snapshot would be dropped by the next sync_shared().
+        """
+        if self.shared_store is not None:
+            raise ValueError("Similarity state is published through the shared store; rebuild it there")
+        users = [user for user in user_data if user.get('userId')]
+
+        # Extend a copy of the current mapping; readers keep using the published one meanwhile
+        user_id_to_index = dict(self.similarity.user_id_to_index)
+        for user in users:
+            user_id_to_index.setdefault(user['userId'], len(user_id_to_index))
+
+        # Features come from the shared schema: fixed columns and answer codes, no refitted encoders
+        feature_names = FEATURE_SCHEMA.dense_columns
+        if not users:
+            self.similarity = SimilaritySnapshot(user_id_to_index, feature_names,
+                                                 csr_matrix((0, len(feature_names))))
             return
+        if codes is None:
+            codes = FEATURE_SCHEMA.codes_many(users)
 
-        # Set user_index as index and drop it from features before creating sparse matrix
-        user_features = user_features.set_index('user_index').sort_index()
         # Ensure the matrix has enough rows for all mapped users
-        max_user_index = max(self.user_id_to_index.values())
-        num_features = len(user_features.columns)
-
-        # Convert to sparse matrix, ensuring correct shape
-        self.user_item_matrix = csr_matrix((max_user_index + 1, num_features), dtype=np.float32)
-        for idx, row in user_features.iterrows():
-            self.user_item_matrix[idx, :] = row.values
+        rows = np.fromiter((user_id_to_index[user['userId']] for user in users), dtype=np.int64, count=len(users))
+        matrix = np.full((max(user_id_to_index.values()) + 1, len(feature_names)), MISSING, dtype=np.int64)
+        matrix[rows] = codes
 
-        # Calculate user similarity matrix
-        self.user_similarity_matrix = cosine_similarity(self.user_item_matrix)
+        # Build the one-hot signature rows, then publish everything in one assignment
+        self.similarity = SimilaritySnapshot.from_arrays(user_id_to_index, feature_names,
+                                                         SimilaritySnapshot.build_arrays(matrix))
     
+    @staticmethod
+    def build_shared(user_data: List[Dict]) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """Similarity state for SharedArrayStore.publish, built without touching a live service"""
+        users = [user for user in user_data if user.get('userId')]
+        # Row per distinct user; a later duplicate overwrites the earlier row, as before
+        user_ids = list(dict.fromkeys(user['userId'] for user in users))
+        feature_names = FEATURE_SCHEMA.dense_columns
+        codes = np.full((len(user_ids), len(feature_names)), MISSING, dtype=np.int64)
+        if users:
+            index = {user_id: i for i, user_id in enumerate(user_ids)}
+            rows = np.fromiter((index[user['userId']] for user in users), dtype=np.int64, count=len(users))
+            codes[rows] = FEATURE_SCHEMA.codes_many(users)
+        arrays = SimilaritySnapshot.build_arrays(codes)
+        meta = {"ml_user_ids": user_ids, "ml_feature_names": list(feature_names)}
+        return arrays, meta
+
+    def sync_shared(self):
+        """Re-attach to the shared similarity state when a newer generation was published"""
+        if self.shared_store is None:
+            return
+        shared = self.shared_store.refresh(self.similarity.shared)
+        if shared is None or "ml_signature_indptr" not in shared.arrays:
+            return
+        self.similarity = SimilaritySnapshot.from_shared(shared)
+
     def get_similar_users(self, user_id: str, n_recommendations: int = 5) -> List[Tuple[str, float]]:
         """Get similar users based on collaborative filtering"""
-        if self.user_similarity_matrix is None or user_id not in self.user_id_to_index:
+        self.sync_shared()
+        snapshot = self.similarity
+        similar_indices, similar_scores = self._neighbours(snapshot, user_id, n_recommendations)
+
+        # Convert similar indices back to original user_ids
+        similar_user_ids = [snapshot.index_to_user_id[idx] for idx in similar_indices]
+        
+        return list(zip(similar_user_ids, similar_scores))
+
+    def _neighbours(self, snapshot: SimilaritySnapshot, user_id: str, n_recommendations: int,
+                    encoded: Optional[EncodedProfile] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Row indices and scores of the user's most similar users, best first.
+
+        With encoded, neighbours are found for that profile rather than for the user's row
+        in the snapshot, which may predate the profile the request just saved.
+        """
+        if not snapshot.ready or (encoded is None and user_id not in snapshot.user_id_to_index):
             print(f"[MLService] User similarity matrix not initialized or user {user_id} not in index.") # Debug
             raise ValueError("User similarity matrix not initialized or user not found.")
         
         # Get user index from mapping
-        user_idx = self.user_id_to_index[user_id]
+        user_idx = snapshot.user_id_to_index.get(user_id)
         print(f"[MLService] Retrieved user index for {user_id}: {user_idx}") # Debug
         
-        # Get similarity scores for the user
-        user_similarities = self.user_similarity_matrix[user_idx]
+        # Get similarity scores for the user (one sparse product over the signatures)
+        if encoded is not None:
+            query = FEATURE_SCHEMA.unit_onehot_from_codes(encoded.codes[np.newaxis, :]).toarray().ravel()
+            user_similarities = snapshot.similarities_to(query)
+        else:
+            user_similarities = snapshot.similarities(user_idx)
         
-        # Get top N similar users (excluding the user themselves)
-        # Use argsort to get indices that would sort the array, then reverse for descending order
-        # Slice to exclude the user themselves and get top N
-        similar_indices = np.argsort(user_similarities)[::-1][1:n_recommendations+1]
-        similar_scores = user_similarities[similar_indices]
+        return self._top_neighbours(user_similarities, user_idx, n_recommendations)
 
-        # Convert similar indices back to original user_ids
-        similar_user_ids = [self.index_to_user_id[idx] for idx in similar_indices]
-        
-        return list(zip(similar_user_ids, similar_scores))
+    @staticmethod
+    def _top_neighbours(user_similarities: np.ndarray, user_idx: Optional[int],
+                        n_recommendations: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The n most similar rows, best first; equal scores go to the lower row index.
+
+        Similarities take few distinct values, so ties are common; breaking them by index
+        makes the neighbours, and the recommendations built from them, reproducible.
+        """
+        # Get top N similar users (excluding the user themselves)
+        # Users sharing the signature tie at the top, so the user is excluded by index
+        candidates = len(user_similarities)
+        if user_idx is not None:
+            user_similarities[user_idx] = -np.inf
+            candidates -= 1
+        k = min(n_recommendations, candidates)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=user_similarities.dtype)
+        # Everything tied with the k-th best score, then a stable sort of that short list
+        threshold = np.partition(user_similarities, len(user_similarities) - k)[len(user_similarities) - k]
+        similar_indices = np.flatnonzero(user_similarities >= threshold)
+        similar_indices = similar_indices[np.argsort(-user_similarities[similar_indices], kind="stable")[:k]]
+        return similar_indices, user_similarities[similar_indices]
     
-    def get_recommendations(self, user_id: str, n_recommendations: int = 5) -> List[Dict]:
-        """Get personalized recommendations based on similar users"""
+    def get_recommendations(self, user_id: str, n_recommendations: int = 5,
+                            encoded: Optional[EncodedProfile] = None) -> List[Dict]:
+        """Get personalized recommendations based on similar users.
+
+        One entry per feature on which some neighbour has a lower (better) impact value,
+        taken from the neighbour with the largest improvement potential and ranked by it.
+        Passing the request's encoded profile makes them reflect that profile.
+        """
         print(f"[MLService] Getting recommendations for user: {user_id}") # Debug
+        # One snapshot for the whole request: indices, rows and feature names stay consistent
+        self.sync_shared()
+        snapshot = self.similarity
         try:
-            similar_users = self.get_similar_users(user_id, n_recommendations)
+            neighbour_indices, similarity_scores = self._neighbours(snapshot, user_id, n_recommendations, encoded)
         except ValueError as e:
             print(f"[MLService] Error getting similar users: {e}") # Debug
             return [] # Return empty recommendations if similar users cannot be found
+        if encoded is not None:
+            current_user_row = encoded.dense[np.newaxis, :]
+        else:
+            current_user_row = snapshot.user_item_matrix[snapshot.user_id_to_index[user_id]].toarray()
+        return self._recommend_from(snapshot, current_user_row, neighbour_indices, similarity_scores)
+
+    def recommendations_for_all(self, n_recommendations: int = 5, snapshot: Optional[SimilaritySnapshot] = None,
+                                block_size: int = 256) -> Iterator[Tuple[str, List[Dict]]]:
+        """(user_id, recommendations) for every user of a snapshot, as get_recommendations returns them.
+
+        Similarities are computed for a block of users at a time with one sparse product,
+        instead of one product per user.
+        """
+        snapshot = snapshot or self.similarity
+        if not snapshot.ready:
+            return
+        vectors = snapshot.signature_vectors
+        n_users = len(snapshot.user_signatures)
+        for start in range(0, n_users, block_size):
+            rows = np.arange(start, min(start + block_size, n_users))
+            block = (vectors @ vectors[snapshot.user_signatures[rows]].T).toarray()[snapshot.user_signatures]
+            current_rows = snapshot.user_item_matrix[rows].toarray()
+            for i, user_idx in enumerate(rows):
+                neighbour_indices, similarity_scores = self._top_neighbours(
+                    np.ascontiguousarray(block[:, i]), int(user_idx), n_recommendations
+                )
+                yield snapshot.index_to_user_id[int(user_idx)], self._recommend_from(
+                    snapshot, current_rows[i:i + 1], neighbour_indices, similarity_scores
+                )
+
+    @staticmethod
+    def _recommend_from(snapshot: SimilaritySnapshot, current_user_row: np.ndarray,
+                        neighbour_indices: np.ndarray, similarity_scores: np.ndarray) -> List[Dict]:
+        if len(neighbour_indices) == 0:
+            return []
+
+        # One gather of the k neighbour rows, diffed against the user's row by broadcasting
+        neighbour_rows = snapshot.user_item_matrix[neighbour_indices].toarray()
+        # Assuming lower value means better (e.g., lower footprint contribution)
+        potential = current_user_row - neighbour_rows
         
-        recommendations = []
-        for similar_user_id, similarity_score in similar_users:
-            # Get the similar user's data
-            if similar_user_id not in self.user_id_to_index:
-                print(f"[MLService] Similar user ID {similar_user_id} not in user_id_to_index. Skipping.") # Debug
-                continue
-            
-            similar_user_idx = self.user_id_to_index[similar_user_id]
-            similar_user_data_row = self.user_item_matrix.getrow(similar_user_idx).toarray().flatten()
-            
-            # Get current user's data
-            current_user_idx = self.user_id_to_index[user_id]
-            current_user_data_row = self.user_item_matrix.getrow(current_user_idx).toarray().flatten()
-            
-            # Find features where similar user has better (lower) values
-            # Assuming lower value means better (e.g., lower footprint contribution)
-            better_features_indices = np.where(similar_user_data_row < current_user_data_row)[0]
-            
-            # Check ALL better features, not just the first one
-            for feature_idx in better_features_indices:
-                # Use stored feature names if available, otherwise fallback to hardcoded mapping
-                if hasattr(self, 'model_feature_names') and self.model_feature_names and feature_idx < len(self.model_feature_names):
-                    feature_name = self.model_feature_names[feature_idx]
-                else:
-                    # Fallback to hardcoded mapping
-                    feature_mapping_for_recommendations = {
-                        0: 'diet_type',
-                        1: 'transportation_mode',
-                        2: 'vehicle_type',
-                        3: 'heating_source',
-                        4: 'home_energy_efficiency',
-                        5: 'shower_frequency',
-                        6: 'screen_time',
-                        7: 'internet_usage',
-                        8: 'clothes_purchases',
-                        9: 'recycling',
-                        10: 'trash_bag_size',
-                    }
-                    if feature_idx in feature_mapping_for_recommendations:
-                        feature_name = feature_mapping_for_recommendations[feature_idx]
-                    else:
-                        feature_name = "an unspecified feature"
-
-                recommendation = {
-                    "feature": feature_name,
-                    "similarity_score": float(similarity_score),
-                    "improvement_potential": float(current_user_data_row[feature_idx] - 
-                                                similar_user_data_row[feature_idx])
-                }
-                recommendations.append(recommendation)
+        # Per feature, the neighbour with the largest potential; ties go to the more similar one
+        best_neighbour = potential.argmax(axis=0)
+        best_potential = potential[best_neighbour, np.arange(potential.shape[1])]
+        features = np.flatnonzero(best_potential > 0)
+        best_scores = similarity_scores[best_neighbour[features]]
+        order = np.lexsort((-best_scores, -best_potential[features]))
         
-        return recommendations 
\ No newline at end of file
+        feature_names = snapshot.feature_names
+        return [
+            {
+                "feature": feature_names[feature_idx],
+                "similarity_score": float(score),
+                "improvement_potential": float(improvement)
+            }
+            for feature_idx, score, improvement in zip(features[order], best_scores[order],
+                                                      best_potential[features][order])
+        ]
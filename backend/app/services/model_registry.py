@@ -0,0 +1,196 @@
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+MODELS_ROOT = Path(__file__).parent.parent.parent / "models"
+# models/CURRENT names the active version directory (models/<version>/); without it the
+# artifacts directly under models/ are used
+POINTER_FILE = "CURRENT"
+DEFAULT_VERSION = "default"
+
+# A complete, valid Android profile used to validate a model set before it goes live
+SMOKE_PROFILE = {
+    "userId": "__smoke_test__",
+    "body_type": "Normal",
+    "gender": "Female",
+    "diet_type": "Omnivore",
+    "shower_frequency": "Daily",
+    "heating_source": "Natural gas",
+    "transportation_mode": "Public transport",
+    "vehicle_type": "I don't own a vehicle",
+    "social_activity": "Sometimes",
+    "trash_bag_size": "Medium",
+    "air_travel_frequency": "Rarely",
+    "home_energy_efficiency": "Sometimes",
+    "recycling": "Paper",
+    "cooking_devices": "Stove",
+    "screen_time": "4-8 hours",
+    "clothes_purchases": "11-20",
+    "internet_usage": "4-8 hours"
+}
+
+
+class ModelRegistry:
+    """Hot reload of every model-backed component from a version pointer.
+
+    Registered components implement load_bundle(model_dir, version), smoke_test(bundle,
+    profile) and activate(bundle). A reload loads every bundle off the request path,
+    runs a smoke prediction on each and only then activates them all; if any step fails
+    the active versions stay in place and the error is reported by status().
+    """
+
+    def __init__(self, models_root: Optional[Path] = None, poll_interval: float = 5.0):
+        self.models_root = Path(models_root) if models_root else MODELS_ROOT
+        self.poll_interval = poll_interval
+        self._components: Dict[str, Any] = {}
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pointer_seen = None
+        self.active_version = None
+        self.active_dir = None
+        self.loaded_at = None
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.last_error = None
+
+    @property
+    def pointer_path(self) -> Path:
+        return self.models_root / POINTER_FILE
+
+    def register(self, name: str, component: Any):
+        """Track a component; components start out with the artifacts directly under models/"""
+        self._components[name] = component
+        if self.active_version is None:
+            self.active_version = DEFAULT_VERSION
+            self.active_dir = str(self.models_root)
+
+    def read_pointer(self) -> str:
+        try:
+            version = self.pointer_path.read_text().strip()
+        except OSError:
+            return DEFAULT_VERSION
+        return version or DEFAULT_VERSION
+
+    def version_dir(self, version: str) -> Path:
+        if version == DEFAULT_VERSION:
+            return self.models_root
+        # The pointer may only name a directory inside the models root
+        path = (self.models_root / version).resolve()
+        if path.parent != self.models_root.resolve():
+            raise ValueError(f"Invalid model version: {version!r}")
+        return path
+
+    def write_pointer(self, version: str):
+        """Point every worker watching this models root at a version (atomic rename)"""
+        fd, tmp = tempfile.mkstemp(prefix=".CURRENT-", dir=self.models_root)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(version + "\n")
+            os.replace(tmp, self.pointer_path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def reload(self, version: Optional[str] = None, force: bool = False, publish: bool = True) -> Dict:
+        """Load, validate and swap in a model version (the pointer's one by default).
+
+        An explicit version is published to the pointer file once it has been activated,
+        so other workers pick it up on their next poll (unless publish=False).
+        """
+        with self._reload_lock:
+            pointer_state = self._pointer_state()
+            target = version or self.read_pointer()
+            if target == self.active_version and not force:
+                self._pointer_seen = pointer_state
+                return self.status()
+
+            start_time = time.perf_counter()
+            try:
+                model_dir = self.version_dir(target)
+                if not model_dir.is_dir():
+                    raise FileNotFoundError(f"Model directory not found: {model_dir}")
+                bundles = {}
+                timings = {}
+                for name, component in self._components.items():
+                    step_start = time.perf_counter()
+                    bundles[name] = component.load_bundle(str(model_dir), target)
+                    loaded = time.perf_counter()
+                    component.smoke_test(bundles[name], SMOKE_PROFILE)
+                    timings[name] = {
+                        "load_ms": (loaded - step_start) * 1000,
+                        "smoke_test_ms": (time.perf_counter() - loaded) * 1000
+                    }
+            except Exception as e:
+                self.failed_reloads += 1
+                self.last_error = f"{target}: {str(e)}"
+                # Do not retry a broken pointer on every poll; a new pointer write is a new attempt
+                self._pointer_seen = pointer_state
+                print(f"[ModelRegistry] Keeping version {self.active_version}, reload of {target} failed: {str(e)}")
+                raise
+
+            # Every bundle loaded and passed its smoke test: publish them together
+            for name, component in self._components.items():
+                component.activate(bundles[name])
+            self.active_version = target
+            self.active_dir = str(model_dir)
+            self.loaded_at = datetime.now().isoformat()
+            self.timings = {**timings, "total_ms": (time.perf_counter() - start_time) * 1000}
+            self.reloads += 1
+            self.last_error = None
+            if publish and version is not None and version != self.read_pointer():
+                self.write_pointer(version)
+            self._pointer_seen = self._pointer_state()
+            print(f"[ModelRegistry] Activated model version {target} in {self.timings['total_ms']:.0f} ms")
+            return self.status()
+
+    def status(self) -> Dict:
+        return {
+            "active_version": self.active_version,
+            "model_dir": self.active_dir,
+            "pointer_version": self.read_pointer(),
+            "loaded_at": self.loaded_at,
+            "timings": self.timings,
+            "components": list(self._components),
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "last_error": self.last_error,
+            "watching": self._thread is not None and self._thread.is_alive()
+        }
+
+    def start(self):
+        """Start the background thread that follows the pointer file"""
+        if self.poll_interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-registry-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _pointer_state(self):
+        try:
+            stat = self.pointer_path.stat()
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            if self._pointer_state() == self._pointer_seen:
+                continue
+            try:
+                self.reload()
+            except Exception:
+                # Already recorded in status(); the active models keep serving
+                pass
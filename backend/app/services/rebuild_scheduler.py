@@ -0,0 +1,170 @@
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+
+class RebuildScheduler:
+    """Coalesces "state is dirty" signals into background rebuilds.
+
+    Writes call mark_dirty() and return immediately. A single thread runs the rebuild
+    once writes have been quiet for quiet_period seconds, but never sooner than
+    min_interval after the previous rebuild started and never later than max_staleness
+    after the first unhandled write. Marks that arrive while a rebuild runs are folded
+    into the next one.
+    """
+
+    def __init__(self, rebuild: Callable[[], Any], name: str = "rebuild-scheduler",
+                 min_interval: float = 5.0, quiet_period: float = 1.0, max_staleness: float = 30.0):
+        self.rebuild = rebuild
+        self.name = name
+        self.min_interval = min_interval
+        self.quiet_period = quiet_period
+        self.max_staleness = max(max_staleness, 0.0)
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._dirty_since: Optional[float] = None
+        self._last_mark: Optional[float] = None
+        self._last_start: Optional[float] = None
+        self._forced = False
+        self._running = False
+        # Incremented when a rebuild finishes; force(wait=True) waits for the next one
+        self._completed = 0
+        self.marks = 0
+        self.rebuilds = 0
+        self.forced_rebuilds = 0
+        self.failed_rebuilds = 0
+        self.last_duration: Optional[float] = None
+        self.last_finished_at: Optional[str] = None
+        self.last_result: Any = None
+        self.last_error: Optional[str] = None
+        self.max_observed_staleness = 0.0
+
+    def start(self):
+        """Start the background rebuild thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def mark_dirty(self):
+        """Record a write; the rebuild happens later on the scheduler thread"""
+        now = time.monotonic()
+        with self._condition:
+            self.marks += 1
+            self._last_mark = now
+            if self._dirty_since is None:
+                self._dirty_since = now
+            self._condition.notify_all()
+        if not self.running:
+            # No scheduler thread (scripts, tests): rebuild in the caller as before
+            self._execute(forced=False)
+
+    def force(self, wait: bool = False, timeout: Optional[float] = None) -> Dict:
+        """Rebuild as soon as possible, ignoring the interval and quiet period"""
+        if not self.running:
+            self._execute(forced=True)
+            return self.stats()
+        with self._condition:
+            target = self._completed + (2 if self._running else 1)
+            self._forced = True
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            self._condition.notify_all()
+            if wait:
+                # A rebuild already in progress may predate the caller's writes, so wait for the next one
+                self._condition.wait_for(lambda: self._completed >= target or self._stop.is_set(), timeout)
+        return self.stats()
+
+    def _due_at(self) -> Optional[float]:
+        if self._dirty_since is None:
+            return None
+        if self._forced:
+            return time.monotonic()
+        due = min(self._last_mark + self.quiet_period, self._dirty_since + self.max_staleness)
+        if self._last_start is not None:
+            due = max(due, self._last_start + self.min_interval)
+        return due
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._condition:
+                due = self._due_at()
+                now = time.monotonic()
+                if due is None or due > now:
+                    self._condition.wait(None if due is None else due - now)
+                    continue
+                forced = self._forced
+            self._execute(forced)
+
+    def _execute(self, forced: bool):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            start = time.monotonic()
+            if self._dirty_since is not None:
+                self.max_observed_staleness = max(self.max_observed_staleness, start - self._dirty_since)
+            # Marks arriving from here on belong to the next rebuild
+            self._dirty_since = None
+            self._forced = False
+            self._last_start = start
+        try:
+            self.last_result = self.rebuild()
+            self.last_error = None
+            self.rebuilds += 1
+            if forced:
+                self.forced_rebuilds += 1
+        except Exception as e:
+            self.failed_rebuilds += 1
+            self.last_error = str(e)
+            print(f"[RebuildScheduler] {self.name} rebuild failed: {str(e)}")
+            with self._condition:
+                # The writes it should have absorbed are still pending; retry after min_interval
+                if self._dirty_since is None:
+                    self._dirty_since = start
+                    self._last_mark = start
+        finally:
+            with self._condition:
+                self.last_duration = time.monotonic() - start
+                self.last_finished_at = datetime.now().isoformat()
+                self._running = False
+                self._completed += 1
+                self._condition.notify_all()
+
+    def stats(self) -> Dict:
+        with self._condition:
+            staleness = time.monotonic() - self._dirty_since if self._dirty_since is not None else 0.0
+            return {
+                "running": self.running,
+                "dirty": self._dirty_since is not None,
+                "staleness_seconds": staleness,
+                "max_observed_staleness_seconds": self.max_observed_staleness,
+                "marks": self.marks,
+                "rebuilds": self.rebuilds,
+                "forced_rebuilds": self.forced_rebuilds,
+                "failed_rebuilds": self.failed_rebuilds,
+                # Writes absorbed into a shared rebuild instead of triggering their own
+                "coalesced_marks": max(0, self.marks - self.rebuilds - self.failed_rebuilds),
+                "last_duration_seconds": self.last_duration,
+                "last_finished_at": self.last_finished_at,
+                "last_result": self.last_result,
+                "last_error": self.last_error,
+                "min_interval_seconds": self.min_interval,
+                "quiet_period_seconds": self.quiet_period,
+                "max_staleness_seconds": self.max_staleness
+            }
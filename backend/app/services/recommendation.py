@@ -1,51 +1,231 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Iterable
+import threading
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import pandas as pd
+from scipy.sparse import csr_matrix
+from ..ml.feature_schema import FEATURE_SCHEMA, EncodedProfile
+
+# Kategorik değişkenler one-hot, sayısal değişkenler z-score ile kodlanır
+CATEGORICAL_COLUMNS = [
+    'Body Type', 'Sex', 'Diet', 'How Often Shower',
+    'Heating Energy Source', 'Transport', 'Vehicle Type',
+    'Social Activity', 'Energy efficiency', 'Recycling'
+]
+NUMERICAL_COLUMNS = [
+    'Monthly Grocery Bill', 'Vehicle Monthly Distance Km',
+    'Waste Bag Weekly Count', 'How Long TV PC Daily Hour',
+    'How Many New Clothes Monthly', 'How Long Internet Daily Hour'
+]
+
+class FittedFeatureSchema:
+    """load_data sırasında dondurulan one-hot sözlüğü ve normalizasyon istatistikleri."""
+
+    def __init__(self, vocabulary: Dict[str, List[str]], means: np.ndarray, stds: np.ndarray):
+        self.vocabulary = vocabulary
+        self.means = means
+        self.stds = stds
+        self.offsets = {}
+        self.code_maps = {}
+        offset = 0
+        for column in CATEGORICAL_COLUMNS:
+            self.offsets[column] = offset
+            self.code_maps[column] = {value: i for i, value in enumerate(vocabulary[column])}
+            offset += len(vocabulary[column])
+        self.numerical_offset = offset
+        self.width = offset + len(NUMERICAL_COLUMNS)
+        self.columns = [f"{c}_{v}" for c in CATEGORICAL_COLUMNS for v in vocabulary[c]] + NUMERICAL_COLUMNS
+
+    @classmethod
+    def fit(cls, user_data: pd.DataFrame) -> "FittedFeatureSchema":
+        vocabulary = {
+            column: sorted(str(v) for v in user_data[column].dropna().unique())
+            for column in CATEGORICAL_COLUMNS
+        }
+        numerical = user_data[NUMERICAL_COLUMNS].astype(float)
+        stds = numerical.std().to_numpy(copy=True)
+        stds[stds == 0] = 1.0
+        return cls(vocabulary, numerical.mean().to_numpy(copy=True), stds)
+
+    def encode_profile(self, profile: Dict[str, Any], encoded: Optional[EncodedProfile] = None) -> np.ndarray:
+        """Tek bir profili (Android veya veri seti alanları) pandas kullanmadan kodlar."""
+        vector = np.zeros(self.width, dtype=np.float32)
+        # Android yazımlarının normalizasyonu ortak özellik şemasında yapılır
+        record = FEATURE_SCHEMA.ensure(profile, encoded).dataset_record
+        for column in CATEGORICAL_COLUMNS:
+            code = self.code_maps[column].get(record.get(column))
+            if code is not None:
+                vector[self.offsets[column] + code] = 1.0
+        for i, column in enumerate(NUMERICAL_COLUMNS):
+            value = record.get(column)
+            if value is not None:
+                # Bilinmeyen sayısal değerler ortalamaya (z-score 0) eşitlenir
+                vector[self.numerical_offset + i] = (value - self.means[i]) / self.stds[i]
+        return vector
+
+
+# Etkileşim ağırlıkları: başlatılan < ilerleyen < tamamlanan
+INTERACTION_STARTED = 0.25
+INTERACTION_COMPLETED = 1.0
+
+
+def progress_weight(progress: float) -> float:
+    """Yüzde ilerlemeyi etkileşim ağırlığına çevirir."""
+    progress = min(100.0, max(0.0, float(progress)))
+    if progress >= 100.0:
+        return INTERACTION_COMPLETED
+    return INTERACTION_STARTED + (INTERACTION_COMPLETED - INTERACTION_STARTED) * 0.5 * progress / 100.0
+
+
+class InteractionMatrix:
+    """Kullanıcı × meydan okuma etkileşimlerini tutan, artımlı güncellenen sparse matris."""
+
+    def __init__(self, challenge_ids: List[str]):
+        self.challenge_index = {cid: i for i, cid in enumerate(challenge_ids)}
+        self.user_index: Dict[str, int] = {}
+        self._weights: Dict[tuple, float] = {}
+        self._csr = None
+        self._lock = threading.Lock()
+
+    def ensure_user(self, user_id: str) -> int:
+        with self._lock:
+            return self._ensure_user(user_id)
+
+    def _ensure_user(self, user_id: str) -> int:
+        if user_id not in self.user_index:
+            self.user_index[user_id] = len(self.user_index)
+            self._csr = None
+        return self.user_index[user_id]
+
+    def record(self, user_id: str, challenge_id: str, weight: float):
+        """Etkileşimi kaydeder; aynı çift için en güçlü etkileşim korunur."""
+        column = self.challenge_index.get(challenge_id)
+        if column is None or not user_id:
+            return
+        with self._lock:
+            key = (self._ensure_user(user_id), column)
+            if weight > self._weights.get(key, 0.0):
+                self._weights[key] = weight
+                self._csr = None
+
+    def set_challenges(self, challenge_ids: List[str]):
+        """Katalog değiştiğinde sütunları yeni id sırasına taşır."""
+        with self._lock:
+            old_ids = {i: cid for cid, i in self.challenge_index.items()}
+            self.challenge_index = {cid: i for i, cid in enumerate(challenge_ids)}
+            weights = {}
+            for (row, column), weight in self._weights.items():
+                new_column = self.challenge_index.get(old_ids[column])
+                if new_column is not None:
+                    weights[(row, new_column)] = weight
+            self._weights = weights
+            self._csr = None
+
+    def csr(self) -> csr_matrix:
+        """Güncel etkileşimleri CSR olarak döndürür (değişmediyse önbellekten)."""
+        with self._lock:
+            if self._csr is None:
+                shape = (len(self.user_index), len(self.challenge_index))
+                if self._weights:
+                    keys = np.array(list(self._weights.keys()), dtype=np.int64)
+                    values = np.fromiter(self._weights.values(), dtype=np.float32, count=len(self._weights))
+                    self._csr = csr_matrix((values, (keys[:, 0], keys[:, 1])), shape=shape)
+                else:
+                    self._csr = csr_matrix(shape, dtype=np.float32)
+            return self._csr
+
 
 class RecommendationEngine:
     def __init__(self):
-        self.user_matrix = None
         self.challenge_matrix = None
-        self.user_similarities = None
+        self.feature_schema: Optional[FittedFeatureSchema] = None
+        # Firestore kullanıcıları: etkileşim matrisiyle aynı satır sırasında profil vektörleri
+        self.challenge_ids: List[str] = []
+        self.interactions = InteractionMatrix([])
+        self._member_vectors = np.zeros((0, 0), dtype=np.float32)
+        self._member_lock = threading.Lock()
     
     def load_data(self, user_data: pd.DataFrame, challenge_data: List[Dict[str, Any]]):
         """Kullanıcı ve meydan okuma verilerini yükler."""
-        # Kullanıcı verilerini sayısallaştır
-        self.user_matrix = self._preprocess_user_data(user_data)
+        # Özellik şemasını dondur; profiller upsert_member ile bu şemaya göre kodlanır
+        self.feature_schema = FittedFeatureSchema.fit(user_data)
         
         # Meydan okuma verilerini matrise dönüştür
+        self.load_challenges(challenge_data)
+    
+    def load_challenges(self, challenge_data: List[Dict[str, Any]]):
+        """Meydan okuma kataloğu değiştiğinde matrisi yeniden oluşturur."""
         self.challenge_matrix = self._create_challenge_matrix(challenge_data)
-        
-        # Kullanıcı benzerliklerini hesapla
-        self.user_similarities = cosine_similarity(self.user_matrix)
+        self.challenge_ids = [c['id'] for c in challenge_data]
+        self.interactions.set_challenges(self.challenge_ids)
     
-    def _preprocess_user_data(self, user_data: pd.DataFrame) -> np.ndarray:
-        """Kullanıcı verilerini sayısallaştırır."""
-        # Kategorik değişkenleri one-hot encoding ile dönüştür
-        categorical_columns = [
-            'Body Type', 'Sex', 'Diet', 'How Often Shower',
-            'Heating Energy Source', 'Transport', 'Vehicle Type',
-            'Social Activity', 'Energy efficiency', 'Recycling'
-        ]
-        
-        # Sayısal değişkenleri normalize et
-        numerical_columns = [
-            'Monthly Grocery Bill', 'Vehicle Monthly Distance Km',
-            'Waste Bag Weekly Count', 'How Long TV PC Daily Hour',
-            'How Many New Clothes Monthly', 'How Long Internet Daily Hour'
-        ]
-        
-        # Kategorik değişkenleri dönüştür
-        categorical_data = pd.get_dummies(user_data[categorical_columns])
+    def load_members(self, profiles: Iterable[Dict[str, Any]]):
+        """Firestore kullanıcı profillerini üye matrisine yükler."""
+        for profile in profiles:
+            self.upsert_member(profile)
+    
+    def upsert_member(self, profile: Dict[str, Any], encoded: Optional[EncodedProfile] = None):
+        """Bir kullanıcının profil vektörünü ekler veya günceller."""
+        if self.feature_schema is None or not profile.get('userId'):
+            return
+        vector = self.feature_schema.encode_profile(profile, encoded)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+        with self._member_lock:
+            row = self.interactions.ensure_user(profile['userId'])
+            vectors = self._member_vectors
+            if vectors.shape[1] != vector.shape[0]:
+                vectors = np.zeros((0, vector.shape[0]), dtype=np.float32)
+            if row >= vectors.shape[0]:
+                # Kapasiteyi katlayarak büyüt; her eklemede kopyalamayı önler
+                grown = np.zeros((max(row + 1, 2 * vectors.shape[0], 16), vector.shape[0]), dtype=np.float32)
+                grown[:vectors.shape[0]] = vectors
+                vectors = grown
+            vectors[row] = vector
+            self._member_vectors = vectors
+    
+    def load_interactions(self, interactions: Iterable[tuple]):
+        """(userId, challengeId, ağırlık) üçlülerini toplu olarak yükler."""
+        for user_id, challenge_id, weight in interactions:
+            self.interactions.record(user_id, challenge_id, weight)
+    
+    def record_interaction(self, user_id: str, challenge_id: str, weight: float):
+        """start/progress/complete olaylarında matrisi artımlı günceller."""
+        self.interactions.record(user_id, challenge_id, weight)
+    
+    def _score_from_neighbours(self, user_vector: np.ndarray, exclude_user: Optional[str],
+                               n_neighbours: int, n_recommendations: int) -> List[Dict[str, Any]]:
+        """Benzerlik ağırlıkları × etkileşim matrisi: tek bir sparse çarpım."""
+        interactions = self.interactions.csr()
+        n_members = interactions.shape[0]
+        with self._member_lock:
+            members = self._member_vectors[:n_members]
         
-        # Sayısal değişkenleri normalize et
-        numerical_data = (user_data[numerical_columns] - user_data[numerical_columns].mean()) / user_data[numerical_columns].std()
+        exclude_row = self.interactions.user_index.get(exclude_user) if exclude_user else None
+        scores = np.zeros(len(self.challenge_ids), dtype=np.float32)
+        # Etkileşimi olup profili hiç yüklenmemiş kullanıcıların satırı yok: members daha kısa olabilir
+        if len(members) and members.shape[1] == user_vector.shape[0]:
+            similarities = members @ user_vector
+            if exclude_row is not None and exclude_row < len(members):
+                similarities[exclude_row] = -np.inf
+            k = min(n_neighbours, len(similarities))
+            neighbours = np.argpartition(-similarities, k - 1)[:k]
+            neighbours = neighbours[np.isfinite(similarities[neighbours]) & (similarities[neighbours] > 0)]
+            if len(neighbours):
+                weights = csr_matrix(
+                    (similarities[neighbours] / k, (np.zeros(len(neighbours), dtype=np.int64), neighbours)),
+                    shape=(1, n_members)
+                )
+                scores = np.asarray((weights @ interactions).todense()).ravel()
         
-        # Tüm verileri birleştir
-        processed_data = pd.concat([categorical_data, numerical_data], axis=1)
+        # Kullanıcının zaten tamamladığı meydan okumaları önerme (satır etkileşim matrisine göre)
+        if exclude_row is not None and exclude_row < n_members:
+            own = interactions.getrow(exclude_row)
+            scores[own.indices[own.data >= INTERACTION_COMPLETED]] = -np.inf
         
-        return processed_data.values
+        order = np.argsort(-scores, kind='stable')
+        order = order[np.isfinite(scores[order])][:n_recommendations]
+        return [{'challenge_id': self.challenge_ids[i], 'score': float(scores[i])} for i in order]
     
     def _create_challenge_matrix(self, challenge_data: List[Dict[str, Any]]) -> np.ndarray:
         """Meydan okuma verilerini matrise dönüştürür."""
@@ -68,97 +248,37 @@ class RecommendationEngine:
         
         return np.array(challenge_features)
     
-    def get_similar_users(self, user_id: int, n_users: int = 5) -> List[int]:
-        """Belirli bir kullanıcıya benzer kullanıcıları bulur."""
-        if self.user_similarities is None:
-            raise ValueError("Önce load_data() metodunu çağırın")
-        
-        # Kullanıcının benzerlik skorlarını al
-        user_similarities = self.user_similarities[user_id]
-        
-        # Kendisi hariç en benzer n kullanıcıyı bul
-        similar_users = np.argsort(user_similarities)[::-1][1:n_users+1]
-        
-        return similar_users.tolist()
-    
-    def recommend_challenges(self, user_id: int, user_challenges: List[Dict[str, Any]], 
+    def recommend_challenges(self, user_id: str, user_challenges: List[Dict[str, Any]], 
                            n_recommendations: int = 5) -> List[Dict[str, Any]]:
         """Kullanıcıya meydan okuma önerileri yapar."""
-        if self.user_similarities is None or self.challenge_matrix is None:
+        if self.challenge_matrix is None:
             raise ValueError("Önce load_data() metodunu çağırın")
         
-        # Kullanıcının tamamladığı meydan okumaları
-        completed_challenges = {c['challenge_id'] for c in user_challenges if c['completed']}
-        
-        # Benzer kullanıcıları bul
-        similar_users = self.get_similar_users(user_id)
-        
-        # Benzer kullanıcıların tamamladığı meydan okumaları
-        similar_user_challenges = []
-        for similar_user_id in similar_users:
-            # Burada benzer kullanıcıların meydan okuma verilerini almalıyız
-            # Şimdilik örnek veri kullanıyoruz
-            pass
+        # Kullanıcının tamamladığı meydan okumalar etkileşim matrisine de yansısın
+        for c in user_challenges:
+            if c.get('completed'):
+                self.record_interaction(user_id, c['challenge_id'], INTERACTION_COMPLETED)
         
-        # Meydan okuma skorlarını hesapla
-        challenge_scores = {}
-        for challenge_id, challenge_features in enumerate(self.challenge_matrix):
-            if challenge_id not in completed_challenges:
-                # Benzer kullanıcıların bu meydan okumayı tamamlama oranı
-                completion_rate = sum(1 for c in similar_user_challenges 
-                                   if c['challenge_id'] == challenge_id) / len(similar_users)
-                
-                # Kullanıcı-benzerlik ağırlıklı skor
-                score = completion_rate * np.mean(self.user_similarities[user_id, similar_users])
-                
-                challenge_scores[challenge_id] = score
+        row = self.interactions.user_index.get(user_id)
+        with self._member_lock:
+            if row is None or row >= self._member_vectors.shape[0]:
+                raise ValueError(f"User {user_id} has no profile in the recommendation engine")
+            user_vector = self._member_vectors[row].copy()
         
-        # En yüksek skorlu meydan okumaları öner
-        recommended_challenges = sorted(challenge_scores.items(), 
-                                     key=lambda x: x[1], 
-                                     reverse=True)[:n_recommendations]
-        
-        return [{'challenge_id': cid, 'score': score} 
-                for cid, score in recommended_challenges]
+        return self._score_from_neighbours(user_vector, user_id, 5, n_recommendations)
     
     def get_challenge_recommendations(self, user_data: Dict[str, Any], 
-                                    n_recommendations: int = 5) -> List[Dict[str, Any]]:
+                                    n_recommendations: int = 5,
+                                    encoded: Optional[EncodedProfile] = None) -> List[Dict[str, Any]]:
         """Kullanıcı verilerine göre meydan okuma önerileri yapar."""
-        # Kullanıcı verilerini DataFrame'e dönüştür
-        user_df = pd.DataFrame([user_data])
-        
-        # Kullanıcı verilerini işle
-        user_features = self._preprocess_user_data(user_df)
-        
-        # Tüm kullanıcılarla benzerlik hesapla
-        similarities = cosine_similarity(user_features, self.user_matrix)[0]
-        
-        # En benzer kullanıcıları bul
-        similar_users = np.argsort(similarities)[::-1][:5]
-        
-        # Benzer kullanıcıların tamamladığı meydan okumaları
-        similar_user_challenges = []
-        for similar_user_id in similar_users:
-            # Burada benzer kullanıcıların meydan okuma verilerini almalıyız
-            # Şimdilik örnek veri kullanıyoruz
-            pass
-        
-        # Meydan okuma skorlarını hesapla
-        challenge_scores = {}
-        for challenge_id, challenge_features in enumerate(self.challenge_matrix):
-            # Benzer kullanıcıların bu meydan okumayı tamamlama oranı
-            completion_rate = sum(1 for c in similar_user_challenges 
-                               if c['challenge_id'] == challenge_id) / len(similar_users)
-            
-            # Kullanıcı-benzerlik ağırlıklı skor
-            score = completion_rate * np.mean(similarities[similar_users])
-            
-            challenge_scores[challenge_id] = score
+        if self.feature_schema is None or self.challenge_matrix is None:
+            raise ValueError("Önce load_data() metodunu çağırın")
         
-        # En yüksek skorlu meydan okumaları öner
-        recommended_challenges = sorted(challenge_scores.items(), 
-                                     key=lambda x: x[1], 
-                                     reverse=True)[:n_recommendations]
+        # Profili şemaya hizalı bir vektöre dönüştür (DataFrame/get_dummies yok)
+        user_vector = self.feature_schema.encode_profile(user_data, encoded)
+        norm = np.linalg.norm(user_vector)
+        if norm > 0:
+            user_vector = user_vector / norm
         
-        return [{'challenge_id': cid, 'score': score} 
-                for cid, score in recommended_challenges] 
\ No newline at end of file
+        # Benzer Firestore kullanıcılarının etkileşimlerinden skorla
+        return self._score_from_neighbours(user_vector, user_data.get('userId'), 5, n_recommendations)
@@ -0,0 +1,245 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .shared_state import SharedArrayStore, SharedSnapshot
+
+FEATURES = "features"
+CHALLENGES = "challenges"
+
+
+class PrecomputedRecommendations:
+    """One published set of per-user recommendation lists, only ever replaced.
+
+    Each kind is a padded users x k array of item indices (-1 in unused slots) with the
+    scores beside it and a per-user count; a count of -1 means the list could not be
+    computed for that user. Looking a user up is a dict hit and a row slice.
+    """
+
+    __slots__ = ("user_index", "feature_names", "challenge_ids", "arrays", "started_at",
+                 "similarity_generation", "shared")
+
+    def __init__(self, user_ids: List[str], feature_names: List[str], challenge_ids: List[str],
+                 arrays: Dict[str, np.ndarray], started_at: float = 0.0, similarity_generation: int = 0,
+                 shared: Optional[SharedSnapshot] = None):
+        self.user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+        self.feature_names = feature_names
+        self.challenge_ids = challenge_ids
+        self.arrays = arrays
+        # When the job began reading its inputs; anything changed later is not reflected
+        self.started_at = started_at
+        self.similarity_generation = similarity_generation
+        self.shared = shared
+
+    @classmethod
+    def empty(cls) -> "PrecomputedRecommendations":
+        return cls([], [], [], {})
+
+    @classmethod
+    def from_shared(cls, shared: SharedSnapshot) -> "PrecomputedRecommendations":
+        meta = shared.meta
+        return cls(meta["rec_user_ids"], meta["rec_feature_names"], meta["rec_challenge_ids"], shared.arrays,
+                   meta["rec_started_at"], meta["rec_similarity_generation"], shared)
+
+    @property
+    def generation(self) -> int:
+        return self.shared.generation if self.shared is not None else 0
+
+    @property
+    def users(self) -> int:
+        return len(self.user_index)
+
+    @staticmethod
+    def build_arrays(user_ids: List[str], feature_lists: Dict[str, Optional[List[Dict]]],
+                     challenge_lists: Dict[str, Optional[List[Dict]]], feature_names: List[str],
+                     challenge_ids: List[str]) -> Dict[str, np.ndarray]:
+        """Pack the lists into the padded index and score arrays"""
+        feature_index = {feature: i for i, feature in enumerate(feature_names)}
+        challenge_index = {challenge_id: i for i, challenge_id in enumerate(challenge_ids)}
+        feature_items, feature_scores, feature_counts = _pack(
+            user_ids, feature_lists, lambda rec: feature_index.get(rec["feature"], -1),
+            ("similarity_score", "improvement_potential"), np.int16
+        )
+        challenge_items, challenge_scores, challenge_counts = _pack(
+            user_ids, challenge_lists, lambda rec: challenge_index.get(rec["challenge_id"], -1),
+            ("score",), np.int32
+        )
+        return {
+            "rec_feature": feature_items,
+            "rec_feature_similarity": feature_scores[0],
+            "rec_feature_improvement": feature_scores[1],
+            "rec_feature_count": feature_counts,
+            "rec_challenge": challenge_items,
+            "rec_challenge_score": challenge_scores[0],
+            "rec_challenge_count": challenge_counts
+        }
+
+    def features(self, user_id: str) -> Optional[List[Dict]]:
+        row = self._row(user_id, "rec_feature_count")
+        if row is None:
+            return None
+        row, count = row
+        items = self.arrays["rec_feature"][row, :count]
+        similarities = self.arrays["rec_feature_similarity"][row, :count]
+        improvements = self.arrays["rec_feature_improvement"][row, :count]
+        return [
+            {
+                "feature": self.feature_names[item],
+                "similarity_score": float(similarity),
+                "improvement_potential": float(improvement)
+            }
+            for item, similarity, improvement in zip(items, similarities, improvements)
+        ]
+
+    def challenges(self, user_id: str) -> Optional[List[Dict]]:
+        row = self._row(user_id, "rec_challenge_count")
+        if row is None:
+            return None
+        row, count = row
+        items = self.arrays["rec_challenge"][row, :count]
+        scores = self.arrays["rec_challenge_score"][row, :count]
+        return [{"challenge_id": self.challenge_ids[item], "score": float(score)} for item, score in zip(items, scores)]
+
+    def _row(self, user_id: str, count_array: str) -> Optional[Tuple[int, int]]:
+        row = self.user_index.get(user_id)
+        if row is None:
+            return None
+        count = int(self.arrays[count_array][row])
+        return (row, count) if count >= 0 else None
+
+
+def _pack(user_ids: List[str], lists: Dict[str, Optional[List[Dict]]], item_of: Callable[[Dict], int],
+          score_keys: Tuple[str, ...], item_dtype) -> Tuple[np.ndarray, List[np.ndarray], np.ndarray]:
+    width = max((len(recs) for recs in lists.values() if recs), default=0)
+    items = np.full((len(user_ids), width), -1, dtype=item_dtype)
+    scores = [np.zeros((len(user_ids), width), dtype=np.float32) for _ in score_keys]
+    counts = np.full(len(user_ids), -1, dtype=np.int16)
+    for row, user_id in enumerate(user_ids):
+        recs = lists.get(user_id)
+        if recs is None:
+            continue
+        # Items outside the published vocabulary (e.g. a challenge removed since) are dropped
+        recs = [rec for rec in recs if item_of(rec) >= 0]
+        counts[row] = len(recs)
+        for slot, rec in enumerate(recs):
+            items[row, slot] = item_of(rec)
+            for score, key in zip(scores, score_keys):
+                score[row, slot] = rec[key]
+    return items, scores, counts
+
+
+class RecommendationStore:
+    """Feature and challenge recommendations precomputed for every user.
+
+    A batch job computes the lists for all users from one similarity snapshot and
+    publishes them through a SharedArrayStore, so they are persisted on disk, survive a
+    restart and are memory-mapped once by every worker; serving a user is then a lookup.
+    A profile write refreshes that user's lists here (refresh_user) instead of waiting
+    for the next batch; such entries are dropped once a batch started after them is
+    attached. They are kept by the worker that handled the write, so other workers serve
+    the batch lists until the next one. Anything that must hold on every worker at once,
+    such as not recommending completed challenges, is applied by the caller at lookup.
+    """
+
+    def __init__(self, shared_store: SharedArrayStore):
+        self.shared_store = shared_store
+        self.snapshot = PrecomputedRecommendations.empty()
+        # user_id -> kind -> (time of the refresh, fresh list)
+        self._overrides: Dict[str, Dict[str, Tuple[float, List[Dict]]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.user_refreshes = 0
+
+    def sync_shared(self):
+        """Attach to a newer published batch, dropping the per-user entries it already covers"""
+        shared = self.shared_store.refresh(self.snapshot.shared)
+        if shared is None or "rec_feature_count" not in shared.arrays:
+            return
+        snapshot = PrecomputedRecommendations.from_shared(shared)
+        with self._lock:
+            self.snapshot = snapshot
+            overrides = {}
+            for user_id, entries in self._overrides.items():
+                newer = {kind: entry for kind, entry in entries.items() if entry[0] >= snapshot.started_at}
+                if newer:
+                    overrides[user_id] = newer
+            self._overrides = overrides
+
+    def features(self, user_id: str) -> Optional[List[Dict]]:
+        """The user's feature recommendations, or None when they have to be computed live"""
+        return self._get(FEATURES, user_id)
+
+    def challenges(self, user_id: str) -> Optional[List[Dict]]:
+        """The user's challenge recommendations, or None when they have to be computed live"""
+        return self._get(CHALLENGES, user_id)
+
+    def _get(self, kind: str, user_id: str) -> Optional[List[Dict]]:
+        self.sync_shared()
+        with self._lock:
+            entry = self._overrides.get(user_id, {}).get(kind)
+            snapshot = self.snapshot
+        if entry is not None:
+            recs = [dict(rec) for rec in entry[1]]
+        else:
+            recs = snapshot.features(user_id) if kind == FEATURES else snapshot.challenges(user_id)
+        if recs is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return recs
+
+    def refresh_user(self, user_id: str, features: Optional[List[Dict]] = None,
+                     challenges: Optional[List[Dict]] = None):
+        """Serve freshly computed lists for one user until a newer batch includes them"""
+        now = time.time()
+        with self._lock:
+            entries = self._overrides.setdefault(user_id, {})
+            if features is not None:
+                entries[FEATURES] = (now, [dict(rec) for rec in features])
+            if challenges is not None:
+                entries[CHALLENGES] = (now, [dict(rec) for rec in challenges])
+            self.user_refreshes += 1
+
+    @staticmethod
+    def build_shared(feature_lists: Dict[str, Optional[List[Dict]]], challenge_lists: Dict[str, Optional[List[Dict]]],
+                     feature_names: List[str], challenge_ids: List[str], started_at: float,
+                     similarity_generation: int) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """Lists for SharedArrayStore.publish, built without touching a live store"""
+        user_ids = list(dict.fromkeys([*feature_lists, *challenge_lists]))
+        arrays = PrecomputedRecommendations.build_arrays(user_ids, feature_lists, challenge_lists,
+                                                         list(feature_names), list(challenge_ids))
+        meta = {
+            "rec_user_ids": user_ids,
+            "rec_feature_names": list(feature_names),
+            "rec_challenge_ids": list(challenge_ids),
+            "rec_started_at": started_at,
+            "rec_similarity_generation": similarity_generation
+        }
+        return arrays, meta
+
+    def rebuild(self, build: Callable[[], Tuple[Dict[str, np.ndarray], Dict]], wait: bool = False) -> Optional[int]:
+        """Run the batch job if this process wins the builder lock, then attach to the result"""
+        generation = self.shared_store.rebuild(build, wait=wait)
+        self.sync_shared()
+        return generation
+
+    def stats(self) -> Dict:
+        snapshot = self.snapshot
+        lookups = self.hits + self.misses
+        with self._lock:
+            overridden = len(self._overrides)
+        return {
+            "generation": snapshot.generation,
+            "users": snapshot.users,
+            "similarity_generation": snapshot.similarity_generation,
+            "started_at": snapshot.started_at or None,
+            "bytes": int(sum(array.nbytes for array in snapshot.arrays.values())),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "refreshed_users": overridden,
+            "user_refreshes": self.user_refreshes
+        }
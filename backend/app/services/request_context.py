@@ -0,0 +1,48 @@
+from typing import Dict, List, Optional
+
+from ..ml.feature_schema import EncodedProfile, encode_profile
+from .cpu_pool import CPUPool, calculate_footprint_task
+from .ml_service import MLService
+
+
+class RequestContext:
+    """The work derived from one profile within one request, each piece done at most once.
+
+    Encoding, the category predictions and the neighbour lookup are memoised here, so an
+    endpoint (and anything it calls) asks the context instead of recomputing them. The
+    footprint is computed without recommendations; recommendations are looked up for the
+    profile being saved, so they reflect it even before the next similarity rebuild.
+    """
+
+    def __init__(self, user_id: str, profile: Dict, ml_service: MLService, cpu_pool: CPUPool):
+        self.user_id = user_id
+        self.profile = {**profile, "userId": user_id}
+        self.ml_service = ml_service
+        self.cpu_pool = cpu_pool
+        self._encoded: Optional[EncodedProfile] = None
+        self._footprint: Optional[Dict] = None
+        self._recommendations: Optional[List[Dict]] = None
+
+    @property
+    def encoded(self) -> EncodedProfile:
+        if self._encoded is None:
+            self._encoded = encode_profile(self.profile)
+        return self._encoded
+
+    async def footprint(self) -> Dict:
+        """Total and per-category footprint, predicted once in the CPU pool"""
+        if self._footprint is None:
+            self._footprint = await self.cpu_pool.run(
+                calculate_footprint_task, self.profile, self.encoded, False
+            )
+        return self._footprint
+
+    def recommendations(self) -> List[Dict]:
+        """Neighbour-based recommendations for this profile, looked up once"""
+        if self._recommendations is None:
+            try:
+                self._recommendations = self.ml_service.get_recommendations(self.user_id, encoded=self.encoded)
+            except Exception as e:
+                print(f"[RequestContext] Error getting recommendations for {self.user_id}: {str(e)}")
+                self._recommendations = []
+        return self._recommendations
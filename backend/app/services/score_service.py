@@ -0,0 +1,75 @@
+import random
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+from firebase_admin import firestore
+
+
+class ScoreService:
+    """Contention-free challenge scoring backed by server-side increments"""
+
+    def __init__(self, db, num_shards: int = 10, sharded_users: Optional[Iterable[str]] = None,
+                 shard_all: bool = False):
+        self.db = db
+        self.num_shards = max(1, num_shards)
+        self.sharded_users = set(sharded_users or [])
+        self.shard_all = shard_all
+
+    def is_sharded(self, user_id: str) -> bool:
+        return self.shard_all or user_id in self.sharded_users
+
+    def award(self, user_id: str, challenge_title: str, points: int) -> int:
+        """Add points and record the completion in a single atomic commit.
+
+        Returns the total score read back after the commit, so it is the committed value
+        (including any award that landed concurrently) rather than a cached one.
+        """
+        now = datetime.now()
+        user_ref = self.db.collection("user_data").document(user_id)
+        last_challenge = {
+            "last_challenge_completed": challenge_title,
+            "last_challenge_date": now
+        }
+        batch = self.db.batch()
+        batch.set(self.db.collection("completed_challenges").document(), {
+            "userId": user_id,
+            "challenge_title": challenge_title,
+            "points_earned": points,
+            "completed_at": now
+        })
+
+        if self.is_sharded(user_id):
+            # Hot users spread their increments over N shard documents so that concurrent
+            # completions do not all queue up on the single user_data document; nothing
+            # else is written there either, so the last completion is kept on the shard
+            shard_ref = user_ref.collection("score_shards").document(str(random.randrange(self.num_shards)))
+            batch.set(shard_ref, {"points": firestore.Increment(points), **last_challenge}, merge=True)
+        else:
+            batch.update(user_ref, {"total_score": firestore.Increment(points), **last_challenge})
+
+        batch.commit()
+        total = self.read_total(user_id)
+        return total if total is not None else points
+
+    def get_total(self, user_id: str, base_score: int) -> int:
+        """Total score of a user: the document's total_score plus any shard points"""
+        if not self.is_sharded(user_id):
+            return base_score
+        shards = self.db.collection("user_data").document(user_id).collection("score_shards").stream()
+        return base_score + sum(int(doc.to_dict().get("points", 0)) for doc in shards)
+
+    def read_total(self, user_id: str) -> Optional[int]:
+        """Total score read from Firestore, or None when the user does not exist"""
+        snapshot = self.db.collection("user_data").document(user_id).get()
+        if not snapshot.exists:
+            return None
+        return self.get_total(user_id, int((snapshot.to_dict() or {}).get("total_score", 0)))
+
+    def shard_totals(self) -> Dict[str, int]:
+        """Shard points of every sharded user, read with one collection-group query"""
+        if not self.shard_all and not self.sharded_users:
+            return {}
+        totals = {}
+        for doc in self.db.collection_group("score_shards").stream():
+            user_id = doc.reference.parent.parent.id
+            totals[user_id] = totals.get(user_id, 0) + int(doc.to_dict().get("points", 0))
+        return totals
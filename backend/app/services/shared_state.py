@@ -0,0 +1,205 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process per store, a thread lock is enough
+    fcntl = None
+
+SHARED_STATE_ROOT = Path(os.getenv("SHARED_STATE_DIR", str(Path(__file__).parent.parent.parent / "data" / "shared")))
+
+_thread_locks: Dict[str, threading.Lock] = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path: Path, blocking: bool = True):
+    """Exclusive lock shared by every process (and thread) using the same lock file.
+
+    Yields True when the lock is held, False when blocking=False and someone else has it.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        with _thread_locks_guard:
+            lock = _thread_locks.setdefault(str(path), threading.Lock())
+        acquired = lock.acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+        return
+
+    with open(path, "a+") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class SharedSnapshot:
+    """One published generation: read-only memory-mapped arrays plus JSON metadata"""
+
+    __slots__ = ("generation", "arrays", "meta")
+
+    def __init__(self, generation: int, arrays: Dict[str, np.ndarray], meta: Dict):
+        self.generation = generation
+        self.arrays = arrays
+        self.meta = meta
+
+
+class SharedArrayStore:
+    """Arrays built by one process and memory-mapped read-only by every uvicorn worker.
+
+    Each publish writes <root>/<name>/gen-<n>/ (one .npy per array plus meta.json) and
+    then atomically replaces the GENERATION file. Workers compare that counter with the
+    generation they hold and re-attach when it moves, so published arrays live once in the
+    page cache instead of once per worker. Rebuilds are serialised by a file lock: a
+    worker that finds another build in progress leaves a rebuild request behind, and the
+    builder runs again before it releases the lock.
+    """
+
+    def __init__(self, name: str, root: Optional[Path] = None, keep_generations: int = 2):
+        self.name = name
+        self.directory = Path(root or SHARED_STATE_ROOT) / name
+        self.keep_generations = max(2, keep_generations)
+        self.builds = 0
+        self.skipped_builds = 0
+
+    @property
+    def generation_path(self) -> Path:
+        return self.directory / "GENERATION"
+
+    @property
+    def lock_path(self) -> Path:
+        return self.directory / "builder.lock"
+
+    @property
+    def request_path(self) -> Path:
+        return self.directory / "rebuild.requested"
+
+    def generation(self) -> int:
+        """The latest published generation, 0 if nothing has been published yet"""
+        try:
+            return int(self.generation_path.read_text().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def generation_age(self) -> Optional[float]:
+        """Seconds since the latest generation was published"""
+        try:
+            return time.time() - self.generation_path.stat().st_mtime
+        except OSError:
+            return None
+
+    def attach(self) -> Optional[SharedSnapshot]:
+        """Memory-map the latest generation read-only"""
+        generation = self.generation()
+        if generation == 0:
+            return None
+        directory = self._generation_dir(generation)
+        try:
+            with open(directory / "meta.json") as f:
+                meta = json.load(f)
+            arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in meta.pop("_arrays")}
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[SharedArrayStore] Could not attach {self.name} generation {generation}: {str(e)}")
+            return None
+        return SharedSnapshot(generation, arrays, meta)
+
+    def refresh(self, snapshot: Optional[SharedSnapshot]) -> Optional[SharedSnapshot]:
+        """A newer snapshot if the generation moved on, otherwise None"""
+        current = snapshot.generation if snapshot is not None else 0
+        if self.generation() == current:
+            return None
+        return self.attach()
+
+    def publish(self, arrays: Dict[str, np.ndarray], meta: Dict) -> int:
+        """Write a new generation and make it current; call while holding the builder lock"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        generation = self.generation() + 1
+        staging = Path(tempfile.mkdtemp(prefix=".staging-", dir=self.directory))
+        try:
+            for name, array in arrays.items():
+                np.save(staging / f"{name}.npy", np.ascontiguousarray(array))
+            with open(staging / "meta.json", "w") as f:
+                json.dump({**meta, "_arrays": list(arrays)}, f, default=str)
+            target = self._generation_dir(generation)
+            if target.exists():
+                shutil.rmtree(target)
+            os.rename(staging, target)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        fd, tmp = tempfile.mkstemp(prefix=".GENERATION-", dir=self.directory)
+        with os.fdopen(fd, "w") as f:
+            f.write(str(generation))
+        os.replace(tmp, self.generation_path)
+        self._prune(generation)
+        return generation
+
+    def rebuild(self, build: Callable[[], Union[Tuple[Dict[str, np.ndarray], Dict], int]],
+                wait: bool = False, max_age: Optional[float] = None) -> Optional[int]:
+        """Build and publish a generation if this process wins the builder lock.
+
+        With wait=False a busy lock records a rebuild request and returns None at once.
+        With max_age, a generation published less than max_age seconds ago is reused
+        instead of building again (several workers starting together build only once).
+        """
+        generation = None
+        while True:
+            with file_lock(self.lock_path, blocking=wait) as acquired:
+                if not acquired:
+                    if generation is None:
+                        self.directory.mkdir(parents=True, exist_ok=True)
+                        self.request_path.touch()
+                        self.skipped_builds += 1
+                    return generation
+                age = self.generation_age()
+                if (generation is None and max_age is not None and age is not None and age < max_age
+                        and not self.request_path.exists()):
+                    return self.generation()
+                while generation is None or self._take_request():
+                    self._take_request()
+                    result = build()
+                    # A build may publish by itself (e.g. from a pool process) and return the generation
+                    generation = result if isinstance(result, int) else self.publish(*result)
+                    self.builds += 1
+            # A request left between our last check and the unlock would otherwise wait for the next write
+            if not self.request_path.exists():
+                return generation
+            wait = False
+
+    def _take_request(self) -> bool:
+        try:
+            self.request_path.unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _generation_dir(self, generation: int) -> Path:
+        return self.directory / f"gen-{generation:06d}"
+
+    def _prune(self, generation: int):
+        # Mapped files stay readable after unlink on POSIX, so old generations can go
+        for path in self.directory.glob("gen-*"):
+            try:
+                if int(path.name[4:]) <= generation - self.keep_generations:
+                    shutil.rmtree(path)
+            except (ValueError, OSError):
+                continue
@@ -0,0 +1,140 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class UserDataCache:
+    """Read-through TTL/LRU cache for user_data documents.
+
+    The cache lives in one process and nothing invalidates it across workers: a write
+    handled by another uvicorn worker, or made by the app directly in Firestore, is seen
+    here only once the entry expires. Keep ttl_seconds short when running several
+    workers. Missing documents are remembered for negative_ttl_seconds only, so a user
+    who registers right after a failed lookup is found almost at once.
+    """
+
+    def __init__(self, db, collection: str = "user_data", max_entries: int = 1024, ttl_seconds: float = 30.0,
+                 negative_ttl_seconds: float = 2.0):
+        self.db = db
+        self.collection = collection
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        # user_id -> (expires_at, document dict or None for a missing document)
+        self._entries = OrderedDict()
+        # user_id -> token of the Firestore read in flight; a local write removes it, so
+        # the (older) result of that read is not stored over the write
+        self._pending: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        """Return a copy of the user document, loading it from Firestore on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return dict(entry[1]) if entry[1] is not None else None
+            self.misses += 1
+            token = object()
+            self._pending[user_id] = token
+
+        try:
+            doc = self.db.collection(self.collection).document(user_id).get()
+        except Exception:
+            with self._lock:
+                if self._pending.get(user_id) is token:
+                    del self._pending[user_id]
+            raise
+        data = doc.to_dict() if doc.exists else None
+        with self._lock:
+            if self._pending.get(user_id) is token:
+                del self._pending[user_id]
+                self._store_locked(user_id, data)
+        return dict(data) if data is not None else None
+
+    def set(self, user_id: str, data: Dict):
+        """Write-through after a full document set"""
+        with self._lock:
+            self._pending.pop(user_id, None)
+            self._store_locked(user_id, dict(data))
+
+    def update(self, user_id: str, fields: Dict):
+        """Merge a partial update into a cached entry, if there is one"""
+        with self._lock:
+            self._pending.pop(user_id, None)
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] is None:
+                return
+            self._entries[user_id] = (entry[0], {**entry[1], **fields})
+
+    def increment(self, user_id: str, field: str, amount) -> Optional[int]:
+        """Mirror a server-side Increment on a cached entry and return the new value"""
+        with self._lock:
+            self._pending.pop(user_id, None)
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] is None:
+                return None
+            value = entry[1].get(field, 0) + amount
+            self._entries[user_id] = (entry[0], {**entry[1], field: value})
+            return value
+
+    def invalidate(self, user_id: str):
+        """Drop a cached entry so the next read goes to Firestore"""
+        with self._lock:
+            self._pending.pop(user_id, None)
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._entries.clear()
+
+    def _store_locked(self, user_id: str, data: Optional[Dict]):
+        # Called with the lock held
+        ttl = self.ttl_seconds if data is not None else self.negative_ttl_seconds
+        if ttl <= 0:
+            self._entries.pop(user_id, None)
+            return
+        self._entries[user_id] = (time.monotonic() + ttl, data)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _estimate_bytes(self) -> int:
+        """Rough deep size of the cached documents"""
+        total = sys.getsizeof(self._entries)
+        for user_id, (_, data) in self._entries.items():
+            total += sys.getsizeof(user_id)
+            if data is None:
+                continue
+            total += sys.getsizeof(data)
+            for key, value in data.items():
+                total += sys.getsizeof(key) + sys.getsizeof(value)
+                if isinstance(value, (list, dict)):
+                    items = value.values() if isinstance(value, dict) else value
+                    total += sum(sys.getsizeof(item) for item in items)
+        return total
+
+    def stats(self) -> Dict:
+        """Hit ratio and memory usage of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "negative_ttl_seconds": self.negative_ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "approx_bytes": self._estimate_bytes()
+            }
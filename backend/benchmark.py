@@ -0,0 +1,284 @@
+import argparse
+import ast
+import contextlib
+import gc
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from sklearn.metrics.pairwise import cosine_similarity
+
+from app.batch import dataset_profiles
+from app.ml.feature_schema import FEATURE_SCHEMA, profile_signatures
+from app.services.data_loader import DataLoader, parse_list_literal
+from app.services.dataset import DatasetStore
+from app.services.ml_service import MLService, SimilaritySnapshot
+from app.services.recommendation_store import RecommendationStore
+from app.services.shared_state import SharedArrayStore
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATASET_PATH = os.path.join(os.path.dirname(__file__), "data", "Carbon Emission.csv")
+
+
+def synthetic_dataset(rows: int, path: str, seed: int = 42):
+    """Write a copy of the dataset resampled (with replacement) to the requested size"""
+    source = pd.read_csv(DATASET_PATH)
+    rng = np.random.default_rng(seed)
+    source.iloc[rng.integers(0, len(source), size=rows)].to_csv(path, index=False)
+
+
+def legacy_load(path: str) -> pd.DataFrame:
+    """The previous loading path: inferred dtypes and a per-row parse of Cooking_With"""
+    data = pd.read_csv(path)
+    data['Cooking_With'] = data['Cooking_With'].apply(ast.literal_eval)
+    methods = set()
+    for items in data['Cooking_With']:
+        methods.update(items)
+    for method in methods:
+        data[f'Cooking_{method}'] = data['Cooking_With'].apply(lambda x: 1 if method in x else 0)
+    return data
+
+
+def timed(func, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def bench_loader(args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "carbon_emission_synthetic.csv")
+        logger.info(f"Writing a {args.rows:,}-row synthetic dataset...")
+        synthetic_dataset(args.rows, path)
+
+        cache_root = os.path.join(tmp, "cache")
+        # Cold: parse the CSV and write the columnar cache; warm: a new process maps the cache
+        loader, loader_time = timed(DataLoader, data_path=path, dataset=DatasetStore(path, cache_root))
+        result = {
+            "rows": args.rows,
+            "loader_s": loader_time,
+            "features": loader.X.shape[1],
+            "memory_mb": loader.data.memory_usage(deep=True).sum() / 1e6
+        }
+        del loader
+        gc.collect()
+        _, result["cached_s"] = timed(DataLoader, data_path=path, dataset=DatasetStore(path, cache_root))
+        if not args.skip_legacy:
+            _, legacy_time = timed(legacy_load, path)
+            result["legacy_s"] = legacy_time
+        return result
+
+
+def print_loader(result: dict):
+    print("\n" + "=" * 60)
+    print("📊 DATASET LOADER BENCHMARK")
+    print("=" * 60)
+    print(f"  • Rows: {result['rows']:,}, features: {result['features']}")
+    print(f"  • DataLoader, cold (parse CSV + write cache): {result['loader_s']:.2f} s "
+          f"({result['rows'] / result['loader_s']:,.0f} rows/s)")
+    print(f"  • DataLoader, warm (memory-mapped cache): {result['cached_s']:.2f} s")
+    print(f"  • Preprocessed frame in memory: {result['memory_mb']:.1f} MB")
+    if "legacy_s" in result:
+        print(f"  • Legacy read + per-row list parsing: {result['legacy_s']:.2f} s "
+              f"({result['legacy_s'] / result['loader_s']:.1f}x slower)")
+
+
+def bench_predict(args) -> dict:
+    loader = DataLoader()
+    logger.info("Training the emission model...")
+    loader.train_model(save=False)
+
+    users = loader.dataset.frame(copy=False).drop(columns=["CarbonEmission"])
+    rng = np.random.default_rng(42)
+    batch = users.iloc[rng.integers(0, len(users), size=args.rows)].reset_index(drop=True)
+    singles = [
+        {**record, "Cooking_With": parse_list_literal(record["Cooking_With"])}
+        for record in batch.iloc[:args.single_calls].to_dict("records")
+    ]
+
+    loader.predict_emission(singles[0])  # warm-up
+    _, single_time = timed(lambda: [loader.predict_emission(record) for record in singles])
+    _, batch_time = timed(loader.predict_emission_many, batch)
+    return {
+        "single_calls": len(singles),
+        "single_ms": single_time / len(singles) * 1000,
+        "single_rps": len(singles) / single_time,
+        "rows": args.rows,
+        "batch_s": batch_time,
+        "batch_rps": args.rows / batch_time
+    }
+
+
+def print_predict(result: dict):
+    print("\n" + "=" * 60)
+    print("📊 EMISSION PREDICTION THROUGHPUT")
+    print("=" * 60)
+    print(f"  • 1 row per call ({result['single_calls']} calls): {result['single_ms']:.2f} ms/call, "
+          f"{result['single_rps']:,.0f} rows/s")
+    print(f"  • {result['rows']:,} rows in one predict_emission_many call: {result['batch_s']:.2f} s, "
+          f"{result['batch_rps']:,.0f} rows/s")
+    print(f"  • Batch speed-up: {result['batch_rps'] / result['single_rps']:.1f}x")
+
+
+def bench_similarity(args) -> dict:
+    source = pd.read_csv(DATASET_PATH)
+    rng = np.random.default_rng(42)
+    frame = source.iloc[rng.integers(0, len(source), size=args.rows)] if args.rows != len(source) else source
+    profiles = dataset_profiles(frame)
+    sample = rng.integers(0, len(profiles), size=min(args.queries, len(profiles)))
+
+    # Previous representation: impact values, dense cosine between distinct rows (k x k)
+    def dense_build():
+        matrix = FEATURE_SCHEMA.dense_many(profiles)
+        signatures, user_signatures = profile_signatures(matrix)
+        return user_signatures, cosine_similarity(signatures)
+
+    (dense_signatures, dense_similarity), dense_time = timed(dense_build)
+    _, dense_query_time = timed(lambda: [dense_similarity[dense_signatures[u]][dense_signatures] for u in sample])
+
+    # Current representation: normalised one-hot CSR rows, one sparse product per query
+    (arrays, meta), sparse_time = timed(MLService.build_shared, profiles)
+    snapshot = SimilaritySnapshot.from_arrays({}, meta["ml_feature_names"], arrays)
+    rows, sparse_query_time = timed(lambda: [snapshot.similarities(u) for u in sample])
+
+    onehot = FEATURE_SCHEMA.onehot_from_codes(FEATURE_SCHEMA.codes_many([profiles[u] for u in sample[:20]]))
+    reference = cosine_similarity(onehot, FEATURE_SCHEMA.onehot_from_codes(FEATURE_SCHEMA.codes_many(profiles)))
+    sparse_mb = sum(arrays[name].nbytes for name in arrays if name.startswith("ml_signature")) / 1e6
+    result = {
+        "rows": len(profiles),
+        "queries": len(sample),
+        "dense_signatures": int(dense_signatures.max()) + 1,
+        "dense_s": dense_time,
+        "dense_mb": dense_similarity.nbytes / 1e6,
+        "dense_query_ms": dense_query_time / len(sample) * 1000,
+        "signatures": snapshot.signature_vectors.shape[0],
+        "nnz": snapshot.signature_vectors.nnz,
+        "sparse_s": sparse_time,
+        "sparse_mb": sparse_mb,
+        "sparse_query_ms": sparse_query_time / len(sample) * 1000,
+        "max_abs_diff": float(np.abs(np.vstack(rows[:20]) - reference).max())
+    }
+    if not args.skip_full:
+        # The original representation: dense cosine between all users (n x n)
+        full, result["full_s"] = timed(cosine_similarity, FEATURE_SCHEMA.dense_many(profiles))
+        result["full_mb"] = full.nbytes / 1e6
+    return result
+
+
+def print_similarity(result: dict):
+    print("\n" + "=" * 60)
+    print("📊 COLLABORATIVE-FILTERING SIMILARITY")
+    print("=" * 60)
+    print(f"  • Users: {result['rows']:,}, timed queries: {result['queries']}")
+    if "full_s" in result:
+        print(f"  • Dense impact values, n x n cosine: {result['full_s']:.2f} s, {result['full_mb']:.1f} MB")
+    print(f"  • Dense impact values, {result['dense_signatures']:,} distinct rows, k x k cosine: "
+          f"{result['dense_s']:.2f} s, {result['dense_mb']:.1f} MB, {result['dense_query_ms']:.3f} ms/query")
+    print(f"  • Sparse one-hot, {result['signatures']:,} signatures ({result['nnz']:,} non-zeros): "
+          f"{result['sparse_s']:.2f} s, {result['sparse_mb']:.2f} MB, {result['sparse_query_ms']:.3f} ms/query")
+    print(f"  • Build: {result['dense_s'] / result['sparse_s']:.1f}x faster, "
+          f"memory: {result['dense_mb'] / result['sparse_mb']:.0f}x smaller")
+    print(f"  • Max difference from sklearn cosine on one-hot rows: {result['max_abs_diff']:.2e}")
+
+
+def bench_recommendations(args) -> dict:
+    source = pd.read_csv(DATASET_PATH)
+    rng = np.random.default_rng(42)
+    frame = source.iloc[rng.integers(0, len(source), size=args.rows)] if args.rows != len(source) else source
+    profiles = dataset_profiles(frame)
+    user_ids = [profile["userId"] for profile in profiles]
+    sample = [user_ids[i] for i in rng.integers(0, len(user_ids), size=min(args.queries, len(user_ids)))]
+
+    with tempfile.TemporaryDirectory() as root, open(os.devnull, "w") as devnull:
+        similarity_store = SharedArrayStore("similarity", root)
+        similarity_store.rebuild(lambda: MLService.build_shared(profiles), wait=True)
+        service = MLService(shared_store=similarity_store)
+        service.sync_shared()
+        snapshot = service.similarity
+
+        # Per request, as the endpoint computed them before (the service logs every call)
+        with contextlib.redirect_stdout(devnull):
+            live, live_time = timed(lambda: {user_id: service.get_recommendations(user_id) for user_id in sample})
+
+        # Batch job: every user from the snapshot, then one publish
+        store = RecommendationStore(SharedArrayStore("recommendations", root))
+        feature_lists, batch_time = timed(lambda: dict(service.recommendations_for_all(snapshot=snapshot)))
+        _, publish_time = timed(store.rebuild, lambda: RecommendationStore.build_shared(
+            feature_lists, {}, snapshot.feature_names, [], time.time(), snapshot.generation
+        ), True)
+        stored, lookup_time = timed(lambda: {user_id: store.features(user_id) for user_id in sample})
+
+        stats = store.stats()
+        max_diff = max(
+            (abs(a[key] - b[key]) for user_id in sample for a, b in zip(live[user_id], stored[user_id])
+             for key in ("similarity_score", "improvement_potential")),
+            default=0.0
+        )
+        return {
+            "rows": len(profiles),
+            "queries": len(sample),
+            "live_ms": live_time / len(sample) * 1000,
+            "batch_s": batch_time,
+            "publish_s": publish_time,
+            "lookup_us": lookup_time / len(sample) * 1e6,
+            "store_mb": stats["bytes"] / 1e6,
+            "same_features": all([r["feature"] for r in live[u]] == [r["feature"] for r in stored[u]] for u in sample),
+            "max_abs_diff": float(max_diff)
+        }
+
+
+def print_recommendations(result: dict):
+    print("\n" + "=" * 60)
+    print("📊 PRECOMPUTED RECOMMENDATIONS")
+    print("=" * 60)
+    print(f"  • Users: {result['rows']:,}, timed lookups: {result['queries']}")
+    print(f"  • Computed per request: {result['live_ms']:.3f} ms/user")
+    print(f"  • Batch job: {result['batch_s']:.2f} s for every user, published in {result['publish_s']:.2f} s "
+          f"({result['store_mb']:.2f} MB)")
+    print(f"  • Lookup: {result['lookup_us']:.1f} µs/user, {result['live_ms'] * 1000 / result['lookup_us']:.0f}x faster")
+    print(f"  • Same features as computed per request: {result['same_features']}, "
+          f"max score difference (float32): {result['max_abs_diff']:.2e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Carbon Hero backend")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    loader_parser = subparsers.add_parser("loader", help="Load and preprocess a synthetic copy of the dataset")
+    loader_parser.add_argument("--rows", type=int, default=1_000_000)
+    loader_parser.add_argument("--skip-legacy", action="store_true", help="Do not time the previous loading path")
+
+    predict_parser = subparsers.add_parser("predict", help="Single-row vs batch emission predictions")
+    predict_parser.add_argument("--rows", type=int, default=10_000)
+    predict_parser.add_argument("--single-calls", type=int, default=500)
+
+    similarity_parser = subparsers.add_parser("similarity", help="Dense vs sparse one-hot user similarity")
+    similarity_parser.add_argument("--rows", type=int, default=10_000, help="Users, resampled from the dataset")
+    similarity_parser.add_argument("--skip-full", action="store_true", help="Do not compute the n x n matrix")
+    similarity_parser.add_argument("--queries", type=int, default=200, help="Similarity rows to time")
+
+    recommendations_parser = subparsers.add_parser("recommendations",
+                                                   help="Per-request vs precomputed feature recommendations")
+    recommendations_parser.add_argument("--rows", type=int, default=10_000, help="Users, resampled from the dataset")
+    recommendations_parser.add_argument("--queries", type=int, default=500, help="Users to look up")
+
+    args = parser.parse_args()
+    if args.command == "loader":
+        print_loader(bench_loader(args))
+    elif args.command == "predict":
+        print_predict(bench_predict(args))
+    elif args.command == "similarity":
+        print_similarity(bench_similarity(args))
+    elif args.command == "recommendations":
+        print_recommendations(bench_recommendations(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import itertools
+import threading
+
+from app.services.footprint_writer import FootprintHistoryWriter
+
+
+class FakeDocument:
+    def __init__(self, db, doc_id):
+        self.db = db
+        self.id = doc_id
+
+    def set(self, record):
+        self.db.rows[self.id] = record
+        self.db.order.append(record["n"])
+
+
+class FakeCollection:
+    def __init__(self, db):
+        self.db = db
+
+    def document(self, doc_id=None):
+        return FakeDocument(self.db, doc_id if doc_id is not None else f"auto-{next(self.db.ids)}")
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, doc, record):
+        self.writes.append((doc.id, record))
+
+    def commit(self):
+        self.db.gate.wait(10)
+        for doc_id, record in self.writes:
+            self.db.rows[doc_id] = record
+            self.db.order.append(record["n"])
+        if self.db.lost_responses:
+            # The write landed but the client never heard back
+            self.db.lost_responses -= 1
+            raise RuntimeError("deadline exceeded")
+
+
+class FakeDB:
+    def __init__(self, lost_responses=0):
+        self.ids = itertools.count()
+        self.rows = {}
+        self.order = []
+        self.lost_responses = lost_responses
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def collection(self, name):
+        return FakeCollection(self)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def test_rows_are_committed_in_queue_order():
+    db = FakeDB()
+    writer = FootprintHistoryWriter(db, batch_size=7, flush_interval=0.01, max_queue=1000)
+    writer.start()
+    for n in range(100):
+        writer.enqueue({"n": n})
+    writer.stop()
+    assert db.order == list(range(100))
+    assert writer.stats()["written"] == 100
+
+
+def test_queue_is_bounded_while_firestore_lags():
+    db = FakeDB()
+    db.gate.clear()  # Every commit blocks until the gate opens
+    writer = FootprintHistoryWriter(db, batch_size=5, flush_interval=0.01, max_queue=10)
+    writer.start()
+    for n in range(50):
+        writer.enqueue({"n": n})
+    stats = writer.stats()
+    assert stats["queued"] <= 10
+    assert stats["dropped"] > 0
+    assert stats["enqueued"] + stats["dropped"] == 50
+    assert writer.is_full()
+
+    db.gate.set()
+    writer.stop()
+    # What was accepted is written, oldest first
+    assert db.order == sorted(db.order)
+    assert len(db.order) == writer.stats()["enqueued"]
+
+
+def test_retried_batch_does_not_duplicate_rows():
+    db = FakeDB(lost_responses=2)
+    writer = FootprintHistoryWriter(db, batch_size=50, flush_interval=0.01)
+    writer._commit_with_retry([(f"id-{n}", {"n": n}) for n in range(10)])
+    assert len(db.rows) == 10
+    assert writer.stats()["failed_commits"] == 2
+
+
+def test_enqueue_without_flusher_writes_synchronously():
+    db = FakeDB()
+    writer = FootprintHistoryWriter(db)
+    writer.enqueue({"n": 1})
+    assert db.order == [1]
+    assert writer.stats()["sync_fallbacks"] == 1
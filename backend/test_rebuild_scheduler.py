@@ -0,0 +1,49 @@
+import time
+
+from app.services.rebuild_scheduler import RebuildScheduler
+
+
+def test_burst_of_writes_is_coalesced_into_one_rebuild():
+    calls = []
+    scheduler = RebuildScheduler(lambda: calls.append(time.monotonic()), min_interval=0.0,
+                                 quiet_period=0.05, max_staleness=5.0)
+    scheduler.start()
+    try:
+        for _ in range(50):
+            scheduler.mark_dirty()
+        deadline = time.monotonic() + 5
+        while not calls and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.2)
+        assert len(calls) == 1
+        assert scheduler.stats()["coalesced_marks"] == 49
+        assert not scheduler.stats()["dirty"]
+    finally:
+        scheduler.stop()
+
+
+def test_force_waits_for_a_rebuild_that_includes_earlier_writes():
+    calls = []
+    scheduler = RebuildScheduler(lambda: calls.append(1) or len(calls), min_interval=60.0,
+                                 quiet_period=60.0, max_staleness=60.0)
+    scheduler.start()
+    try:
+        scheduler.mark_dirty()
+        stats = scheduler.force(wait=True, timeout=5)
+        assert calls == [1]
+        assert stats["forced_rebuilds"] == 1
+        assert stats["last_result"] == 1
+    finally:
+        scheduler.stop()
+
+
+def test_failed_rebuild_stays_dirty():
+    def failing():
+        raise RuntimeError("firestore unavailable")
+
+    scheduler = RebuildScheduler(failing)
+    scheduler.mark_dirty()  # Not started: runs in the caller
+    stats = scheduler.stats()
+    assert stats["failed_rebuilds"] == 1
+    assert stats["last_error"] == "firestore unavailable"
+    assert stats["dirty"]
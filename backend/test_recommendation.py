@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+from app.ml.feature_schema import FEATURE_SCHEMA
+from app.services.recommendation import (
+    CATEGORICAL_COLUMNS, NUMERICAL_COLUMNS, INTERACTION_COMPLETED, INTERACTION_STARTED, RecommendationEngine
+)
+
+VEGAN = {"diet_type": "Vegan", "transportation_mode": "Walk", "heating_source": "Electric", "shower_frequency": "Daily"}
+OMNIVORE = {"diet_type": "Omnivore", "transportation_mode": "Private car", "heating_source": "Coal",
+            "shower_frequency": "Twice a day"}
+CHALLENGES = [
+    {"id": f"c{i}", "difficulty": "easy", "category": "diet", "carbon_savings": 1.0, "duration_days": 7}
+    for i in range(4)
+]
+
+
+def make_engine():
+    records = [FEATURE_SCHEMA.ensure(profile).dataset_record for profile in (VEGAN, OMNIVORE, VEGAN, OMNIVORE)]
+    engine = RecommendationEngine()
+    engine.load_data(pd.DataFrame(records, columns=CATEGORICAL_COLUMNS + NUMERICAL_COLUMNS), CHALLENGES)
+    return engine
+
+
+def test_neighbours_interactions_are_recommended():
+    engine = make_engine()
+    engine.upsert_member({"userId": "vegan", **VEGAN})
+    engine.upsert_member({"userId": "driver", **OMNIVORE})
+    engine.record_interaction("vegan", "c1", INTERACTION_COMPLETED)
+    engine.record_interaction("driver", "c2", INTERACTION_COMPLETED)
+
+    recommendations = engine.get_challenge_recommendations({"userId": "new", **VEGAN})
+    assert recommendations[0]["challenge_id"] == "c1"
+    assert recommendations[0]["score"] > 0
+
+
+def test_completed_challenges_are_not_recommended_again():
+    engine = make_engine()
+    engine.upsert_member({"userId": "a", **VEGAN})
+    engine.upsert_member({"userId": "b", **VEGAN})
+    engine.record_interaction("a", "c1", INTERACTION_COMPLETED)
+    engine.record_interaction("b", "c1", INTERACTION_COMPLETED)
+    engine.record_interaction("b", "c3", INTERACTION_COMPLETED)
+
+    ids = [rec["challenge_id"] for rec in engine.recommend_challenges("a", [])]
+    assert "c1" not in ids
+    assert ids[0] == "c3"
+
+
+def test_users_with_interactions_but_no_profile_vector():
+    engine = make_engine()
+    engine.upsert_member({"userId": "member", **VEGAN})
+    engine.record_interaction("member", "c1", INTERACTION_COMPLETED)
+    # Challenge starts for users whose profile was never loaded into the engine
+    for i in range(20):
+        engine.record_interaction(f"x{i}", "c2", INTERACTION_STARTED)
+    engine.record_interaction("x19", "c3", INTERACTION_COMPLETED)
+
+    ids = [rec["challenge_id"] for rec in engine.get_challenge_recommendations({"userId": "x19", **VEGAN})]
+    assert ids[0] == "c1"
+    assert "c3" not in ids
+    with pytest.raises(ValueError):
+        engine.recommend_challenges("x19", [])
+
+
+def test_catalog_change_keeps_interactions_of_remaining_challenges():
+    engine = make_engine()
+    engine.upsert_member({"userId": "a", **VEGAN})
+    engine.record_interaction("a", "c2", INTERACTION_COMPLETED)
+    engine.load_challenges([c for c in CHALLENGES if c["id"] != "c1"])
+
+    recommendations = engine.get_challenge_recommendations({"userId": "new", **VEGAN})
+    assert recommendations[0]["challenge_id"] == "c2"
+    assert all(rec["challenge_id"] != "c1" for rec in recommendations)
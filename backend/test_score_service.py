@@ -0,0 +1,123 @@
+import itertools
+
+from app.services.score_service import ScoreService
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+def _apply(old, fields):
+    new = dict(old or {})
+    for key, value in fields.items():
+        # firestore.Increment carries its operand in .value
+        new[key] = new.get(key, 0) + value.value if hasattr(value, "value") else value
+    return new
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        return FakeCollection(self.db, self.path[:-1])
+
+    def collection(self, name):
+        return FakeCollection(self.db, self.path + (name,))
+
+    def get(self):
+        return FakeSnapshot(self, self.db.docs.get(self.path))
+
+
+class FakeCollection:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+
+    @property
+    def parent(self):
+        return FakeDocument(self.db, self.path[:-1])
+
+    def document(self, doc_id=None):
+        return FakeDocument(self.db, self.path + (doc_id or f"auto-{next(self.db.ids)}",))
+
+    def stream(self):
+        return [FakeSnapshot(FakeDocument(self.db, path), data) for path, data in sorted(self.db.docs.items())
+                if path[:-1] == self.path]
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, doc, fields, merge=False):
+        self.writes.append((doc.path, fields, merge))
+
+    def update(self, doc, fields):
+        self.writes.append((doc.path, fields, True))
+
+    def commit(self):
+        for path, fields, merge in self.writes:
+            self.db.docs[path] = _apply(self.db.docs.get(path) if merge else None, fields)
+            self.db.written.append(path)
+
+
+class FakeDB:
+    def __init__(self):
+        self.ids = itertools.count()
+        self.docs = {}
+        self.written = []
+
+    def collection(self, name):
+        return FakeCollection(self, (name,))
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def collection_group(self, name):
+        return FakeGroup(self, name)
+
+
+class FakeGroup:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def stream(self):
+        return [FakeSnapshot(FakeDocument(self.db, path), data) for path, data in sorted(self.db.docs.items())
+                if len(path) > 1 and path[-2] == self.name]
+
+
+def test_award_increments_the_user_document():
+    db = FakeDB()
+    db.docs[("user_data", "u1")] = {"total_score": 10}
+    service = ScoreService(db)
+    assert service.award("u1", "No Car Day", 25) == 35
+    assert db.docs[("user_data", "u1")]["last_challenge_completed"] == "No Car Day"
+
+
+def test_sharded_award_never_writes_the_user_document():
+    db = FakeDB()
+    db.docs[("user_data", "hot")] = {"total_score": 10}
+    service = ScoreService(db, num_shards=4, sharded_users=["hot"])
+    totals = [service.award("hot", "No Car Day", 5) for _ in range(20)]
+
+    assert ("user_data", "hot") not in db.written
+    assert db.docs[("user_data", "hot")] == {"total_score": 10}
+    assert totals[-1] == 110
+    assert service.read_total("hot") == 110
+    assert service.shard_totals() == {"hot": 100}
+    assert len([path for path in db.docs if path[:3] == ("user_data", "hot", "score_shards")]) <= 4
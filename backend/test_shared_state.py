@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+
+from app.services.shared_state import SharedArrayStore
+
+
+def test_attach_before_anything_is_published(tmp_path):
+    store = SharedArrayStore("empty", tmp_path)
+    assert store.generation() == 0
+    assert store.attach() is None
+    assert store.refresh(None) is None
+
+
+def test_publish_swaps_generations_without_touching_held_snapshots(tmp_path):
+    store = SharedArrayStore("similarity", tmp_path)
+    assert store.publish({"values": np.arange(4)}, {"users": ["a", "b", "c", "d"]}) == 1
+    first = store.attach()
+    assert first.generation == 1
+    assert first.meta == {"users": ["a", "b", "c", "d"]}
+    assert store.refresh(first) is None
+
+    store.publish({"values": np.arange(4) * 10}, {"users": ["a", "b", "c", "d"]})
+    second = store.refresh(first)
+    assert second.generation == 2
+    assert second.arrays["values"].tolist() == [0, 10, 20, 30]
+    # A reader still holding generation 1 keeps seeing it
+    assert first.arrays["values"].tolist() == [0, 1, 2, 3]
+    assert not second.arrays["values"].flags.writeable
+
+
+def test_old_generations_are_pruned(tmp_path):
+    store = SharedArrayStore("pruned", tmp_path, keep_generations=2)
+    held = None
+    for generation in range(1, 5):
+        store.publish({"values": np.full(3, generation)}, {})
+        if generation == 1:
+            held = store.attach()
+    assert sorted(path.name for path in store.directory.glob("gen-*")) == ["gen-000003", "gen-000004"]
+    # Mapped arrays stay readable after their directory is removed
+    assert held.arrays["values"].tolist() == [1, 1, 1]
+
+
+def test_rebuild_reuses_a_fresh_generation(tmp_path):
+    store = SharedArrayStore("reuse", tmp_path)
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {"values": np.zeros(2)}, {}
+
+    assert store.rebuild(build, wait=True) == 1
+    assert store.rebuild(build, wait=True, max_age=60) == 1
+    assert len(builds) == 1
+    assert store.rebuild(build, wait=True) == 2
+
+
+def test_rebuild_requested_during_a_build_runs_again(tmp_path):
+    store = SharedArrayStore("requests", tmp_path)
+    started = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def slow_build():
+        builds.append(1)
+        if len(builds) == 1:
+            started.set()
+            release.wait(10)
+        return {"values": np.full(2, len(builds))}, {}
+
+    builder = threading.Thread(target=store.rebuild, args=(slow_build,), kwargs={"wait": True})
+    builder.start()
+    started.wait(10)
+    # Another writer finds the lock taken: it leaves a request and returns at once
+    assert store.rebuild(slow_build, wait=False) is None
+    assert store.skipped_builds == 1
+    release.set()
+    builder.join(10)
+
+    assert len(builds) == 2
+    assert store.attach().arrays["values"].tolist() == [2, 2]
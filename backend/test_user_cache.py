@@ -0,0 +1,112 @@
+from app.services.user_cache import UserDataCache
+
+
+class FakeSnapshot:
+    def __init__(self, data):
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, db, doc_id):
+        self.db = db
+        self.doc_id = doc_id
+
+    def get(self):
+        self.db.reads += 1
+        data = self.db.docs.get(self.doc_id)
+        if self.db.during_read is not None:
+            # Something else writes while this read is in flight
+            callback, self.db.during_read = self.db.during_read, None
+            callback()
+        return FakeSnapshot(data)
+
+
+class FakeCollection:
+    def __init__(self, db):
+        self.db = db
+
+    def document(self, doc_id):
+        return FakeDocument(self.db, doc_id)
+
+
+class FakeDB:
+    def __init__(self, docs=None):
+        self.docs = dict(docs or {})
+        self.reads = 0
+        self.during_read = None
+
+    def collection(self, name):
+        return FakeCollection(self)
+
+
+def test_hits_are_served_without_firestore_reads():
+    db = FakeDB({"u1": {"total_score": 5}})
+    cache = UserDataCache(db)
+    assert cache.get("u1") == {"total_score": 5}
+    assert cache.get("u1") == {"total_score": 5}
+    assert db.reads == 1
+
+
+def test_invalidate_forces_a_fresh_read():
+    db = FakeDB({"u1": {"total_score": 5}})
+    cache = UserDataCache(db)
+    cache.get("u1")
+    db.docs["u1"] = {"total_score": 9}
+    cache.invalidate("u1")
+    assert cache.get("u1") == {"total_score": 9}
+    assert db.reads == 2
+
+
+def test_write_during_a_read_is_not_overwritten_by_the_stale_result():
+    db = FakeDB({"u1": {"total_score": 5}})
+    cache = UserDataCache(db)
+    db.during_read = lambda: cache.set("u1", {"total_score": 6})
+    # The in-flight read returns the old document, but the write that raced it wins
+    assert cache.get("u1") == {"total_score": 5}
+    assert cache.get("u1") == {"total_score": 6}
+    assert db.reads == 1
+
+
+def test_invalidate_during_a_read_drops_its_result():
+    db = FakeDB({"u1": {"total_score": 5}})
+    cache = UserDataCache(db)
+    db.during_read = lambda: cache.invalidate("u1")
+    cache.get("u1")
+    cache.get("u1")
+    assert db.reads == 2
+
+
+def test_missing_documents_are_remembered_only_briefly():
+    db = FakeDB()
+    cache = UserDataCache(db, negative_ttl_seconds=0)
+    assert cache.get("new") is None
+    db.docs["new"] = {"total_score": 0}
+    assert cache.get("new") == {"total_score": 0}
+
+
+def test_returned_documents_are_copies():
+    db = FakeDB({"u1": {"total_score": 5}})
+    cache = UserDataCache(db)
+    cache.get("u1")["total_score"] = 100
+    assert cache.get("u1") == {"total_score": 5}
+
+
+def test_least_recently_used_entries_are_evicted():
+    db = FakeDB({f"u{i}": {"i": i} for i in range(3)})
+    cache = UserDataCache(db, max_entries=2)
+    cache.get("u0")
+    cache.get("u1")
+    cache.get("u0")
+    cache.get("u2")  # Evicts u1, the least recently used
+    reads = db.reads
+    cache.get("u0")
+    assert db.reads == reads
+    cache.get("u1")
+    assert db.reads == reads + 1
@@ -0,0 +1,104 @@
+import requests
+import time
+import statistics
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Logging setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+CHALLENGE_TITLES = [
+    "Meatless Monday", "Public Transport Week", "Power Down Hour",
+    "Recycling Master", "Water Conservation", "No Car Day"
+]
+
+class ChallengeCompletionLoadTester:
+    def __init__(self, base_url="http://localhost:8000", user_id="load_test_user"):
+        self.base_url = base_url
+        self.user_id = user_id
+
+    def ensure_user(self):
+        """Create the load test user if it does not exist yet"""
+        requests.post(f"{self.base_url}/api/user-data", json={
+            "userId": self.user_id,
+            "diet_type": "Omnivore",
+            "transportation_mode": "Private car",
+            "vehicle_type": "Petrol",
+            "heating_source": "Natural gas",
+            "home_energy_efficiency": "No",
+            "shower_frequency": "Daily",
+            "screen_time": "4-8 hours",
+            "internet_usage": "4-8 hours",
+            "clothes_purchases": "11-20",
+            "recycling": "Paper",
+            "trash_bag_size": "Medium"
+        }, timeout=30)
+
+    def get_score(self):
+        # Read from Firestore: /user-stats serves the handling worker's cache, which only
+        # mirrors the increments that worker applied itself
+        response = requests.get(f"{self.base_url}/api/score/{self.user_id}", timeout=10)
+        response.raise_for_status()
+        return response.json().get("total_score", 0)
+
+    def complete_one(self, i):
+        title = CHALLENGE_TITLES[i % len(CHALLENGE_TITLES)]
+        start_time = time.time()
+        response = requests.post(
+            f"{self.base_url}/api/challenges/{self.user_id}/complete/{title}", timeout=30
+        )
+        elapsed = (time.time() - start_time) * 1000
+        points = response.json().get("points_earned", 0) if response.status_code == 200 else 0
+        return response.status_code, elapsed, points
+
+    def run(self, requests_total=500, concurrency=20):
+        self.ensure_user()
+        score_before = self.get_score()
+
+        logger.info(f"🚀 Completing {requests_total} challenges with {concurrency} concurrent clients...")
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(self.complete_one, range(requests_total)))
+        wall_time = time.time() - start_time
+
+        latencies = [r[1] for r in results if r[0] == 200]
+        errors = sum(1 for r in results if r[0] != 200)
+        expected_points = sum(r[2] for r in results)
+        score_after = self.get_score()
+
+        return {
+            "throughput_rps": len(results) / wall_time,
+            "p50_ms": statistics.median(latencies) if latencies else 0.0,
+            "p95_ms": sorted(latencies)[int(len(latencies) * 0.95) - 1] if latencies else 0.0,
+            "errors": errors,
+            "expected_points": expected_points,
+            "observed_points": score_after - score_before
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent challenge completion load test")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--user-id", default="load_test_user")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    tester = ChallengeCompletionLoadTester(args.base_url, args.user_id)
+    result = tester.run(args.requests, args.concurrency)
+
+    print("\n" + "=" * 60)
+    print("📊 CHALLENGE COMPLETION LOAD TEST")
+    print("=" * 60)
+    print(f"  • Throughput: {result['throughput_rps']:.1f} completions/s")
+    print(f"  • Latency p50: {result['p50_ms']:.1f} ms, p95: {result['p95_ms']:.1f} ms")
+    print(f"  • Errors: {result['errors']}")
+    print(f"  • Points awarded: {result['expected_points']}, score increased by: {result['observed_points']}")
+    if result["expected_points"] == result["observed_points"]:
+        print("\n✅ No lost score updates")
+    else:
+        print("\n❌ Score mismatch (lost score updates)")
+
+if __name__ == "__main__":
+    main()